@@ -22,12 +22,14 @@ tests_packages = [
     "pytest-icdiff",
     "pytest-mock",
     "freezegun",
+    "fakeredis",
     "opentelemetry-sdk",
     "sentry-sdk",
 ]
 mypy_packages = [
     "pytest",
     "pytest-mock",
+    "fakeredis",
     "types-freezegun",
     "mypy-typing-asserts",
 ]
@@ -41,7 +43,7 @@ def all_extras(session: Session) -> str:
 @nox.parametrize("sqlalchemy", ["1.4.52", "2.0.29"])
 def tests(session: Session, sqlalchemy: str) -> None:
     args = session.posargs
-    session.install(".[worker-manager,structlog]", *tests_packages)
+    session.install(".[worker-manager,structlog,arq,arq-codecs]", *tests_packages)
     session._session.install(f"sqlalchemy=={sqlalchemy}")
     session.run(
         "pytest",
@@ -62,7 +64,7 @@ def example_tests(session: Session) -> None:
 def tests_worker(session: Session) -> None:
     """Worker tests must pass without installing the worker-manager extra."""
     args = session.posargs
-    session.install(".", *tests_packages)
+    session.install(".[arq,arq-codecs]", *tests_packages)
     session.run("pytest", "tests/worker", *args)
 
 
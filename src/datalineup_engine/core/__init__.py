@@ -4,6 +4,7 @@ from .pipeline import PipelineResult
 from .pipeline import PipelineResults
 from .pipeline import QueuePipeline
 from .pipeline import ResourceUsed
+from .resource import KeyedResource
 from .resource import Resource
 from .topic import TopicMessage
 from .types import Cursor
@@ -11,6 +12,7 @@ from .types import JobId
 from .types import MessageId
 
 __all__ = [
+    "KeyedResource",
     "PipelineInfo",
     "PipelineOutput",
     "PipelineResult",
@@ -16,6 +16,9 @@ from .resource import Resource
 from .topic import TopicMessage
 
 T = TypeVar("T", bound=Hashable)
+CallableT = TypeVar("CallableT", bound=Callable)
+
+SETUPS_ATTRIBUTE: t.Final[str] = "__datalineup_setups__"
 
 
 class CancellationToken:
@@ -40,6 +43,56 @@ class CancellationToken:
             self._cancel()
 
 
+@dataclasses.dataclass(frozen=True)
+class PipelineSetup:
+    """Per-process setup of a pipeline state, like a model or a client.
+
+    `setup` is called once per executor process, before the first message of a
+    pipeline using it. Its result is passed to the pipeline arguments
+    annotated with the setup return type, and `teardown` is called with it
+    when the executor closes.
+    """
+
+    setup: Callable[[], Any]
+    teardown: t.Optional[Callable[[Any], None]] = None
+
+    @property
+    def state_type(self) -> t.Optional[type]:
+        try:
+            state_type = t.get_type_hints(self.setup).get("return")
+        except Exception:
+            return None
+        return state_type if isinstance(state_type, type) else None
+
+    @staticmethod
+    def of(pipeline: Callable) -> tuple["PipelineSetup", ...]:
+        return getattr(pipeline, SETUPS_ATTRIBUTE, ())
+
+
+def with_setup(
+    setup: Callable[[], Any], *, teardown: t.Optional[Callable[[Any], None]] = None
+) -> Callable[[CallableT], CallableT]:
+    """Register a per-process setup for the decorated pipeline.
+
+    ```
+    def load_model() -> Model: ...
+
+    @with_setup(load_model, teardown=Model.close)
+    def predict(model: Model, text: str) -> ...
+    ```
+    """
+
+    def decorator(pipeline: CallableT) -> CallableT:
+        setattr(
+            pipeline,
+            SETUPS_ATTRIBUTE,
+            (PipelineSetup(setup, teardown),) + PipelineSetup.of(pipeline),
+        )
+        return pipeline
+
+    return decorator
+
+
 @dataclasses.dataclass
 class PipelineInfo:
     name: str
@@ -65,7 +118,7 @@ class PipelineInfo:
             if isinstance(parameter.annotation, type) and issubclass(
                 parameter.annotation, Resource
             ):
-                resources[parameter.name] = parameter.annotation._typename()
+                resources[parameter.name] = parameter.annotation._declared_type()
         return resources
 
 
@@ -86,6 +139,8 @@ class ResourceUsed:
     type: str
     release_at: t.Optional[float] = None
     state: t.Optional[dict[str, object]] = None
+    # Set when the resource itself failed the pipeline, such as a banned proxy.
+    failed: bool = False
 
     @classmethod
     def from_resource(
@@ -93,9 +148,15 @@ class ResourceUsed:
         resource: Resource,
         *,
         release_at: t.Optional[float] = None,
-        state: t.Optional[dict[str, object]] = None
+        state: t.Optional[dict[str, object]] = None,
+        failed: bool = False
     ) -> "ResourceUsed":
-        return cls(type=resource._typename(), release_at=release_at, state=state)
+        return cls(
+            type=resource._resource_type(),
+            release_at=release_at,
+            state=state,
+            failed=failed,
+        )
 
 
 class PipelineEvent:
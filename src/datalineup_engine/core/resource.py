@@ -1,10 +1,21 @@
+import typing as t
 from typing import ClassVar
 from typing import Optional
 
 import dataclasses
+import re
+from urllib.parse import urlsplit
 
 from datalineup_engine.utils import inspect
 
+# A keyed resource type, as declared by a pipeline: `type[arg]`, or
+# `type[arg:host]` to key the resource by the host of the URL in `arg`.
+KEYED_TYPE_RE: t.Final[re.Pattern] = re.compile(
+    r"^(?P<type>.+)\[(?P<arg>[^\[\]:]+)(?::(?P<part>host))?\]$"
+)
+# Separates the keyed resource type from the key in the acquired type.
+KEY_SEPARATOR: t.Final[str] = "/"
+
 
 @dataclasses.dataclass(eq=False)
 class Resource:
@@ -14,3 +25,61 @@ class Resource:
     @classmethod
     def _typename(cls) -> str:
         return cls.typename or inspect.get_import_name(cls)
+
+    @classmethod
+    def _declared_type(cls) -> str:
+        return cls._typename()
+
+    def _resource_type(self) -> str:
+        return self._typename()
+
+
+@dataclasses.dataclass(eq=False)
+class KeyedResource(Resource):
+    """Resource pooled by a key taken from the message arguments.
+
+    Each key gets its own pool of resources, created on demand by the
+    worker `KeyedResourcesProvider`. For example, to crawl each host with
+    its own concurrency and rate limits::
+
+        class Host(KeyedResource):
+            key_arg = "url"
+            key_host = True
+
+        async def crawl(url: str, host: Host) -> ...
+    """
+
+    key: str = ""
+    # Message argument the key is taken from.
+    key_arg: ClassVar[str] = ""
+    # Use the host of the URL in `key_arg` as the key.
+    key_host: ClassVar[bool] = False
+
+    @classmethod
+    def _declared_type(cls) -> str:
+        part = ":host" if cls.key_host else ""
+        return f"{cls._typename()}[{cls.key_arg}{part}]"
+
+    def _resource_type(self) -> str:
+        return f"{self._typename()}{KEY_SEPARATOR}{self.key}"
+
+
+def keyed_resource_type(declared_type: str, args: dict[str, t.Any]) -> str:
+    """Return the resource type to acquire for a declared type and message
+    arguments: the keyed resource type with its key, or the declared type."""
+    match = KEYED_TYPE_RE.match(declared_type)
+    if not match:
+        return declared_type
+    value = args.get(match["arg"])
+    if match["part"] == "host":
+        value = urlsplit(str(value or "")).hostname
+    # Messages without a key share the same pool.
+    key = "" if value is None else str(value)
+    return f"{match['type']}{KEY_SEPARATOR}{key}"
+
+
+def declared_base_type(declared_type: str) -> str:
+    """Return the resource type providing a declared type, without its key."""
+    if match := KEYED_TYPE_RE.match(declared_type):
+        return match["type"]
+    return declared_type
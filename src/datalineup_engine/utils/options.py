@@ -2,16 +2,25 @@ import typing as t
 
 import dataclasses
 import json
+import types
 from abc import abstractmethod
 
 import pydantic.v1
+import pydantic.v1.fields
 import pydantic.v1.json
+import pydantic.v1.utils
+import pydantic.v1.validators
 
 from .cache import threadsafe_cache
 
 OptionsSchemaT = t.TypeVar("OptionsSchemaT", bound="OptionsSchema")
 T = t.TypeVar("T")
 
+ValueCheck = t.Callable[[t.Any], bool]
+
+# Types validated by their exact type: pydantic returns such values unchanged.
+EXACT_TYPES: t.Final = (str, bytes, bool, int, float)
+
 
 class OptionsSchema:
     @dataclasses.dataclass
@@ -61,3 +70,103 @@ def fromdict(
     if dataclasses.is_dataclass(klass):
         return t.cast(T, klass(**obj.dict()))
     return t.cast(T, obj)
+
+
+def passthrough_check(typ: t.Any) -> t.Optional[ValueCheck]:
+    """Return a check for the values pydantic validates unchanged as `typ`.
+
+    Returns None when `typ` always needs a full validation, like dataclasses,
+    models, containers or constrained types.
+    """
+    if typ is t.Any or typ is object:
+        return lambda v: not isinstance(v, pydantic.v1.BaseModel)
+
+    origin = t.get_origin(typ)
+    if origin is t.Annotated:
+        inner, *metadata = t.get_args(typ)
+        if any(isinstance(m, pydantic.v1.fields.FieldInfo) for m in metadata):
+            return None
+        return passthrough_check(inner)
+    if origin is t.Union or origin is types.UnionType:
+        checks = [
+            passthrough_check(arg) for arg in t.get_args(typ) if arg is not type(None)
+        ]
+        if len(checks) != 1 or not (check := checks[0]):
+            return None
+        return lambda v: v is None or check(v)
+
+    if typ in EXACT_TYPES:
+        return lambda v: type(v) is typ
+    if (
+        not isinstance(typ, type)
+        or dataclasses.is_dataclass(typ)
+        or issubclass(typ, pydantic.v1.BaseModel)
+        or hasattr(typ, "__get_validators__")
+        or any(issubclass(typ, base) for base, _ in pydantic.v1.validators._VALIDATORS)
+    ):
+        return None
+    # Arbitrary types are only checked with isinstance.
+    return lambda v: isinstance(v, typ)
+
+
+def instance_type(typ: t.Any) -> t.Optional[type]:
+    """Return the class instances of `typ` are, ignoring Optional and Annotated."""
+    origin = t.get_origin(typ)
+    if origin is t.Annotated:
+        return instance_type(t.get_args(typ)[0])
+    if origin is t.Union or origin is types.UnionType:
+        args = [arg for arg in t.get_args(typ) if arg is not type(None)]
+        return instance_type(args[0]) if len(args) == 1 else None
+    return typ if isinstance(typ, type) else None
+
+
+@threadsafe_cache
+def compile_fromdict(
+    klass: t.Type[T],
+) -> t.Callable[[dict[str, t.Any], dict[str, t.Any]], T]:
+    """Compile `fromdict` for a dataclass.
+
+    The compiled function takes the dict to validate and a dict of trusted
+    values, like objects built by the engine, that are only checked to be
+    instances of their field type. When all the values would go through
+    validation unchanged, the dataclass is built directly from the dicts.
+    Otherwise both dicts are validated with `fromdict`.
+    """
+
+    def validate(d: dict[str, t.Any], trusted: dict[str, t.Any]) -> T:
+        return fromdict(d | trusted, klass)
+
+    if not dataclasses.is_dataclass(klass):
+        return validate
+
+    fields: list[tuple[str, t.Optional[ValueCheck], t.Optional[type]]] = []
+    defaults: dict[str, t.Any] = {}
+    for field in dataclasses.fields(klass):
+        if field.default_factory is not dataclasses.MISSING:
+            return validate
+        if field.default is not dataclasses.MISSING:
+            defaults[field.name] = field.default
+        fields.append(
+            (field.name, passthrough_check(field.type), instance_type(field.type))
+        )
+
+    def bind(d: dict[str, t.Any], trusted: dict[str, t.Any]) -> T:
+        values = {}
+        for name, check, cls in fields:
+            if name in trusted:
+                value = trusted[name]
+                if cls is None or not isinstance(value, cls):
+                    return validate(d, trusted)
+            elif name in d:
+                value = d[name]
+                if check is None or not check(value):
+                    return validate(d, trusted)
+            elif name in defaults:
+                # pydantic copies defaults.
+                value = pydantic.v1.utils.smart_deepcopy(defaults[name])
+            else:
+                return validate(d, trusted)
+            values[name] = value
+        return klass(**values)
+
+    return bind
@@ -43,9 +43,11 @@ def build_executor(
     return executor
 
 
+from .async_executor import AsyncExecutor
 from .process import ProcessExecutor
 
 BUILTINS: dict[str, Type[Executor]] = {
+    "AsyncExecutor": AsyncExecutor,
     "ProcessExecutor": ProcessExecutor,
 }
 
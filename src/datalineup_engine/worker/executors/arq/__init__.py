@@ -5,9 +5,13 @@ EXECUTE_FUNC_NAME = "remote_execute"
 healthcheck_interval = 10
 
 
-def worker_healthcheck_key(job_id: str) -> str:
-    return f"datalineup:arq:{job_id}:whealthcheck"
+def worker_healthcheck_key(worker_id: str) -> str:
+    return f"datalineup:arq:{worker_id}:whealthcheck"
 
 
-def executor_healthcheck_key(job_id: str) -> str:
-    return f"datalineup:arq:{job_id}:ehealthcheck"
+def executor_healthcheck_key(executor_id: str) -> str:
+    return f"datalineup:arq:{executor_id}:ehealthcheck"
+
+
+def results_key(worker_id: str) -> str:
+    return f"datalineup:arq:{worker_id}:results"
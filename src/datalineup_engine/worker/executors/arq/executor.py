@@ -2,13 +2,16 @@ import typing as t
 
 import asyncio
 import dataclasses
-import pickle  # noqa: S403
+import secrets
+from uuid import uuid4
 
 import redis.exceptions
 from arq.connections import ArqRedis
 from arq.connections import RedisSettings
-from arq.jobs import Job
-from arq.jobs import JobStatus
+from arq.constants import in_progress_key_prefix
+from arq.constants import job_key_prefix
+from arq.jobs import serialize_job
+from arq.utils import timestamp_ms
 from opentelemetry.metrics import get_meter
 from redis.asyncio import BlockingConnectionPool
 from redis.asyncio import ConnectionPool
@@ -29,7 +32,12 @@ from . import TIMEOUT
 from . import TIMEOUT_DELAY
 from . import executor_healthcheck_key
 from . import healthcheck_interval
+from . import results_key
 from . import worker_healthcheck_key
+from .serializer import Compression
+from .serializer import Serializer
+from .serializer import SerializerFormat
+from .serializer import loads
 
 ARQ_EXECUTOR_NAMESPACE: t.Final[str] = "arq_executor"
 
@@ -38,7 +46,33 @@ class WorkerDiedError(Exception):
     pass
 
 
+@dataclasses.dataclass(eq=False)
+class MonitoredJob:
+    job_id: str
+    started: bool = False
+    misses: int = 0
+    died: asyncio.Event = dataclasses.field(default_factory=asyncio.Event)
+
+
+@dataclasses.dataclass(eq=False)
+class PendingJob:
+    job_id: str
+    job: bytes
+    queue_name: str
+    score: int
+    expires_ms: int
+    enqueued: asyncio.Future[None]
+
+
 class ARQExecutor(Executor):
+    """Execute pipelines on ARQ workers through Redis.
+
+    Jobs carry the executor `worker_id`, `results_key` and `serializer`, and
+    are framed by the serializer. ARQ workers of older versions reject them,
+    so ARQ workers must be upgraded before the executors using them. Upgraded
+    workers still run the jobs of older executors.
+    """
+
     @dataclasses.dataclass
     class Options:
         redis_url: str
@@ -49,11 +83,32 @@ class ARQExecutor(Executor):
         queue_name: str = "arq:queue"
         timeout: int = TIMEOUT
         timeout_delay: int = TIMEOUT_DELAY
+        serializer: SerializerFormat = SerializerFormat.PICKLE
+        compression: t.Optional[Compression] = None
+        compression_threshold: int = 4096
 
     def __init__(self, options: Options, services: Services) -> None:
         self.logger = getLogger(__name__, self)
         self.options = options
         self.config = LazyConfig([{ARQ_EXECUTOR_NAMESPACE: self.options}])
+        self.serializer = Serializer(
+            format=options.serializer,
+            compression=options.compression,
+            compression_threshold=options.compression_threshold,
+        )
+        # A single heartbeat per executor replaces per-job healthchecks. ARQ
+        # workers cancel the jobs of a worker whose healthcheck expired.
+        self.worker_id = secrets.token_hex(8)
+        self.monitored_jobs: dict[str, MonitoredJob] = {}
+        self.heartbeat_task: t.Optional[asyncio.Task] = None
+        # Jobs enqueued concurrently are sent in a single pipeline, and the
+        # workers push the results to a list instead of having each job poll
+        # its result.
+        self.pending_jobs: list[PendingJob] = []
+        self.enqueue_task: t.Optional[asyncio.Task] = None
+        self.results: dict[str, asyncio.Future[PipelineResults]] = {}
+        self.results_task: t.Optional[asyncio.Task] = None
+        self.start_lock = asyncio.Lock()
 
         meter = get_meter("datalineup.metrics")
         self.execute_bytes = meter.create_counter(
@@ -78,14 +133,13 @@ class ARQExecutor(Executor):
             )
 
     def serialize(self, obj: dict[str, t.Any]) -> bytes:
-        data = pickle.dumps(obj)
+        data = self.serializer.dumps(obj)
         self.execute_bytes.add(len(data), {"executor": self.name})
         return data
 
     def deserialize(self, data: bytes) -> dict[str, t.Any]:
         self.results_bytes.add(len(data), {"executor": self.name})
-        obj = pickle.loads(data)  # noqa: S301
-        return obj
+        return loads(data)
 
     def create_connection_pool(self) -> ConnectionPool:
         # Create a connection from
@@ -95,7 +149,8 @@ class ARQExecutor(Executor):
             "password": redis_settings.password,
             "db": redis_settings.database,
             "socket_connect_timeout": 1,
-            "max_connections": self.concurrency,
+            # One more connection is held by the results reception.
+            "max_connections": self.concurrency + 1,
             "timeout": 10,
         }
 
@@ -167,52 +222,207 @@ class ARQExecutor(Executor):
         config = self.config.load_object(message.config)
         options = config.cast_namespace(ARQ_EXECUTOR_NAMESPACE, ARQExecutor.Options)
 
-        job = await (await self.redis_queue).enqueue_job(
+        redis_queue = await self.redis_queue
+        heartbeat_task, results_task = await self.start(redis_queue)
+
+        loop = asyncio.get_running_loop()
+        job_id = uuid4().hex
+        enqueue_time_ms = timestamp_ms()
+        job = serialize_job(
             EXECUTE_FUNC_NAME,
-            message.message.as_remote(),
-            _expires=options.timeout + options.timeout_delay,
-            _queue_name=options.queue_name,
+            (message.message.as_remote(),),
+            {
+                "worker_id": self.worker_id,
+                "results_key": results_key(self.worker_id),
+                "serializer": self.serializer,
+            },
+            None,
+            enqueue_time_ms,
+            serializer=self.serialize,
         )
+        result: asyncio.Future[PipelineResults] = loop.create_future()
+        monitored_job = MonitoredJob(job_id=job_id)
+        self.results[job_id] = result
+        self.monitored_jobs[job_id] = monitored_job
+        try:
+            await self.enqueue(
+                redis_queue,
+                PendingJob(
+                    job_id=job_id,
+                    job=job,
+                    queue_name=options.queue_name,
+                    score=enqueue_time_ms,
+                    expires_ms=(options.timeout + options.timeout_delay) * 1000,
+                    enqueued=loop.create_future(),
+                ),
+            )
 
-        tasks = TasksGroup(name=f"datalineup.arq.process_message({message.id})")
-        result_task: asyncio.Task[PipelineResults] = tasks.create_task(
-            job.result(timeout=options.timeout)
-        )
-        healthcheck_task = tasks.create_task(self.monitor_job_healthcheck(job))
-        async with tasks:
-            while not (done := await tasks.wait(remove=False)):
-                pass
-            if result_task in done:
-                tasks.remove(result_task)
-                return result_task.result()
-            if healthcheck_task in done:
-                tasks.remove(healthcheck_task)
-                raise WorkerDiedError() from healthcheck_task.exception()
-            raise RuntimeError("Unreachable")
-
-    async def monitor_job_healthcheck(self, job: Job) -> None:
-        hc_ex = int((healthcheck_interval * 2) * 1000)
-        # Wait for the job to not be enqueued.
-        while True:
-            await job._redis.psetex(
-                worker_healthcheck_key(job.job_id), hc_ex, b"healthy"
+            tasks = TasksGroup(name=f"datalineup.arq.process_message({message.id})")
+            died_task = tasks.create_task(monitored_job.died.wait())
+            async with tasks:
+                done, _ = await asyncio.wait(
+                    [result, died_task, heartbeat_task, results_task],
+                    timeout=options.timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if died_task.done() and not result.done():
+                    # Avoid any race condition where the healthcheck expired
+                    # right before the result is received.
+                    await asyncio.wait([result], timeout=healthcheck_interval)
+                if result.done():
+                    return result.result()
+                if not done:
+                    raise asyncio.TimeoutError()
+                if results_task.done() and not results_task.cancelled():
+                    raise RuntimeError(
+                        "Results reception stopped"
+                    ) from results_task.exception()
+                if heartbeat_task.done() and not heartbeat_task.cancelled():
+                    raise WorkerDiedError() from heartbeat_task.exception()
+                raise WorkerDiedError()
+        finally:
+            del self.results[job_id]
+            del self.monitored_jobs[job_id]
+
+    async def start(self, redis_queue: ArqRedis) -> tuple[asyncio.Task, asyncio.Task]:
+        """Return the heartbeat and results tasks, starting them if needed.
+
+        The first beat is done before returning, so the worker healthcheck key
+        exists before any job is enqueued.
+        """
+        async with self.start_lock:
+            if self.heartbeat_task is None or self.heartbeat_task.done():
+                await self.beat(redis_queue)
+                self.heartbeat_task = asyncio.create_task(
+                    self.run_heartbeat(redis_queue),
+                    name=f"datalineup.arq.heartbeat({self.worker_id})",
+                )
+            if self.results_task is None or self.results_task.done():
+                self.results_task = asyncio.create_task(
+                    self.receive_results(redis_queue),
+                    name=f"datalineup.arq.results({self.worker_id})",
+                )
+            return self.heartbeat_task, self.results_task
+
+    async def enqueue(self, redis_queue: ArqRedis, job: PendingJob) -> None:
+        self.pending_jobs.append(job)
+        if self.enqueue_task is None or self.enqueue_task.done():
+            self.enqueue_task = asyncio.create_task(
+                self.flush_jobs(redis_queue),
+                name=f"datalineup.arq.enqueue({self.worker_id})",
             )
-            await asyncio.sleep(healthcheck_interval)
-            if await job.status() is not JobStatus.queued:
-                break
+        await job.enqueued
 
-        # Monitor the job healthcheck.
+    async def flush_jobs(self, redis_queue: ArqRedis) -> None:
+        # Jobs added while a batch is sent are part of the next batch.
+        while self.pending_jobs:
+            jobs = [job for job in self.pending_jobs if not job.enqueued.done()]
+            self.pending_jobs = []
+            if not jobs:
+                continue
+            try:
+                await self.enqueue_jobs(redis_queue, jobs)
+            except Exception as e:
+                for job in jobs:
+                    if not job.enqueued.done():
+                        job.enqueued.set_exception(e)
+            else:
+                for job in jobs:
+                    if not job.enqueued.done():
+                        job.enqueued.set_result(None)
+
+    async def enqueue_jobs(self, redis_queue: ArqRedis, jobs: list[PendingJob]) -> None:
+        """Enqueue jobs in a single pipelined round-trip.
+
+        This is what `ArqRedis.enqueue_job` does, without checking for an
+        existing job since job ids are unique.
+        """
+        async with redis_queue.pipeline(transaction=False) as pipe:
+            for job in jobs:
+                pipe.psetex(job_key_prefix + job.job_id, job.expires_ms, job.job)
+                pipe.zadd(job.queue_name, {job.job_id: job.score})
+            await pipe.execute()
+
+    async def receive_results(self, redis_queue: ArqRedis) -> None:
+        key = results_key(self.worker_id)
+        while True:
+            try:
+                popped = await redis_queue.blpop(  # type: ignore[misc]
+                    [key], timeout=healthcheck_interval
+                )
+                if not popped:
+                    continue
+                self.receive_result(popped[1])
+                # Drain the other results pushed so far in the same round-trip.
+                async with redis_queue.pipeline(transaction=True) as pipe:
+                    pipe.lrange(key, 0, -1)
+                    pipe.delete(key)
+                    pushed, _ = await pipe.execute()
+            except (OSError, redis.exceptions.RedisError):
+                # The jobs in flight wait for their results until their
+                # timeout, a transient error is retried after a delay.
+                self.logger.exception("Failed to receive results")
+                await asyncio.sleep(self.options.redis_conn_retry_delay)
+                continue
+
+            for data in pushed:
+                self.receive_result(data)
+
+    def receive_result(self, data: bytes) -> None:
+        # Results are prefixed with their job id, so a result that can't be
+        # deserialized only fails its own job.
+        job_id, _, payload = data.partition(b":")
+        result = self.results.get(job_id.decode(errors="replace"))
+        if result is None or result.done():
+            return
+        try:
+            job_result = self.deserialize(payload)
+        except Exception as e:
+            self.logger.exception("Failed to deserialize results")
+            result.set_exception(e)
+            return
+        if job_result["success"]:
+            result.set_result(job_result["result"])
+        else:
+            result.set_exception(job_result["result"])
+
+    async def run_heartbeat(self, redis_queue: ArqRedis) -> None:
         while True:
-            await job._redis.psetex(
-                worker_healthcheck_key(job.job_id), hc_ex, b"healthy"
-            )
             await asyncio.sleep(healthcheck_interval)
-            if not await job._redis.get(executor_healthcheck_key(job.job_id)):
-                break
+            # The healthcheck lasts two beats, a transient error is retried
+            # before the ARQ workers cancel the jobs.
+            try:
+                await self.beat(redis_queue)
+            except (OSError, redis.exceptions.RedisError):
+                self.logger.exception("Failed to refresh the worker healthcheck")
+
+    async def beat(self, redis_queue: ArqRedis) -> None:
+        """Refresh the worker healthcheck and check the jobs in flight.
+
+        A single pipelined round-trip refreshes the key shared by all the jobs
+        of this executor and fetches the healthcheck of every job in flight.
+        """
+        hc_ex = int((healthcheck_interval * 2) * 1000)
+        jobs = list(self.monitored_jobs.values())
+        async with redis_queue.pipeline(transaction=False) as pipe:
+            pipe.psetex(worker_healthcheck_key(self.worker_id), hc_ex, b"healthy")
+            if jobs:
+                pipe.mget([executor_healthcheck_key(job.job_id) for job in jobs])
+                pipe.mget([in_progress_key_prefix + job.job_id for job in jobs])
+            results = await pipe.execute()
 
-        # Sleep a little, to avoid any race condition where the healthcheck
-        # complete before the result is fetch.
-        await asyncio.sleep(10)
+        if not jobs:
+            return
+        for job, healthy, in_progress in zip(jobs, results[1], results[2], strict=True):
+            if healthy:
+                job.started = True
+                job.misses = 0
+            elif job.started or in_progress:
+                # The ARQ worker sets the job healthcheck as soon as the job
+                # starts, so give it a beat before considering it dead.
+                job.misses += 1
+                if job.misses > 1:
+                    job.died.set()
 
     @property
     def concurrency(self) -> int:
@@ -223,4 +433,13 @@ class ARQExecutor(Executor):
         del self.redis_queue
 
     async def close(self) -> None:
+        tasks = [
+            task
+            for task in (self.heartbeat_task, self.results_task, self.enqueue_task)
+            if task
+        ]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
         await self._close_redis()
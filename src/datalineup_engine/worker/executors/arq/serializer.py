@@ -0,0 +1,177 @@
+import typing as t
+
+import dataclasses
+import enum
+import importlib
+import pickle  # noqa: S403
+import struct
+
+# Framed payloads start with MAGIC, followed by the format and compression
+# bytes. Anything else is a plain pickle, as sent by older executors.
+MAGIC: t.Final[bytes] = b"DL"
+HEADER: t.Final[struct.Struct] = struct.Struct("!2sBB")
+BUFFERS_COUNT: t.Final[struct.Struct] = struct.Struct("!I")
+BUFFER_SIZE: t.Final[struct.Struct] = struct.Struct("!Q")
+
+# msgpack extension type for objects msgpack can't encode natively.
+PICKLE_EXT_TYPE: t.Final[int] = 1
+
+
+class SerializerFormat(enum.Enum):
+    PICKLE = "pickle"
+    MSGPACK = "msgpack"
+
+
+class Compression(enum.Enum):
+    ZSTD = "zstd"
+    LZ4 = "lz4"
+
+
+FORMAT_IDS: t.Final[dict[SerializerFormat, int]] = {
+    SerializerFormat.PICKLE: 1,
+    SerializerFormat.MSGPACK: 2,
+}
+COMPRESSION_IDS: t.Final[dict[t.Optional[Compression], int]] = {
+    None: 0,
+    Compression.ZSTD: 1,
+    Compression.LZ4: 2,
+}
+FORMATS: t.Final[dict[int, SerializerFormat]] = {v: k for k, v in FORMAT_IDS.items()}
+COMPRESSIONS: t.Final[dict[int, t.Optional[Compression]]] = {
+    v: k for k, v in COMPRESSION_IDS.items()
+}
+COMPRESSION_MODULES: t.Final[dict[Compression, str]] = {
+    Compression.ZSTD: "zstandard",
+    Compression.LZ4: "lz4.frame",
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class Serializer:
+    """Encode ARQ payloads in a self-describing frame.
+
+    `pickle` uses protocol 5 and stores large buffers out-of-band, after the
+    pickle stream. `msgpack` encodes plain data natively and falls back to
+    pickle for other objects. Payloads of at least `compression_threshold`
+    bytes are compressed with `compression`. msgpack and the compression
+    libraries are installed with the `arq-codecs` extra.
+
+    Since the frame header names the codec, `loads` decodes any payload and
+    the worker replies with the serializer the executor sent along the job.
+    """
+
+    format: SerializerFormat = SerializerFormat.PICKLE
+    compression: t.Optional[Compression] = None
+    compression_threshold: int = 4096
+
+    def __post_init__(self) -> None:
+        # Fail early when an optional dependency is missing.
+        if self.format is SerializerFormat.MSGPACK:
+            importlib.import_module("msgpack")
+        if self.compression:
+            importlib.import_module(COMPRESSION_MODULES[self.compression])
+
+    def dumps(self, obj: t.Any) -> bytes:
+        if self.format is SerializerFormat.MSGPACK:
+            body = msgpack_dumps(obj)
+        else:
+            body = pickle_dumps(obj)
+
+        compression = None
+        if self.compression and len(body) >= self.compression_threshold:
+            compression = self.compression
+            body = compress(compression, body)
+
+        header = HEADER.pack(
+            MAGIC, FORMAT_IDS[self.format], COMPRESSION_IDS[compression]
+        )
+        return header + body
+
+
+def loads(data: bytes) -> t.Any:
+    if data[: len(MAGIC)] != MAGIC:
+        return pickle.loads(data)  # noqa: S301
+
+    _, format_id, compression_id = HEADER.unpack_from(data)
+    body = memoryview(data)[HEADER.size :]
+    compression = COMPRESSIONS[compression_id]
+    if compression:
+        body = memoryview(decompress(compression, body))
+
+    if FORMATS[format_id] is SerializerFormat.MSGPACK:
+        return msgpack_loads(body)
+    return pickle_loads(body)
+
+
+def pickle_dumps(obj: t.Any) -> bytes:
+    buffers: list[pickle.PickleBuffer] = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+    return b"".join(
+        [
+            BUFFERS_COUNT.pack(len(raws)),
+            *[BUFFER_SIZE.pack(raw.nbytes) for raw in raws],
+            data,
+            *raws,
+        ]
+    )
+
+
+def pickle_loads(body: memoryview) -> t.Any:
+    (count,) = BUFFERS_COUNT.unpack_from(body)
+    offset = BUFFERS_COUNT.size
+    sizes = [
+        BUFFER_SIZE.unpack_from(body, offset + i * BUFFER_SIZE.size)[0]
+        for i in range(count)
+    ]
+    offset += count * BUFFER_SIZE.size
+    buffers_start = len(body) - sum(sizes)
+
+    buffers = []
+    buffer_offset = buffers_start
+    for size in sizes:
+        buffers.append(body[buffer_offset : buffer_offset + size])
+        buffer_offset += size
+    return pickle.loads(body[offset:buffers_start], buffers=buffers)  # noqa: S301
+
+
+def msgpack_dumps(obj: t.Any) -> bytes:
+    import msgpack
+
+    def default(o: t.Any) -> msgpack.ExtType:
+        return msgpack.ExtType(PICKLE_EXT_TYPE, pickle.dumps(o, protocol=5))
+
+    return msgpack.packb(obj, default=default)
+
+
+def msgpack_loads(body: memoryview) -> t.Any:
+    import msgpack
+
+    def ext_hook(code: int, data: bytes) -> t.Any:
+        if code == PICKLE_EXT_TYPE:
+            return pickle.loads(data)  # noqa: S301
+        return msgpack.ExtType(code, data)
+
+    return msgpack.unpackb(body, ext_hook=ext_hook, strict_map_key=False)
+
+
+def compress(compression: Compression, data: bytes) -> bytes:
+    if compression is Compression.ZSTD:
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+
+    import lz4.frame
+
+    return lz4.frame.compress(data)
+
+
+def decompress(compression: Compression, data: memoryview) -> bytes:
+    if compression is Compression.ZSTD:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    import lz4.frame
+
+    return lz4.frame.decompress(data)
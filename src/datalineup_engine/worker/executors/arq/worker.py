@@ -1,9 +1,13 @@
 import typing as t
 
 import asyncio
+import contextlib
 import enum
 import logging
 import multiprocessing
+import multiprocessing.util
+import pickle  # noqa: S403
+from collections.abc import AsyncIterator
 from concurrent import futures
 
 import arq.worker
@@ -19,11 +23,15 @@ from datalineup_engine.worker.services.loggers import logger
 from datalineup_engine.worker.services.loggers.logger import pipeline_message_data
 
 from ..bootstrap import PipelineBootstrap
+from ..bootstrap import RemoteException
 from ..bootstrap import wrap_remote_exception
 from . import EXECUTE_FUNC_NAME
+from . import TIMEOUT_DELAY
 from . import executor_healthcheck_key
 from . import healthcheck_interval
 from . import worker_healthcheck_key
+from .serializer import Serializer
+from .serializer import loads
 
 
 class WorkerType(enum.Enum):
@@ -41,6 +49,8 @@ class Context(WorkerOptions):
     executor: futures.Executor
     redis: ArqRedis
     job_id: str
+    heartbeat: "WorkerHeartbeat"
+    heartbeat_task: asyncio.Task
 
 
 _bootstraper: t.Optional[PipelineBootstrap] = None
@@ -75,54 +85,157 @@ def remote_bootstrap(message: PipelineMessage) -> PipelineResults:
     return bootstraper.bootstrap_pipeline(message)
 
 
-async def remote_execute(ctx: Context, message: PipelineMessage) -> PipelineResults:
+async def remote_execute(
+    ctx: Context,
+    message: PipelineMessage,
+    worker_id: t.Optional[str] = None,
+    results_key: t.Optional[str] = None,
+    serializer: t.Optional[Serializer] = None,
+) -> PipelineResults:
+    dumps = serializer.dumps if serializer else pickle.dumps
+    try:
+        results = await execute_watched(ctx, message, worker_id=worker_id)
+    except Exception as e:
+        if results_key:
+            await push_result(ctx, results_key, dumps, success=False, result=e)
+        raise
+    if results_key:
+        await push_result(ctx, results_key, dumps, success=True, result=results)
+    return results
+
+
+async def push_result(
+    ctx: Context,
+    results_key: str,
+    dumps: t.Callable[[t.Any], bytes],
+    *,
+    success: bool,
+    result: object,
+) -> None:
+    """Push a job result to the list the executor is blocking on.
+
+    The result is prefixed with the job id and a colon.
+    """
+    try:
+        data = dumps({"success": success, "result": result})
+    except Exception as e:
+        data = dumps({"success": False, "result": RemoteException.from_exception(e)})
+    async with ctx["redis"].pipeline(transaction=False) as pipe:
+        pipe.rpush(results_key, ctx["job_id"].encode() + b":" + data)
+        # Don't keep the results of an executor that went away.
+        pipe.expire(results_key, TIMEOUT_DELAY)
+        await pipe.execute()
+
+
+async def execute_watched(
+    ctx: Context, message: PipelineMessage, *, worker_id: t.Optional[str]
+) -> PipelineResults:
     executor = ctx["executor"]
     with wrap_remote_exception():
-        cancellation_token = CancellationToken()
-        message.set_meta_arg(meta_type=CancellationToken, value=cancellation_token)
-
-        loop = asyncio.get_running_loop()
-        tasks = TasksGroup(name=f"datalineup.arq.remote({message.id})")
-
-        async def execute_message() -> PipelineResults:
-            return await loop.run_in_executor(executor, remote_bootstrap, message)
-
-        executor_task = tasks.create_task(execute_message())
-        healthcheck_task = tasks.create_task(remote_job_healthcheck(ctx))
-        async with tasks:
-            while not (done := await tasks.wait(remove=False)):
-                pass
-            if executor_task in done:
-                tasks.remove(executor_task)
-                return executor_task.result()
-            if healthcheck_task in done:
-                cancellation_token._cancel()
-                logging.getLogger(__name__).error(
-                    "Worker died", extra={"data": pipeline_message_data(message)}
-                )
-                raise RuntimeError("Job Cancelled")
-            raise RuntimeError("Unreachable")
-
-
-async def remote_job_healthcheck(ctx: Context) -> None:
-    hc_ex = int((healthcheck_interval * 2) * 1000)
-    redis = ctx["redis"]
-    job_id = ctx["job_id"]
-    while True:
-        await redis.psetex(
-            executor_healthcheck_key(job_id),
-            hc_ex,
-            b"healthy",
-        )
-        await asyncio.sleep(healthcheck_interval)
-        if not await redis.get(worker_healthcheck_key(job_id)):
-            break
+        async with ctx["heartbeat"].watch(
+            job_id=ctx["job_id"], worker_id=worker_id
+        ) as worker_died:
+            cancellation_token = CancellationToken()
+            message.set_meta_arg(meta_type=CancellationToken, value=cancellation_token)
+
+            loop = asyncio.get_running_loop()
+            tasks = TasksGroup(name=f"datalineup.arq.remote({message.id})")
+
+            async def execute_message() -> PipelineResults:
+                return await loop.run_in_executor(executor, remote_bootstrap, message)
+
+            executor_task = tasks.create_task(execute_message())
+            healthcheck_task = tasks.create_task(worker_died.wait())
+            async with tasks:
+                while not (done := await tasks.wait(remove=False)):
+                    pass
+                if executor_task in done:
+                    tasks.remove(executor_task)
+                    return executor_task.result()
+                if healthcheck_task in done:
+                    cancellation_token._cancel()
+                    logging.getLogger(__name__).error(
+                        "Worker died", extra={"data": pipeline_message_data(message)}
+                    )
+                    raise RuntimeError("Job Cancelled")
+                raise RuntimeError("Unreachable")
+
+
+class WorkerHeartbeat:
+    """Single healthcheck loop for all the jobs of an ARQ worker process.
+
+    Each beat refreshes the healthcheck of every job in flight and fetches the
+    healthcheck of every datalineup worker with jobs in flight, in a single
+    pipelined round-trip. The jobs of a worker whose healthcheck expired are
+    notified.
+    """
+
+    def __init__(self, redis: ArqRedis) -> None:
+        self.redis = redis
+        self.jobs: dict[str, t.Optional[str]] = {}
+        self.watchers: dict[str, set[asyncio.Event]] = {}
+        self.logger = logging.getLogger(__name__)
+
+    @contextlib.asynccontextmanager
+    async def watch(
+        self, *, job_id: str, worker_id: t.Optional[str]
+    ) -> AsyncIterator[asyncio.Event]:
+        # Set the job healthcheck right away, the next beat refreshes it.
+        hc_ex = int((healthcheck_interval * 2) * 1000)
+        await self.redis.psetex(executor_healthcheck_key(job_id), hc_ex, b"healthy")
+
+        worker_died = asyncio.Event()
+        self.jobs[job_id] = worker_id
+        if worker_id:
+            self.watchers.setdefault(worker_id, set()).add(worker_died)
+        try:
+            yield worker_died
+        finally:
+            del self.jobs[job_id]
+            if worker_id:
+                self.watchers[worker_id].discard(worker_died)
+                if not self.watchers[worker_id]:
+                    del self.watchers[worker_id]
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.beat()
+            except Exception:
+                self.logger.exception("Failed to refresh jobs healthcheck")
+            await asyncio.sleep(healthcheck_interval)
+
+    async def beat(self) -> None:
+        if not self.jobs:
+            return
+
+        hc_ex = int((healthcheck_interval * 2) * 1000)
+        worker_ids = list(self.watchers)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.mset(
+                {executor_healthcheck_key(job_id): b"healthy" for job_id in self.jobs}
+            )
+            for job_id in self.jobs:
+                pipe.pexpire(executor_healthcheck_key(job_id), hc_ex)
+            if worker_ids:
+                pipe.mget([worker_healthcheck_key(w) for w in worker_ids])
+            results = await pipe.execute()
+
+        if not worker_ids:
+            return
+        for worker_id, healthy in zip(worker_ids, results[-1], strict=True):
+            if healthy:
+                continue
+            for worker_died in self.watchers.get(worker_id, ()):
+                worker_died.set()
 
 
 def remote_initializer(
     worker_initializer: t.Optional[t.Callable[[PipelineBootstrap], t.Any]]
 ) -> None:
     _init_bootstraper(worker_initializer)
+    # Teardown the pipeline setups when the child process exits.
+    multiprocessing.util.Finalize(None, _ensure_bootstraper().close, exitpriority=10)
 
 
 async def startup(ctx: Context) -> None:
@@ -146,11 +259,17 @@ async def startup(ctx: Context) -> None:
 
         ctx["executor"] = executor
 
+    ctx["heartbeat"] = WorkerHeartbeat(ctx["redis"])
+    ctx["heartbeat_task"] = asyncio.create_task(ctx["heartbeat"].run())
+
     _init_bootstraper(worker_initializer)
 
 
 async def shutdown(ctx: Context) -> None:
+    ctx["heartbeat_task"].cancel()
     ctx["executor"].shutdown()
+    if _bootstraper:
+        _bootstraper.close()
 
 
 class WorkerSettings:
@@ -159,7 +278,13 @@ class WorkerSettings:
             remote_execute,  # type: ignore[arg-type]
             name=EXECUTE_FUNC_NAME,
             max_tries=1,
+            # Results are pushed to the executor, ARQ only keeps them for
+            # executors polling the job result.
+            keep_result=TIMEOUT_DELAY,
         )
     ]
     on_startup = startup
     on_shutdown = shutdown
+    # Jobs are framed with the executor serializer, which is sent along each
+    # job so results are encoded the same way.
+    job_deserializer = loads
@@ -0,0 +1,62 @@
+import typing as t
+
+import dataclasses
+
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.utils.config import LazyConfig
+from datalineup_engine.worker.executors.executable import ExecutableMessage
+from datalineup_engine.worker.services import Services
+
+from . import Executor
+from .bootstrap import PipelineBootstrap
+from .bootstrap import wrap_remote_exception
+
+ASYNC_EXECUTOR_NAMESPACE: t.Final[str] = "async_executor"
+
+
+class AsyncExecutor(Executor):
+    """Execute coroutine pipelines directly on the worker event loop.
+
+    Pipelines can be `async def` functions or async generators. Since nothing
+    is offloaded to a pool, `concurrency` only bounds how many messages are in
+    flight, and a synchronous pipeline would block the whole worker.
+
+    `timeout` is the number of seconds a single message is allowed to run. It
+    can be overridden per job or per message from the `async_executor` config
+    namespace.
+
+    Outputs of async generators are streamed when the queue provides an
+    output stream.
+    """
+
+    @dataclasses.dataclass
+    class Options:
+        concurrency: int = 100
+        timeout: t.Optional[float] = None
+
+    def __init__(self, options: Options, services: Services) -> None:
+        self.options = options
+        self.config = LazyConfig([{ASYNC_EXECUTOR_NAMESPACE: self.options}])
+        self.bootstrapper = PipelineBootstrap(
+            initialized_hook=services.s.hooks.executor_initialized
+        )
+
+    async def process_message(self, message: ExecutableMessage) -> PipelineResults:
+        config = self.config.load_object(message.config)
+        options = config.cast_namespace(ASYNC_EXECUTOR_NAMESPACE, AsyncExecutor.Options)
+
+        # Errors are wrapped the same way as the pool executors, so error
+        # handlers match pipeline exceptions regardless of the executor.
+        with wrap_remote_exception():
+            return await self.bootstrapper.bootstrap_async_pipeline(
+                message.message,
+                timeout=options.timeout,
+                on_output=message.output_stream.put if message.output_stream else None,
+            )
+
+    @property
+    def concurrency(self) -> int:
+        return self.options.concurrency
+
+    async def close(self) -> None:
+        self.bootstrapper.close()
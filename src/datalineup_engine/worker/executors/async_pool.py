@@ -0,0 +1,373 @@
+import typing as t
+
+import asyncio
+import concurrent.futures
+import contextlib
+import dataclasses
+import itertools
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.core.pipeline import CancellationToken
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+
+from .bootstrap import RemoteException
+from .recycling import RecycleLimits
+from .recycling import RecycleReason
+from .recycling import rss_mb
+
+STOP_TIMEOUT: t.Final[float] = 10
+
+# Parent to child: `(call_id, message, timed)` to execute a message, with
+# `timed` when the parent wants to know when the call starts,
+# `(call_id, None, False)` to cancel it and `None` to stop the child.
+# Child to parent: `(call_id, None, None)` when a timed call starts, then
+# `(call_id, results, rss_mb)` with the results or a RemoteException, and the
+# child RSS when the pool recycles by RSS.
+Request = t.Optional[tuple[int, t.Optional[PipelineMessage], bool]]
+Response = tuple[
+    int, t.Optional[t.Union[PipelineResults, RemoteException]], t.Optional[float]
+]
+RemoteExecute = t.Callable[[PipelineMessage], t.Awaitable[PipelineResults]]
+
+
+@dataclasses.dataclass(eq=False)
+class PoolProcess:
+    process: BaseProcess
+    conn: Connection
+    calls: dict[int, asyncio.Future[PipelineResults]] = dataclasses.field(
+        default_factory=dict
+    )
+    started: dict[int, asyncio.Future[None]] = dataclasses.field(default_factory=dict)
+    tasks: int = 0
+    is_retiring: bool = False
+
+
+class AsyncProcessPool:
+    """Pool of child processes, each running pipelines on its own event loop.
+
+    Every child executes up to `concurrency` messages at once. Messages are
+    sent to the child with the fewest calls in flight, unless `submit` is
+    given the `index` of a child. A child that dies is
+    replaced and its pending calls fail with `BrokenProcessPool`.
+
+    With a `timeout`, a call running for too long gets cancelled. The timeout
+    starts once the child runs the call, not while it waits for one of the
+    child slots. If the call didn't return after `grace` more seconds, its
+    child is killed and replaced, and `asyncio.TimeoutError` is raised.
+
+    A child over one of the `limits` is retired: a new child takes its place
+    while it finishes its calls in flight, then it is stopped.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_workers: int,
+        concurrency: int,
+        initializer: t.Callable[[], None],
+        execute: RemoteExecute,
+        limits: t.Optional[RecycleLimits] = None,
+        on_recycle: t.Optional[t.Callable[[RecycleReason], None]] = None,
+    ) -> None:
+        self.max_workers = max_workers
+        self.concurrency = concurrency
+        self.initializer = initializer
+        self.execute = execute
+        self.limits = limits or RecycleLimits()
+        self.on_recycle = on_recycle
+        self.processes: list[PoolProcess] = []
+        self.retiring: list[PoolProcess] = []
+        self.stopping: set[asyncio.Task] = set()
+        self.call_ids = itertools.count()
+        self.is_closed = False
+        self.mp_context = multiprocessing.get_context()
+
+    async def submit(
+        self,
+        message: PipelineMessage,
+        *,
+        timeout: t.Optional[float] = None,
+        grace: float = 0,
+        index: t.Optional[int] = None,
+    ) -> PipelineResults:
+        if self.is_closed:
+            raise RuntimeError("cannot schedule new calls after shutdown")
+        if not self.processes:
+            self.processes = [self.spawn() for _ in range(self.max_workers)]
+
+        if index is None:
+            process = min(self.processes, key=lambda p: len(p.calls))
+        else:
+            process = self.processes[index]
+        call_id = next(self.call_ids)
+        future = asyncio.get_running_loop().create_future()
+        process.calls[call_id] = future
+        try:
+            if timeout is None:
+                process.conn.send((call_id, message, False))
+                return await future
+
+            started = asyncio.get_running_loop().create_future()
+            process.started[call_id] = started
+            process.conn.send((call_id, message, True))
+            await asyncio.wait([future, started], return_when=asyncio.FIRST_COMPLETED)
+            done, _ = await asyncio.wait([future], timeout=timeout)
+            if done:
+                return future.result()
+
+            with contextlib.suppress(OSError):
+                process.conn.send((call_id, None, False))
+            done, _ = await asyncio.wait([future], timeout=grace)
+            if not done:
+                # The call is stuck, like in a C extension ignoring the
+                # cancellation. Its child gets killed and replaced.
+                process.calls.pop(call_id, None)
+                process.process.kill()
+                self.process_died(process)
+            raise asyncio.TimeoutError()
+        except asyncio.CancelledError:
+            # Let the pipeline know through its CancellationToken.
+            with contextlib.suppress(OSError):
+                process.conn.send((call_id, None, False))
+            raise
+        finally:
+            process.calls.pop(call_id, None)
+            process.started.pop(call_id, None)
+            if process.is_retiring and not process.calls:
+                self.stop_retired(process)
+
+    def loads(self) -> list[int]:
+        """Number of calls in flight in each child."""
+        if not self.processes:
+            return [0] * self.max_workers
+        return [len(process.calls) for process in self.processes]
+
+    def spawn(self) -> PoolProcess:
+        conn, child_conn = self.mp_context.Pipe()
+        process = self.mp_context.Process(
+            target=async_process_main,
+            kwargs={
+                "conn": child_conn,
+                "concurrency": self.concurrency,
+                "initializer": self.initializer,
+                "execute": self.execute,
+                "measure_rss": self.limits.max_rss_mb is not None,
+            },
+            name="datalineup-async-process",
+        )
+        process.start()
+        child_conn.close()
+
+        pool_process = PoolProcess(process=process, conn=conn)
+        asyncio.get_running_loop().add_reader(
+            conn.fileno(), self.on_readable, pool_process
+        )
+        return pool_process
+
+    def on_readable(self, process: PoolProcess) -> None:
+        try:
+            while process.conn.poll():
+                call_id, result, rss = t.cast(Response, process.conn.recv())
+                if result is None:
+                    started = process.started.pop(call_id, None)
+                    if started is not None and not started.done():
+                        started.set_result(None)
+                    continue
+
+                process.tasks += 1
+                future = process.calls.get(call_id)
+                if future is not None and not future.done():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+                if process.is_retiring or self.is_closed:
+                    continue
+                reason = self.limits.exceeded(tasks=process.tasks, rss_mb=rss)
+                if reason:
+                    self.retire(process, reason)
+        except (EOFError, OSError):
+            self.process_died(process)
+
+    def retire(self, process: PoolProcess, reason: RecycleReason) -> None:
+        process.is_retiring = True
+        self.processes[self.processes.index(process)] = self.spawn()
+        self.retiring.append(process)
+        if self.on_recycle:
+            self.on_recycle(reason)
+        # Otherwise, the process is stopped once its last call returns.
+        if not process.calls:
+            self.stop_retired(process)
+
+    def stop_retired(self, process: PoolProcess) -> None:
+        # A child that died while retiring is already reaped.
+        if process not in self.retiring:
+            return
+        self.retiring.remove(process)
+        asyncio.get_running_loop().remove_reader(process.conn.fileno())
+        with contextlib.suppress(OSError):
+            process.conn.send(None)
+        self.reap(process)
+
+    def reap(self, process: PoolProcess) -> None:
+        task = asyncio.create_task(self.join(process), name="async-process-pool.reap")
+        self.stopping.add(task)
+        task.add_done_callback(self.stopping.discard)
+
+    def process_died(self, process: PoolProcess) -> None:
+        asyncio.get_running_loop().remove_reader(process.conn.fileno())
+        process.conn.close()
+        for future in process.calls.values():
+            if not future.done():
+                future.set_exception(
+                    BrokenProcessPool("A child process terminated abruptly")
+                )
+        process.calls.clear()
+        process.started.clear()
+        self.reap(process)
+        if process.is_retiring:
+            self.retiring.remove(process)
+        else:
+            self.processes[self.processes.index(process)] = self.spawn()
+
+    async def join(self, process: PoolProcess) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, process.process.join, STOP_TIMEOUT)
+        if process.process.is_alive():
+            process.process.kill()
+        process.conn.close()
+
+    async def shutdown(self) -> None:
+        self.is_closed = True
+        loop = asyncio.get_running_loop()
+        processes = self.processes + self.retiring
+        for process in processes:
+            loop.remove_reader(process.conn.fileno())
+            with contextlib.suppress(OSError):
+                process.conn.send(None)
+            for future in process.calls.values():
+                future.cancel()
+
+        for process in processes:
+            await self.join(process)
+        if self.stopping:
+            await asyncio.wait(self.stopping)
+        self.processes = []
+        self.retiring = []
+
+
+def async_process_main(
+    *,
+    conn: Connection,
+    concurrency: int,
+    initializer: t.Callable[[], None],
+    execute: RemoteExecute,
+    measure_rss: bool = False,
+) -> None:
+    initializer()
+    worker = AsyncProcessWorker(
+        conn, concurrency=concurrency, execute=execute, measure_rss=measure_rss
+    )
+    asyncio.run(worker.run())
+
+
+class AsyncProcessWorker:
+    def __init__(
+        self,
+        conn: Connection,
+        *,
+        concurrency: int,
+        execute: RemoteExecute,
+        measure_rss: bool = False,
+    ) -> None:
+        self.conn = conn
+        self.execute = execute
+        self.measure_rss = measure_rss
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tokens: dict[int, CancellationToken] = {}
+        self.tasks: set[asyncio.Task] = set()
+        # Results are sent from a thread so the loop keeps reading requests
+        # while the parent is busy, otherwise both sides could block on a
+        # full pipe.
+        self.sender = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopped: asyncio.Future[None] = loop.create_future()
+        loop.add_reader(self.conn.fileno(), self.on_readable, stopped)
+        try:
+            await stopped
+        finally:
+            loop.remove_reader(self.conn.fileno())
+            for token in self.tokens.values():
+                token._cancel()
+            if self.tasks:
+                await asyncio.wait(self.tasks, timeout=STOP_TIMEOUT)
+            self.sender.shutdown(wait=True, cancel_futures=True)
+
+    def on_readable(self, stopped: asyncio.Future[None]) -> None:
+        if stopped.done():
+            return
+        try:
+            while self.conn.poll():
+                request = t.cast(Request, self.conn.recv())
+                if request is None:
+                    raise EOFError()
+                call_id, message, timed = request
+                if message is None:
+                    if token := self.tokens.get(call_id):
+                        token._cancel()
+                    continue
+                task = asyncio.create_task(
+                    self.execute_message(call_id, message, timed=timed)
+                )
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+        except (EOFError, OSError):
+            stopped.set_result(None)
+
+    async def execute_message(
+        self, call_id: int, message: PipelineMessage, *, timed: bool = False
+    ) -> None:
+        token = CancellationToken()
+        self.tokens[call_id] = token
+        result: t.Union[PipelineResults, RemoteException]
+        try:
+            async with self.semaphore:
+                # Cancelled while waiting for a slot. The parent might still
+                # wait for the response before killing the child.
+                if token.is_cancelled:
+                    result = RemoteException.from_exception(asyncio.CancelledError())
+                else:
+                    if timed:
+                        self.sender.submit(self.send, (call_id, None, None))
+                    try:
+                        message.set_meta_arg(meta_type=CancellationToken, value=token)
+                        result = await self.execute(message)
+                    except RemoteException as e:
+                        result = e
+                    except Exception as e:
+                        result = RemoteException.from_exception(e)
+        finally:
+            del self.tokens[call_id]
+
+        rss = rss_mb() if self.measure_rss else None
+        await asyncio.get_running_loop().run_in_executor(
+            self.sender, self.send, (call_id, result, rss)
+        )
+
+    def send(self, response: Response) -> None:
+        try:
+            self.conn.send(response)
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            # The results couldn't be pickled.
+            self.conn.send(
+                (response[0], RemoteException.from_exception(e), response[2])
+            )
@@ -0,0 +1,91 @@
+import typing as t
+
+import asyncio
+from collections.abc import Awaitable
+
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+
+from .bootstrap import RemoteException
+
+BatchResult = t.Union[PipelineResults, RemoteException]
+BatchOutcome = t.Union[PipelineResults, Exception]
+ExecuteBatch = t.Callable[[list[PipelineMessage]], Awaitable[list[BatchOutcome]]]
+
+
+class MessageBatcher:
+    """Buffer messages into batches executed by a single call.
+
+    A batch is executed once it holds `batch_size` messages or `linger`
+    seconds after its first message got buffered.
+    """
+
+    def __init__(
+        self, *, batch_size: int, linger: float, execute: ExecuteBatch
+    ) -> None:
+        self.batch_size = batch_size
+        self.linger = linger
+        self.execute = execute
+        self.pending: list[tuple[PipelineMessage, asyncio.Future[PipelineResults]]] = []
+        self.linger_handle: t.Optional[asyncio.TimerHandle] = None
+        self.tasks: set[asyncio.Task] = set()
+
+    async def submit(self, message: PipelineMessage) -> PipelineResults:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[PipelineResults] = loop.create_future()
+        self.pending.append((message, future))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.linger_handle is None:
+            self.linger_handle = loop.call_later(self.linger, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self.linger_handle:
+            self.linger_handle.cancel()
+            self.linger_handle = None
+
+        # Skip the messages whose awaiter got cancelled while buffered.
+        batch = [(m, f) for m, f in self.pending if not f.done()]
+        self.pending = []
+        if not batch:
+            return
+
+        task = asyncio.create_task(
+            self.execute_batch(batch), name="process-executor.batch"
+        )
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def execute_batch(
+        self, batch: list[tuple[PipelineMessage, asyncio.Future[PipelineResults]]]
+    ) -> None:
+        try:
+            results = await self.execute([m for m, _ in batch])
+        except BaseException as e:
+            for _, future in batch:
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        for (_, future), result in zip(batch, results, strict=True):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def close(self) -> None:
+        if self.linger_handle:
+            self.linger_handle.cancel()
+            self.linger_handle = None
+        for _, future in self.pending:
+            future.cancel()
+        self.pending = []
@@ -1,9 +1,18 @@
+import typing as t
+
+import asyncio
 import contextlib
+import inspect
 import logging
+import threading
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
 from collections.abc import Generator
 from collections.abc import Iterable
 from collections.abc import Iterator
+from functools import partial
 
+from opentelemetry.metrics import get_meter
 from pydantic.v1 import ValidationError
 
 from datalineup_engine.core import PipelineOutput
@@ -12,18 +21,73 @@ from datalineup_engine.core import ResourceUsed
 from datalineup_engine.core import TopicMessage
 from datalineup_engine.core.pipeline import PipelineEvent
 from datalineup_engine.core.pipeline import PipelineResultTypes
+from datalineup_engine.core.pipeline import PipelineSetup
 from datalineup_engine.utils.hooks import ContextHook
 from datalineup_engine.utils.hooks import EventHook
+from datalineup_engine.utils.telemetry import get_timer
 from datalineup_engine.utils.traceback_data import TracebackData
 from datalineup_engine.worker.context import message_context
 from datalineup_engine.worker.context import pipeline_context
 from datalineup_engine.worker.pipeline_message import PipelineMessage
+from datalineup_engine.worker.pipeline_message import pipeline_plan
 
 PipelineHook = ContextHook[PipelineMessage, PipelineResults]
+OnOutput = t.Callable[[PipelineOutput], None]
+OnAsyncOutput = t.Callable[[PipelineOutput], Awaitable[None]]
+
+
+class PipelineStates:
+    """States of the pipeline setups run in this process.
+
+    Each setup runs once, even when shared by many pipelines, and its state
+    is kept until `close` calls the setups teardowns.
+    """
+
+    def __init__(self) -> None:
+        # Kept in the order they were set up.
+        self.states: dict[PipelineSetup, object] = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("datalineup.bootstrap")
+        self.setup_duration = get_meter("datalineup.metrics").create_histogram(
+            name="datalineup.pipeline.setup.duration",
+            unit="ms",
+            description="""Time spent to run pipeline setups, once per executor
+            process.
+            """,
+        )
+
+    def get(self, setup: PipelineSetup, *, pipeline: str) -> object:
+        if setup in self.states:
+            return self.states[setup]
+        with self.lock:
+            if setup in self.states:
+                return self.states[setup]
+            # A failed setup isn't cached and is retried by the next message.
+            with get_timer(self.setup_duration).time({"pipeline": pipeline}):
+                state = setup.setup()
+            self.states[setup] = state
+            return state
+
+    def close(self) -> None:
+        """Teardown the states, in the reverse setup order."""
+        with self.lock:
+            states, self.states = self.states, {}
+        for setup, state in reversed(states.items()):
+            if not setup.teardown:
+                continue
+            try:
+                setup.teardown(state)
+            except Exception:
+                self.logger.exception("Failed to teardown pipeline setup")
 
 
 class PipelineBootstrap:
-    def __init__(self, initialized_hook: EventHook["PipelineBootstrap"]):
+    def __init__(
+        self,
+        initialized_hook: EventHook["PipelineBootstrap"],
+        *,
+        states: t.Optional[PipelineStates] = None,
+    ):
         self.pipeline_hook: PipelineHook = ContextHook(
             error_handler=self.pipeline_hook_failed
         )
@@ -31,14 +95,88 @@ class PipelineBootstrap:
 
         self.logger = logging.getLogger("datalineup.bootstrap")
 
-    def bootstrap_pipeline(self, message: PipelineMessage) -> PipelineResults:
+        self.states = states or PipelineStates()
+
+    def bootstrap_pipeline(
+        self, message: PipelineMessage, *, on_output: t.Optional[OnOutput] = None
+    ) -> PipelineResults:
+        """Run a pipeline and return its results.
+
+        With `on_output`, outputs are passed to it as soon as they are yielded
+        instead of being returned in the results.
+        """
         message.set_meta_arg(meta_type=TopicMessage, value=message.message)
         with pipeline_context(message.info), message_context(message.message):
-            return self.pipeline_hook.emit(self.run_pipeline)(message)
+            return self.pipeline_hook.emit(
+                partial(self.run_pipeline, on_output=on_output)
+            )(message)
+
+    async def bootstrap_async_pipeline(
+        self,
+        message: PipelineMessage,
+        *,
+        timeout: t.Optional[float] = None,
+        on_output: t.Optional[OnAsyncOutput] = None,
+    ) -> PipelineResults:
+        message.set_meta_arg(meta_type=TopicMessage, value=message.message)
+        with pipeline_context(message.info), message_context(message.message):
+            # Same as `pipeline_hook.emit`, but the scope is awaited.
+            emiter = self.pipeline_hook.emit(self.run_pipeline)
+            generators = emiter.on_call(message)
+            try:
+                results = await asyncio.wait_for(
+                    self.run_async_pipeline(message, on_output=on_output),
+                    timeout=timeout,
+                )
+                emiter.on_result(generators, results)
+            except Exception as e:
+                emiter.on_error(generators, e)
+                raise
+            except BaseException:
+                # Cancelled, the handlers can only clean up.
+                for generator in reversed(generators):
+                    generator.close()
+                raise
+            return results
+
+    def run_pipeline(
+        self, message: PipelineMessage, *, on_output: t.Optional[OnOutput] = None
+    ) -> PipelineResults:
+        return self.collect_results(self.execute_message(message), on_output=on_output)
 
-    def run_pipeline(self, message: PipelineMessage) -> PipelineResults:
+    async def run_async_pipeline(
+        self,
+        message: PipelineMessage,
+        *,
+        on_output: t.Optional[OnAsyncOutput] = None,
+    ) -> PipelineResults:
+        execute_result = self.execute_message(message)
+        if inspect.isawaitable(execute_result):
+            execute_result = await execute_result
+        elif isinstance(execute_result, AsyncIterator):
+            results = []
+            async for result in execute_result:
+                if on_output and (output := as_output(result)):
+                    await on_output(output)
+                else:
+                    results.append(result)
+            execute_result = results
+        return self.collect_results(execute_result)
+
+    def setup_pipeline(self, message: PipelineMessage) -> None:
+        """Set the pipeline setups states as the message meta args."""
+        pipeline = pipeline_plan(message.info.name).pipeline
+        for setup in PipelineSetup.of(pipeline):
+            state = self.states.get(setup, pipeline=message.info.name)
+            message.set_meta_arg(meta_type=setup.state_type or type(state), value=state)
+
+    def close(self) -> None:
+        self.states.close()
+
+    def execute_message(self, message: PipelineMessage) -> object:
+        self.setup_pipeline(message)
         try:
-            execute_result = message.execute()
+            return message.execute()
         except ValidationError:
             self.logger.error(
                 "Failed to deserialize message",
@@ -46,6 +184,9 @@ class PipelineBootstrap:
             )
             raise
 
+    def collect_results(
+        self, execute_result: object, *, on_output: t.Optional[OnOutput] = None
+    ) -> PipelineResults:
         # Ensure result is an iterator.
         results: Iterator
         if execute_result is None:
@@ -66,10 +207,11 @@ class PipelineBootstrap:
         resources: list[ResourceUsed] = []
         events: list[PipelineEvent] = []
         for result in results:
-            if isinstance(result, PipelineOutput):
-                outputs.append(result)
-            elif isinstance(result, TopicMessage):
-                outputs.append(PipelineOutput(channel="default", message=result))
+            if output := as_output(result):
+                if on_output:
+                    on_output(output)
+                else:
+                    outputs.append(output)
             elif isinstance(result, ResourceUsed):
                 resources.append(result)
             elif isinstance(result, PipelineEvent):
@@ -83,13 +225,21 @@ class PipelineBootstrap:
         self.logger.error("Error while handling pipeline hook", exc_info=exception)
 
 
+def as_output(result: object) -> t.Optional[PipelineOutput]:
+    if isinstance(result, PipelineOutput):
+        return result
+    if isinstance(result, TopicMessage):
+        return PipelineOutput(channel="default", message=result)
+    return None
+
+
 class RemoteException(Exception):
     def __init__(self, tb: TracebackData):
         super().__init__(tb)
         self.remote_traceback = tb
 
     @classmethod
-    def from_exception(cls, exception: Exception) -> "RemoteException":
+    def from_exception(cls, exception: BaseException) -> "RemoteException":
         tb = TracebackData.from_exception(exception)
         return cls(tb)
 
@@ -0,0 +1,175 @@
+import typing as t
+
+import asyncio
+import dataclasses
+from collections import deque
+from collections.abc import AsyncGenerator
+
+from opentelemetry.metrics import get_meter
+
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.worker.executors.executable import ExecutableMessage
+
+# Smoothing of the error rate, and of the baseline latency when it follows a
+# slower downstream.
+ERROR_RATE_ALPHA: t.Final[float] = 0.1
+BASELINE_ALPHA: t.Final[float] = 0.05
+# Number of successful samples the baseline latency is the lowest of.
+BASELINE_WINDOW: t.Final[int] = 1000
+
+
+@dataclasses.dataclass
+class AdaptiveConcurrencyOptions:
+    min_concurrency: int = 1
+    max_concurrency: t.Optional[int] = None
+    initial_concurrency: t.Optional[int] = None
+    latency_tolerance: float = 2.0
+    error_rate_threshold: float = 0.1
+    backoff_ratio: float = 0.9
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the number of messages an executor queue runs at once.
+
+    Each executed message is a sample. The limit grows by one every `limit`
+    successful samples while it is in use, and is multiplied by `backoff_ratio`
+    when a message latency exceeds `latency_tolerance` times the lowest
+    latency of the last `BASELINE_WINDOW` successful samples, or when a
+    message fails while the error rate is above `error_rate_threshold`. After
+    a decrease, the messages already in flight can't trigger another one.
+    """
+
+    def __init__(
+        self,
+        options: AdaptiveConcurrencyOptions,
+        *,
+        executor_name: str,
+        max_concurrency: int,
+    ) -> None:
+        self.options = options
+        self.executor_name = executor_name
+        self.min_concurrency = max(options.min_concurrency, 1)
+        self.max_concurrency = max(
+            options.max_concurrency or max_concurrency, self.min_concurrency
+        )
+        self._limit = float(
+            min(
+                max(
+                    options.initial_concurrency or self.min_concurrency,
+                    self.min_concurrency,
+                ),
+                self.max_concurrency,
+            )
+        )
+        self.in_flight = 0
+        self.error_rate = 0.0
+        # Increasing latencies of the baseline window, with their sample number.
+        self.latencies: deque[tuple[int, float]] = deque()
+        self.successes = 0
+        self.samples_since_decrease = 0
+        self.condition = asyncio.Condition()
+
+        self.limit_counter = get_meter("datalineup.metrics").create_up_down_counter(
+            name="datalineup.executor.concurrency.limit",
+            description="""
+            Current number of messages an executor is allowed to run
+            concurrently.
+            """,
+        )
+        self.limit_counter.add(self.limit, {"executor": self.executor_name})
+
+    def close(self) -> None:
+        self.limit_counter.add(-self.limit, {"executor": self.executor_name})
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def baseline_latency(self) -> t.Optional[float]:
+        return self.latencies[0][1] if self.latencies else None
+
+    async def wait_active(self, index: int) -> None:
+        """Wait until the consumer at `index` is within the limit."""
+        if index < self.limit:
+            return
+        async with self.condition:
+            await self.condition.wait_for(lambda: index < self.limit)
+
+    async def on_message_executed(
+        self, xmsg: ExecutableMessage
+    ) -> AsyncGenerator[None, PipelineResults]:
+        # The hook is shared by every executor.
+        if xmsg.queue.executor != self.executor_name:
+            return
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.in_flight += 1
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+        finally:
+            self.in_flight -= 1
+        await self.update(latency=loop.time() - start, failed=failed)
+
+    async def update(self, *, latency: float, failed: bool) -> None:
+        previous_limit = self.limit
+        self.add_sample(latency=latency, failed=failed)
+        if self.limit == previous_limit:
+            return
+
+        self.limit_counter.add(
+            self.limit - previous_limit, {"executor": self.executor_name}
+        )
+        if self.limit > previous_limit:
+            async with self.condition:
+                self.condition.notify_all()
+
+    def add_sample(self, *, latency: float, failed: bool) -> None:
+        self.samples_since_decrease += 1
+        self.error_rate += (float(failed) - self.error_rate) * ERROR_RATE_ALPHA
+        # The baseline is an estimate of the latency without load. Failures
+        # are left out, they are often much faster, like a validation error.
+        if not failed:
+            self.add_latency(latency)
+        baseline = self.baseline_latency
+
+        failing = failed and self.error_rate > self.options.error_rate_threshold
+        slow = baseline is not None and latency > (
+            baseline * self.options.latency_tolerance
+        )
+        congested = failing or slow
+        # At the minimum limit, a higher latency is the downstream latency
+        # itself, so the baseline follows it.
+        if not failed and baseline is not None and self.limit <= self.min_concurrency:
+            self.raise_baseline(baseline + (latency - baseline) * BASELINE_ALPHA)
+
+        if congested:
+            if self.samples_since_decrease > self.limit:
+                self._limit = max(
+                    self._limit * self.options.backoff_ratio, self.min_concurrency
+                )
+                self.samples_since_decrease = 0
+        elif (self.in_flight + 1) * 2 >= self.limit:
+            # Only grow a limit that is in use.
+            self._limit = min(self._limit + 1 / self._limit, self.max_concurrency)
+
+    def add_latency(self, latency: float) -> None:
+        self.successes += 1
+        while self.latencies and self.latencies[-1][1] >= latency:
+            self.latencies.pop()
+        self.latencies.append((self.successes, latency))
+        if self.latencies[0][0] <= self.successes - BASELINE_WINDOW:
+            self.latencies.popleft()
+
+    def raise_baseline(self, baseline: float) -> None:
+        # Latencies under the new baseline take its value, and keep the
+        # sample number of the most recent one.
+        sample = None
+        while self.latencies and self.latencies[0][1] < baseline:
+            sample, _ = self.latencies.popleft()
+        if sample is not None:
+            self.latencies.appendleft((sample, baseline))
@@ -13,6 +13,7 @@ from asyncstdlib import nullcontext
 from datalineup_engine.core import ResourceUsed
 from datalineup_engine.core import TopicMessage
 from datalineup_engine.core.api import QueueItem
+from datalineup_engine.core.resource import KEYED_TYPE_RE
 from datalineup_engine.utils import flatten
 from datalineup_engine.utils import iterators
 from datalineup_engine.utils.config import LazyConfig
@@ -20,6 +21,7 @@ from datalineup_engine.utils.log import getLogger
 from datalineup_engine.worker.context import job_context
 from datalineup_engine.worker.context import message_context
 from datalineup_engine.worker.executors.parkers import Parkers
+from datalineup_engine.worker.executors.streaming import OutputStream
 from datalineup_engine.worker.pipeline_message import PipelineMessage
 from datalineup_engine.worker.resources.manager import ResourceContext
 from datalineup_engine.worker.resources.manager import ResourcesContext
@@ -50,6 +52,11 @@ class ExecutableMessage:
         self.output = output
         self.resources: dict[str, ResourceContext] = {}
         self.queue = queue
+        # Set by the executor queue when outputs are streamed.
+        self.output_stream: t.Optional[OutputStream] = None
+        # Seconds the executor took to process the message, set by the
+        # executor queue. Resources are used for that long.
+        self.execution_duration: t.Optional[float] = None
 
     @property
     def id(self) -> str:
@@ -75,10 +82,20 @@ class ExecutableMessage:
         self.message.update_with_resources(resources_data)
         return resources_data
 
-    def update_resources_used(self, resources_used: list[ResourceUsed]) -> None:
+    def update_resources_used(
+        self, resources_used: list[ResourceUsed], *, failed: bool = False
+    ) -> None:
         if not self.resources:
             return
 
+        if self.execution_duration is not None:
+            failed_types = {r.type for r in resources_used if r.failed}
+            for typ, resource in self.resources.items():
+                resource.report(
+                    duration=self.execution_duration,
+                    failed=failed or typ in failed_types,
+                )
+
         for resource_used in resources_used:
             if resource_used.release_at is not None:
                 self.resources[resource_used.type].release_later(
@@ -226,6 +243,18 @@ class ExecutableQueue:
     def options(self) -> Options:
         return self.config.cast_namespace(JOB_NAMESPACE, self.Options)
 
+    @property
+    def required_resources(self) -> set[str]:
+        """Resource types the pipeline needs, unless provided by its args.
+
+        Keyed resources depend on each message, so they aren't included.
+        """
+        return {
+            typ
+            for name, typ in self.pipeline.info.resources.items()
+            if name not in self.pipeline.args and not KEYED_TYPE_RE.match(typ)
+        }
+
     @cached_property
     def config(self) -> LazyConfig:
         return LazyConfig(
@@ -1,12 +1,17 @@
+import typing as t
+
 import asyncio
+import dataclasses
 
 from datalineup_engine.core import api
 from datalineup_engine.utils.asyncutils import TasksGroupRunner
 from datalineup_engine.utils.log import getLogger
+from datalineup_engine.utils.options import fromdict
 from datalineup_engine.worker.services import Services
 
 from . import Executor
 from . import build_executor
+from .concurrency import AdaptiveConcurrencyOptions
 from .executable import ExecutableMessage
 from .executable import ExecutableQueue
 from .queue import ExecutorQueue
@@ -71,18 +76,44 @@ class ExecutorsManager:
 
 
 class ExecutorWorker:
+    @dataclasses.dataclass
+    class Options:
+        """Options read from the executor definition, along with the options
+        of the executor itself."""
+
+        adaptive_concurrency: t.Optional[AdaptiveConcurrencyOptions] = None
+        # Outputs buffered per message while they are streamed. Outputs are
+        # published once the pipeline completes when unset.
+        output_buffer_size: t.Optional[int] = None
+        # Messages the scheduler can get ahead of the executor.
+        prefetch: int = 1
+
+        def __post_init__(self) -> None:
+            if self.prefetch < 1:
+                raise ValueError("prefetch must be at least 1")
+            if self.output_buffer_size is not None and self.output_buffer_size < 1:
+                raise ValueError("output_buffer_size must be at least 1")
+
     def __init__(
         self,
         *,
         executor: Executor,
         services: Services,
+        adaptive_concurrency: t.Optional[AdaptiveConcurrencyOptions] = None,
+        output_buffer_size: t.Optional[int] = None,
+        prefetch: int = 1,
     ) -> None:
         self.services = services
         self.executor_queue = ExecutorQueue(
             executor=executor,
             services=services,
+            adaptive_concurrency=adaptive_concurrency,
+            output_buffer_size=output_buffer_size,
+            prefetch=prefetch,
+        )
+        self.scheduler: Scheduler[ExecutableMessage] = Scheduler(
+            resources_manager=services.s.resources_manager
         )
-        self.scheduler: Scheduler[ExecutableMessage] = Scheduler()
         self.logger = getLogger(__name__, self)
 
     @classmethod
@@ -92,10 +123,14 @@ class ExecutorWorker:
         *,
         services: Services,
     ) -> "ExecutorWorker":
+        options = fromdict(executor_definition.options, cls.Options)
         executor = build_executor(executor_definition, services=services)
         return cls(
             executor=executor,
             services=services,
+            adaptive_concurrency=options.adaptive_concurrency,
+            output_buffer_size=options.output_buffer_size,
+            prefetch=options.prefetch,
         )
 
     async def run(self) -> None:
@@ -119,7 +154,7 @@ class ExecutorWorker:
         await self.executor_queue.close()
 
     def add_schedulable(self, schedulable: ExecutableQueue) -> None:
-        self.scheduler.add(schedulable)
+        self.scheduler.add(schedulable, resources=schedulable.required_resources)
 
     def remove_schedulable(self, schedulable: ExecutableQueue) -> None:
         self.scheduler.remove(schedulable)
@@ -2,88 +2,520 @@ import typing as t
 
 import asyncio
 import concurrent.futures
+import contextlib
 import dataclasses
 import enum
+import multiprocessing.util
 import os
+from collections.abc import Iterator
 from functools import partial
 
+from opentelemetry.metrics import get_meter
+
 from datalineup_engine.core import PipelineResults
+from datalineup_engine.core.pipeline import CancellationToken
+from datalineup_engine.utils.config import LazyConfig
 from datalineup_engine.utils.hooks import EventHook
 from datalineup_engine.worker.executors.executable import ExecutableMessage
 from datalineup_engine.worker.pipeline_message import PipelineMessage
 from datalineup_engine.worker.services import Services
 
 from . import Executor
+from .async_pool import AsyncProcessPool
+from .batching import BatchOutcome
+from .batching import BatchResult
+from .batching import MessageBatcher
+from .bootstrap import OnOutput
 from .bootstrap import PipelineBootstrap
+from .bootstrap import PipelineStates
+from .bootstrap import RemoteException
 from .bootstrap import wrap_remote_exception
+from .recycling import RecycleLimits
+from .recycling import RecycleReason
+from .recycling import rss_mb
+from .routing import StickyRouting
+from .shared_memory import RemoteSharedMemory
+from .shared_memory import SharedMemoryTransport
+from .timeouts import ChildControl
+from .timeouts import TimeoutOptions
+from .timeouts import timeout_error
+from .timeouts import wait_timeout
+
+PROCESS_EXECUTOR_NAMESPACE: t.Final[str] = "process_executor"
 
 _bootstraper = None
+# Set by the executor to cancel the call running in a single child pool.
+_child_control: t.Optional[ChildControl] = None
+
+T = t.TypeVar("T")
 
 
 class PoolType(enum.Enum):
     PROCESS = "process"
     THREAD = "thread"
+    ASYNC_PROCESS = "async_process"
 
 
 def process_initializer(
     *,
     executor_initialized: EventHook[PipelineBootstrap],
     pool_type: PoolType,
+    states: t.Optional[PipelineStates] = None,
+    child_control: t.Optional[ChildControl] = None,
 ) -> None:
-    global _bootstraper
+    global _bootstraper, _child_control
 
-    if pool_type is PoolType.PROCESS:
+    if child_control:
+        child_control.attach()
+    _child_control = child_control
+    _bootstraper = PipelineBootstrap(
+        initialized_hook=executor_initialized, states=states
+    )
+
+    if pool_type is not PoolType.THREAD:
         # Ignore signals in the process pool since we handle it from the worker
         # process.
         import signal
 
         signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    _bootstraper = PipelineBootstrap(initialized_hook=executor_initialized)
+        # Teardown the pipeline setups when the child process exits.
+        multiprocessing.util.Finalize(None, _bootstraper.close, exitpriority=10)
+
+
+@dataclasses.dataclass(eq=False)
+class PoolSlot:
+    executor: concurrent.futures.Executor
+    max_workers: int
+    # Calls executed since the pool got created, for recycling.
+    tasks: int = 0
+    in_flight: int = 0
+    # Cancels or kills the call of a single child process pool.
+    control: t.Optional[ChildControl] = None
+
+
+def measured_call(func: t.Callable[[], T]) -> tuple[T, float]:
+    return func(), rss_mb()
 
 
 class ProcessExecutor(Executor):
+    """Execute pipelines in a process or thread pool."""
+
     @dataclasses.dataclass
     class Options:
         max_workers: t.Optional[int] = None
         pool_type: PoolType = PoolType.PROCESS
+        # Messages sent to the pool in a single call, once the batch is full or
+        # `batch_linger_ms` elapsed. The concurrency is scaled by the batch size
+        # to keep the batches filled.
+        batch_size: int = 1
+        batch_linger_ms: float = 10
+        # Process pools pass str and bytes args and outputs of at least that
+        # many bytes through shared memory instead of pickling them.
+        shared_memory_threshold: t.Optional[int] = None
+        # Coroutine pipelines awaited concurrently by each `async_process` child.
+        per_process_concurrency: int = 10
+        # Recycle children once they executed that many messages or reached that
+        # RSS. Shared `process` pools are replaced as a whole, on the average
+        # task count or once one of their children reached the RSS.
+        max_tasks_per_child: t.Optional[int] = None
+        max_rss_mb: t.Optional[float] = None
+        # Seconds a single unbatched message may run before its
+        # CancellationToken is set, and `timeout_grace` seconds more before its
+        # child gets killed. Shared `process` pools, used when only jobs or
+        # messages set a timeout, can't cancel nor kill a single child.
+        timeout: t.Optional[float] = None
+        timeout_grace: float = 5
+        # Run messages of a pipeline, or sharing a tag value, in the same few
+        # children. `process` pools then run each child in its own pool.
+        sticky_routing: t.Optional[StickyRouting] = None
+
+        def __post_init__(self) -> None:
+            batched = self.batch_size > 1
+            if self.pool_type is PoolType.THREAD:
+                if self.sticky_routing:
+                    raise ValueError("sticky_routing is not supported by thread pools")
+                if self.max_tasks_per_child is not None or self.max_rss_mb is not None:
+                    raise ValueError(
+                        "max_tasks_per_child and max_rss_mb are not supported by"
+                        " thread pools"
+                    )
+            if batched and self.sticky_routing:
+                raise ValueError("sticky_routing is not supported with batch_size")
+            if batched and self.pool_type is PoolType.ASYNC_PROCESS:
+                raise ValueError("batch_size is not supported by async_process pools")
 
     def __init__(self, options: Options, services: Services) -> None:
+        self.options = options
+        self.config = LazyConfig([{PROCESS_EXECUTOR_NAMESPACE: self.options}])
+        self.pool_type = options.pool_type
         self.max_workers = options.max_workers or os.cpu_count() or 1
+        self.batch_size = max(options.batch_size, 1)
+        self.batcher = MessageBatcher(
+            batch_size=self.batch_size,
+            linger=options.batch_linger_ms / 1000,
+            execute=self.execute_batch,
+        )
+        self.per_process_concurrency = 1
+        self.sticky_routing = options.sticky_routing
+        if self.sticky_routing:
+            self.sticky_fallbacks = get_meter("datalineup.metrics").create_counter(
+                name="datalineup.executor.process.sticky_fallbacks",
+                description="""
+                Number of messages sent to another child process because their
+                preferred children were saturated.
+                """,
+            )
+        self.recycle_limits = RecycleLimits(
+            max_tasks=options.max_tasks_per_child, max_rss_mb=options.max_rss_mb
+        )
+        if self.recycle_limits:
+            self.recycles = get_meter("datalineup.metrics").create_counter(
+                name="datalineup.executor.process.recycles",
+                description="""
+                Number of times child processes got recycled, by reason. Process
+                pools shared by several children are recycled as a whole.
+                """,
+            )
+
+        # Thread pools don't copy the messages, so shared memory is only
+        # useful to process pools.
+        self.shared_memory: t.Optional[SharedMemoryTransport] = None
+        if options.shared_memory_threshold and options.pool_type is PoolType.PROCESS:
+            self.shared_memory = SharedMemoryTransport(
+                threshold=options.shared_memory_threshold
+            )
+            self.shared_memory_bytes = get_meter("datalineup.metrics").create_counter(
+                name="datalineup.executor.process.shared_memory",
+                unit="By",
+                description="""
+                Total bytes passed to and from the pool through shared memory
+                instead of being copied.
+                """,
+            )
 
-        pool_cls: t.Union[
-            t.Type[concurrent.futures.ProcessPoolExecutor],
-            t.Type[concurrent.futures.ThreadPoolExecutor],
-        ]
-        if options.pool_type is PoolType.PROCESS:
-            pool_cls = concurrent.futures.ProcessPoolExecutor
-        elif options.pool_type is PoolType.THREAD:
-            pool_cls = concurrent.futures.ThreadPoolExecutor
-
-        self.pool_executor = pool_cls(
-            max_workers=self.max_workers,
-            initializer=partial(
-                process_initializer,
-                executor_initialized=services.s.hooks.executor_initialized,
-                pool_type=options.pool_type,
-            ),
+        # Threads share the pipeline setups, that are torn down on close.
+        self.states: t.Optional[PipelineStates] = None
+        if options.pool_type is PoolType.THREAD:
+            self.states = PipelineStates()
+        self.initializer = partial(
+            process_initializer,
+            executor_initialized=services.s.hooks.executor_initialized,
+            pool_type=options.pool_type,
+            states=self.states,
         )
+        self.async_pool: t.Optional[AsyncProcessPool] = None
+        if options.pool_type is PoolType.ASYNC_PROCESS:
+            self.per_process_concurrency = max(options.per_process_concurrency, 1)
+            self.async_pool = AsyncProcessPool(
+                max_workers=self.max_workers,
+                concurrency=self.per_process_concurrency,
+                initializer=self.initializer,
+                execute=self.remote_execute_async,
+                limits=self.recycle_limits,
+                on_recycle=self.on_recycle,
+            )
+            return
 
-    async def process_message(self, message: ExecutableMessage) -> PipelineResults:
+        # A timeout only kills the child running its message when each child
+        # runs in its own pool.
+        self.single_child_pools = bool(self.sticky_routing) or (
+            options.pool_type is PoolType.PROCESS
+            and options.timeout is not None
+            and self.batch_size == 1
+        )
+        if self.single_child_pools:
+            self.slots = [self.create_slot(1) for _ in range(self.max_workers)]
+        else:
+            self.slots = [self.create_slot(self.max_workers)]
+
+    def create_slot(self, max_workers: int) -> PoolSlot:
+        control = None
+        if self.pool_type is PoolType.PROCESS and max_workers == 1:
+            control = ChildControl.create()
+        return PoolSlot(
+            executor=self.create_pool_executor(max_workers, control),
+            max_workers=max_workers,
+            control=control,
+        )
+
+    def create_pool_executor(
+        self,
+        max_workers: int,
+        control: t.Optional[ChildControl] = None,
+    ) -> concurrent.futures.Executor:
+        if self.pool_type is PoolType.PROCESS:
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=partial(self.initializer, child_control=control),
+            )
+        return concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, initializer=self.initializer
+        )
+
+    def route(self, message: PipelineMessage, loads: list[int], capacity: int) -> int:
+        assert self.sticky_routing  # noqa: S101
+        index, fallback = self.sticky_routing.select(message, loads, capacity=capacity)
+        if fallback:
+            self.sticky_fallbacks.add(1, {"executor": self.name})
+        return index
+
+    def select_slot(self, message: PipelineMessage) -> PoolSlot:
+        if not self.single_child_pools:
+            return self.slots[0]
+        if not self.sticky_routing:
+            return min(self.slots, key=lambda slot: slot.in_flight)
+        loads = [slot.in_flight for slot in self.slots]
+        return self.slots[self.route(message, loads, capacity=1)]
+
+    async def run_in_pool(
+        self,
+        func: t.Callable[[], T],
+        *,
+        slot: t.Optional[PoolSlot] = None,
+        tasks: int = 1,
+        timeout: t.Optional[float] = None,
+        grace: float = 0,
+        token: t.Optional[CancellationToken] = None,
+    ) -> T:
         loop = asyncio.get_running_loop()
-        execute = partial(self.remote_execute, message=message.message.as_remote())
-        return await loop.run_in_executor(self.pool_executor, execute)
+        slot = slot or self.slots[0]
+        pool_executor = slot.executor
+        measure_rss = self.recycle_limits.max_rss_mb is not None
+        call: t.Callable[[], t.Any] = func
+        if measure_rss:
+            call = partial(measured_call, func)
+        control = slot.control
+        if control:
+            control.reset()
+        future = loop.run_in_executor(pool_executor, call)
+        slot.in_flight += 1
+
+        rss: t.Optional[float] = None
+        try:
+            if timeout is not None:
+                try:
+                    await wait_timeout(
+                        future,
+                        timeout=timeout,
+                        grace=grace,
+                        on_timeout=partial(self.cancel_call, token, control),
+                    )
+                except asyncio.TimeoutError:
+                    if not future.done() and control:
+                        # The pipeline is stuck, like in a C extension.
+                        self.kill_call(slot, pool_executor, control)
+                    future.cancel()
+                    raise
+                except BaseException:
+                    future.cancel()
+                    raise
+            result = await future
+            if measure_rss:
+                result, rss = result
+            return t.cast(T, result)
+        finally:
+            slot.in_flight -= 1
+            # Calls still running in a retired pool don't count toward the new one.
+            if self.recycle_limits and pool_executor is slot.executor:
+                slot.tasks += tasks
+                reason = self.recycle_limits.exceeded(
+                    tasks=slot.tasks // slot.max_workers, rss_mb=rss
+                )
+                if reason:
+                    self.replace_pool_executor(slot)
+                    self.on_recycle(reason)
+
+    @staticmethod
+    def cancel_call(
+        token: t.Optional[CancellationToken], control: t.Optional[ChildControl]
+    ) -> None:
+        if token:
+            token._cancel()
+        if control:
+            control.cancel()
+
+    def kill_call(
+        self,
+        slot: PoolSlot,
+        pool_executor: concurrent.futures.Executor,
+        control: ChildControl,
+    ) -> None:
+        # concurrent.futures can't kill a single child, so its whole pool gets
+        # replaced before its child is killed.
+        if pool_executor is slot.executor:
+            self.replace_pool_executor(slot)
+        control.kill()
+
+    def replace_pool_executor(self, slot: PoolSlot) -> None:
+        pool_executor = slot.executor
+        if slot.control:
+            # The retired pool keeps its own control for its calls in flight.
+            slot.control = ChildControl.create()
+        slot.executor = self.create_pool_executor(slot.max_workers, slot.control)
+        slot.tasks = 0
+        # The replaced pool finishes its calls in flight before stopping.
+        pool_executor.shutdown(wait=False)
+
+    def on_recycle(self, reason: RecycleReason) -> None:
+        self.recycles.add(1, {"executor": self.name, "reason": reason.value})
+
+    async def process_message(self, message: ExecutableMessage) -> PipelineResults:
+        # Only the timeout can be overridden per job or message.
+        config = self.config.load_object(message.config)
+        options = config.cast_namespace(PROCESS_EXECUTOR_NAMESPACE, TimeoutOptions)
+        try:
+            return await self.execute_message(message, options)
+        except asyncio.TimeoutError:
+            raise timeout_error(options.timeout) from None
+
+    async def execute_message(
+        self, message: ExecutableMessage, options: TimeoutOptions
+    ) -> PipelineResults:
+        if self.async_pool:
+            index = None
+            if self.sticky_routing:
+                index = self.route(
+                    message.message,
+                    self.async_pool.loads(),
+                    capacity=self.per_process_concurrency,
+                )
+            return await self.async_pool.submit(
+                message.message.as_remote(),
+                timeout=options.timeout,
+                grace=options.timeout_grace,
+                index=index,
+            )
+        if self.batch_size > 1:
+            return await self.batcher.submit(message.message.as_remote())
+
+        on_output = None
+        if message.output_stream and self.pool_type is PoolType.THREAD:
+            on_output = message.output_stream.put_threadsafe
+
+        with self.shared_memory_call() as shared_memory:
+            remote_message = message.message.as_remote()
+            token = None
+            if options.timeout is not None and self.pool_type is PoolType.THREAD:
+                # Threads share the token, it can't be set in child processes.
+                token = CancellationToken()
+                remote_message.set_meta_arg(meta_type=CancellationToken, value=token)
+            if shared_memory:
+                remote_message = shared_memory.export_message(remote_message)
+            execute = partial(
+                self.remote_execute,
+                message=remote_message,
+                shared_memory=shared_memory,
+                on_output=on_output,
+            )
+            results = await self.run_in_pool(
+                execute,
+                slot=self.select_slot(message.message),
+                timeout=options.timeout,
+                grace=options.timeout_grace,
+                token=token,
+            )
+            if shared_memory:
+                results = shared_memory.import_results(results)
+            return results
+
+    async def execute_batch(
+        self, messages: list[PipelineMessage]
+    ) -> list[BatchOutcome]:
+        with self.shared_memory_call() as shared_memory:
+            if shared_memory:
+                messages = [shared_memory.export_message(m) for m in messages]
+            execute = partial(
+                self.remote_execute_batch,
+                messages=messages,
+                shared_memory=shared_memory,
+            )
+            results = await self.run_in_pool(execute, tasks=len(messages))
+            if not shared_memory:
+                return list(results)
+
+            # Always import the results so their segments are unlinked.
+            outcomes: list[BatchOutcome] = []
+            for result in results:
+                try:
+                    if isinstance(result, PipelineResults):
+                        result = shared_memory.import_results(result)
+                    outcomes.append(result)
+                except Exception as e:
+                    outcomes.append(e)
+            return outcomes
+
+    @contextlib.contextmanager
+    def shared_memory_call(self) -> Iterator[t.Optional[RemoteSharedMemory]]:
+        if not self.shared_memory:
+            yield None
+            return
+
+        shared_memory = self.shared_memory.new_call()
+        try:
+            yield shared_memory
+        finally:
+            shared_memory.release()
+            params = {"executor": self.name}
+            self.shared_memory_bytes.add(
+                shared_memory.exported_bytes, params | {"direction": "execute"}
+            )
+            self.shared_memory_bytes.add(
+                shared_memory.imported_bytes, params | {"direction": "results"}
+            )
 
     @property
     def concurrency(self) -> int:
-        return self.max_workers
+        return self.max_workers * self.batch_size * self.per_process_concurrency
 
     async def close(self) -> None:
-        self.pool_executor.shutdown(wait=False, cancel_futures=True)
+        self.batcher.close()
+        if self.async_pool:
+            await self.async_pool.shutdown()
+        else:
+            for slot in self.slots:
+                slot.executor.shutdown(wait=False, cancel_futures=True)
+        if self.states:
+            self.states.close()
 
     @staticmethod
-    def remote_execute(message: PipelineMessage) -> PipelineResults:
+    def remote_execute(
+        message: PipelineMessage,
+        shared_memory: t.Optional[RemoteSharedMemory] = None,
+        on_output: t.Optional[OnOutput] = None,
+    ) -> PipelineResults:
         if not _bootstraper:
             raise ValueError("process_initializer must be called")
         with wrap_remote_exception():
-            return _bootstraper.bootstrap_pipeline(message)
+            if shared_memory:
+                message = shared_memory.import_message(message)
+            if _child_control is not None:
+                token = CancellationToken()
+                token.event = _child_control.cancel_event  # type: ignore[assignment]
+                message.set_meta_arg(meta_type=CancellationToken, value=token)
+            results = _bootstraper.bootstrap_pipeline(message, on_output=on_output)
+            if shared_memory:
+                results = shared_memory.export_results(results)
+            return results
+
+    @staticmethod
+    async def remote_execute_async(message: PipelineMessage) -> PipelineResults:
+        if not _bootstraper:
+            raise ValueError("process_initializer must be called")
+        with wrap_remote_exception():
+            return await _bootstraper.bootstrap_async_pipeline(message)
+
+    @staticmethod
+    def remote_execute_batch(
+        messages: list[PipelineMessage],
+        shared_memory: t.Optional[RemoteSharedMemory] = None,
+    ) -> list[BatchResult]:
+        results: list[BatchResult] = []
+        for message in messages:
+            try:
+                results.append(
+                    ProcessExecutor.remote_execute(message, shared_memory=shared_memory)
+                )
+            except RemoteException as e:
+                results.append(e)
+        return results
@@ -4,6 +4,9 @@ import asyncio
 import contextlib
 import datetime
 import sys
+from collections.abc import Iterable
+
+from opentelemetry.metrics import get_meter
 
 from datalineup_engine.core import PipelineOutput
 from datalineup_engine.core import PipelineResults
@@ -18,9 +21,13 @@ from datalineup_engine.worker.services import Services
 from datalineup_engine.worker.services.hooks import MessagePublished
 from datalineup_engine.worker.services.hooks import PipelineEventsEmitted
 from datalineup_engine.worker.services.hooks import ResultsProcessed
+from datalineup_engine.worker.topic import Topic
 
 from . import Executor
+from .concurrency import AdaptiveConcurrency
+from .concurrency import AdaptiveConcurrencyOptions
 from .executable import ExecutableMessage
+from .streaming import OutputStream
 
 
 class ExecutorQueue:
@@ -30,10 +37,19 @@ class ExecutorQueue:
         self,
         executor: Executor,
         services: Services,
+        adaptive_concurrency: t.Optional[AdaptiveConcurrencyOptions] = None,
+        output_buffer_size: t.Optional[int] = None,
+        prefetch: int = 1,
     ) -> None:
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1")
         self.logger = getLogger(__name__, self)
         self.submit_lock = asyncio.Lock()
-        self.queue: asyncio.Queue[ExecutableMessage] = asyncio.Queue(maxsize=1)
+        # Messages ready to execute, with the loop time they were queued at.
+        # The scheduler can get up to `prefetch` messages ahead of the executor.
+        self.queue: asyncio.Queue[tuple[float, ExecutableMessage]] = asyncio.Queue(
+            maxsize=prefetch
+        )
         self.submit_tasks = TasksGroupRunner(name="executor-submit")
         self.processing_tasks = TasksGroupRunner(name="executor-queue")
         self.consuming_tasks = TasksGroupRunner(name="executor-consuming")
@@ -43,20 +59,53 @@ class ExecutorQueue:
         self.services = services
         self.poll = Cancellable(self.queue.get)
 
+        self.concurrency = executor.concurrency
+        self.adaptive_concurrency: t.Optional[AdaptiveConcurrency] = None
+        if adaptive_concurrency:
+            self.adaptive_concurrency = AdaptiveConcurrency(
+                adaptive_concurrency,
+                executor_name=executor.name,
+                max_concurrency=executor.concurrency,
+            )
+            self.concurrency = self.adaptive_concurrency.max_concurrency
+
+        # When set, outputs are published while the pipeline runs, with at most
+        # this many outputs buffered per message.
+        self.output_buffer_size = output_buffer_size
+
+        self.queue_wait = get_meter("datalineup.metrics").create_histogram(
+            name="datalineup.executor.queue.wait",
+            unit="ms",
+            description="""Time messages spent in the executor queue, from their
+            submission to the start of their execution.
+            """,
+        )
+
     def start(self) -> None:
         self.is_running = True
-        for i in range(self.executor.concurrency):
+        if self.adaptive_concurrency:
+            self.services.s.hooks.message_executed.register(
+                self.adaptive_concurrency.on_message_executed
+            )
+        for i in range(self.concurrency):
             self.logger.debug("Spawning new queue task")
             self.processing_tasks.create_task(
-                self.run_queue(), name=f"executor-queue-{i}"
+                self.run_queue(i), name=f"executor-queue-{i}"
             )
         self.consuming_tasks.start()
         self.submit_tasks.start()
         self.processing_tasks.start()
 
-    async def run_queue(self) -> None:
+    async def run_queue(self, index: int) -> None:
         while self.is_running:
-            processable = await self.poll()
+            if self.adaptive_concurrency:
+                # Consumers above the current limit stay idle.
+                await self.adaptive_concurrency.wait_active(index)
+            queued_at, processable = await self.poll()
+            self.queue_wait.record(
+                max(round((asyncio.get_running_loop().time() - queued_at) * 1000), 0),
+                {"executor": processable.queue.definition.executor},
+            )
             processable._executing_context.callback(self.queue.task_done)
             with contextlib.suppress(BaseException), processable.datalineup_context():
                 async with (
@@ -68,6 +117,10 @@ class ExecutorQueue:
                     async def scope(
                         xmsg: ExecutableMessage,
                     ) -> PipelineResults:
+                        # Time the execution only, without the time the
+                        # message held its resources waiting in the queue.
+                        loop = asyncio.get_running_loop()
+                        started_at = loop.time()
                         try:
                             return await self.executor.process_message(xmsg)
                         except Exception:
@@ -83,6 +136,20 @@ class ExecutorQueue:
                                 exc_traceback=exc_traceback,
                             )
                             raise
+                        finally:
+                            xmsg.execution_duration = loop.time() - started_at
+
+                    output_stream_task = None
+                    if self.output_buffer_size:
+                        processable.output_stream = OutputStream(
+                            buffer_size=self.output_buffer_size
+                        )
+                        output_stream_task = self.consuming_tasks.create_task(
+                            self.consume_stream(
+                                processable=processable,
+                                stream=processable.output_stream,
+                            )
+                        )
 
                     results = None
                     error = None
@@ -103,10 +170,21 @@ class ExecutorQueue:
                                     context_error=(
                                         error if error and not error.handled else None
                                     ),
+                                    output_stream_task=output_stream_task,
                                 )
                             )
 
-                            processable.update_resources_used(results.resources)
+                            processable.update_resources_used(
+                                results.resources, failed=error is not None
+                            )
+                        else:
+                            processable.update_resources_used([], failed=True)
+                            if processable.output_stream and output_stream_task:
+                                # Like without streaming, outputs aren't
+                                # published once the message failed. Outputs
+                                # published before the failure are kept.
+                                await processable.output_stream.discard()
+                                await output_stream_task
 
                     if error:
                         error.reraise()
@@ -118,10 +196,20 @@ class ExecutorQueue:
         results: PipelineResults,
         context: contextlib.AsyncExitStack,
         context_error: t.Optional[HandledError],
+        output_stream_task: t.Optional[asyncio.Task] = None,
     ) -> None:
         @self.services.s.hooks.results_processed.emit
         async def scope(msg: ResultsProcessed) -> None:
-            await self.consume_output(processable=xmsg, output=msg.results.outputs)
+            if xmsg.output_stream and output_stream_task:
+                # Outputs that weren't streamed go through the same stream so
+                # publishing errors are raised together.
+                for output in msg.results.outputs:
+                    await xmsg.output_stream.put(output)
+                await xmsg.output_stream.close()
+                if error := await output_stream_task:
+                    raise error
+            else:
+                await self.consume_output(processable=xmsg, output=msg.results.outputs)
 
             await self.services.s.hooks.pipeline_events_emitted.emit(
                 PipelineEventsEmitted(events=msg.results.events, xmsg=xmsg)
@@ -148,6 +236,8 @@ class ExecutorQueue:
             if await self.acquire_resources(processable, wait=False):
                 await self.queue_submit(processable)
             else:
+                # The scheduler only polls queues once their resources are
+                # available, but they might have been taken since.
                 # Park the queue from which the processable comes from.
                 # The queue should be unparked once the resources are acquired.
                 processable.park()
@@ -190,50 +280,131 @@ class ExecutorQueue:
 
     async def queue_submit(self, processable: ExecutableMessage) -> None:
         await self.services.s.hooks.message_submitted.emit(processable)
-        await self.queue.put(processable)
+        await self.queue.put((asyncio.get_running_loop().time(), processable))
+
+    async def consume_stream(
+        self, *, processable: ExecutableMessage, stream: OutputStream
+    ) -> t.Optional[Exception]:
+        # Errors are returned to the results processing instead of failing
+        # the consuming task.
+        try:
+            await self.consume_output(processable=processable, output=stream)
+        except Exception as e:
+            return e
+        finally:
+            stream.stop()
+        return None
 
     async def consume_output(
-        self, *, processable: ExecutableMessage, output: list[PipelineOutput]
+        self,
+        *,
+        processable: ExecutableMessage,
+        output: t.Union[Iterable[PipelineOutput], OutputStream],
     ) -> None:
         try:
             errors = []
-            for item in output:
-                topics = processable.output.get(item.channel, [])
-                for topic in topics:
-
-                    @self.services.s.hooks.message_published.emit
-                    async def scope(message_published: MessagePublished) -> None:
-                        if topic is None:
-                            return
-                        with contextlib.suppress(Exception):
-                            if await topic.publish(item.message, wait=False):
-                                return
-
-                        @self.services.s.hooks.output_blocked.emit
-                        async def scope(_: MessagePublished) -> None:
-                            processable.park()
-                            await topic.publish(item.message, wait=True)
-
-                        await scope(message_published)
-
-                    try:
-                        await scope(
-                            MessagePublished(xmsg=processable, topic=topic, output=item)
+            if isinstance(output, OutputStream):
+                async for batch in output.batches():
+                    errors.extend(
+                        await self.publish_outputs(
+                            processable=processable, outputs=batch
                         )
-                    except Exception as e:
-                        errors.append(e)
+                    )
+            else:
+                errors = await self.publish_outputs(
+                    processable=processable, outputs=list(output)
+                )
             if errors:
                 raise ExceptionGroup("Failed to process outputs", errors)
 
         finally:
             await processable.unpark()
 
+    async def publish_outputs(
+        self, *, processable: ExecutableMessage, outputs: list[PipelineOutput]
+    ) -> list[Exception]:
+        """Publish outputs to their topics, each topic concurrently with the
+        others, and return the publishing errors."""
+        batches: dict[int, tuple[Topic, list[PipelineOutput]]] = {}
+        for item in outputs:
+            for topic in processable.output.get(item.channel, []):
+                batches.setdefault(id(topic), (topic, []))[1].append(item)
+
+        errors = await asyncio.gather(
+            *[
+                self.publish_batch(processable=processable, topic=topic, items=items)
+                for topic, items in batches.values()
+            ]
+        )
+        return [e for topic_errors in errors for e in topic_errors]
+
+    async def publish_batch(
+        self,
+        *,
+        processable: ExecutableMessage,
+        topic: Topic,
+        items: list[PipelineOutput],
+    ) -> list[Exception]:
+        @self.services.s.hooks.output_blocked.emit
+        async def publish_blocked(message_published: MessagePublished) -> None:
+            processable.park()
+            await topic.publish(message_published.output.message, wait=True)
+
+        # Each message is published within its own hooks scope, in its own
+        # task. Once every scope is entered, the messages are sent to the
+        # topic as a single batch. Those that couldn't be published right
+        # away then fall back to a blocking publish, in order.
+        messages = [item.message for item in items]
+        published: asyncio.Future[list[bool]] = (
+            asyncio.get_running_loop().create_future()
+        )
+        waiting = len(items)
+        done = [asyncio.Event() for _ in items]
+
+        async def publish_many() -> None:
+            try:
+                result = await topic.publish_many(messages, wait=False)
+            except Exception:
+                self.logger.exception("Failed to publish outputs to %s", topic.name)
+                result = [False] * len(messages)
+            published.set_result(result)
+
+        def publish(index: int, item: PipelineOutput) -> t.Awaitable[None]:
+            @self.services.s.hooks.message_published.emit
+            async def scope(message_published: MessagePublished) -> None:
+                nonlocal waiting
+                try:
+                    waiting -= 1
+                    if not waiting:
+                        await publish_many()
+                    is_published = (await published)[index]
+                    # Messages are done in order, like they are published.
+                    if index:
+                        await done[index - 1].wait()
+                    if not is_published:
+                        await publish_blocked(message_published)
+                finally:
+                    done[index].set()
+
+            return scope(MessagePublished(xmsg=processable, topic=topic, output=item))
+
+        results = await asyncio.gather(
+            *[publish(index, item) for index, item in enumerate(items)],
+            return_exceptions=True,
+        )
+        return [result for result in results if isinstance(result, Exception)]
+
     async def close(self) -> None:
         self.is_running = False
         # Shutdown the queue task first so we don't process any new item.
         self.logger.debug("Closing processing tasks")
         self.poll.cancel()
         await self.processing_tasks.close(timeout=self.CLOSE_TIMEOUT.total_seconds())
+        # Release the resources held by prefetched messages that won't run.
+        while not self.queue.empty():
+            _, processable = self.queue.get_nowait()
+            with contextlib.suppress(Exception):
+                await processable._executing_context.aclose()
         # Delayed tasks waiting on resource
         self.logger.debug("Closing submitting tasks")
         await self.submit_tasks.close()
@@ -241,5 +412,11 @@ class ExecutorQueue:
         self.logger.debug("Closing consuming tasks")
         await self.consuming_tasks.close(timeout=self.CLOSE_TIMEOUT.total_seconds())
 
+        if self.adaptive_concurrency:
+            self.services.s.hooks.message_executed.unregister(
+                self.adaptive_concurrency.on_message_executed
+            )
+            self.adaptive_concurrency.close()
+
         self.logger.debug("Closing executor")
         await self.executor.close()
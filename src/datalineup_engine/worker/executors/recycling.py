@@ -0,0 +1,52 @@
+import typing as t
+
+import dataclasses
+import enum
+import os
+import sys
+
+MIB: t.Final[int] = 1024 * 1024
+
+
+class RecycleReason(enum.Enum):
+    MAX_TASKS = "max_tasks_per_child"
+    MAX_RSS = "max_rss_mb"
+
+
+@dataclasses.dataclass(frozen=True)
+class RecycleLimits:
+    """Limits past which a pool child process gets replaced by a new one."""
+
+    max_tasks: t.Optional[int] = None
+    max_rss_mb: t.Optional[float] = None
+
+    def __bool__(self) -> bool:
+        return self.max_tasks is not None or self.max_rss_mb is not None
+
+    def exceeded(
+        self, *, tasks: int, rss_mb: t.Optional[float]
+    ) -> t.Optional[RecycleReason]:
+        if self.max_tasks is not None and tasks >= self.max_tasks:
+            return RecycleReason.MAX_TASKS
+        if (
+            self.max_rss_mb is not None
+            and rss_mb is not None
+            and rss_mb >= self.max_rss_mb
+        ):
+            return RecycleReason.MAX_RSS
+        return None
+
+
+def rss_mb() -> float:
+    """Resident set size of the current process, in MiB."""
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / MIB
+    except (OSError, ValueError, IndexError):
+        # Without procfs, use the peak resident set size.
+        import resource
+
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in KiB everywhere else.
+        return maxrss / MIB if sys.platform == "darwin" else maxrss / 1024
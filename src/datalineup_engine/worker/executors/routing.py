@@ -0,0 +1,47 @@
+import typing as t
+
+import dataclasses
+import zlib
+from collections.abc import Sequence
+
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+
+
+@dataclasses.dataclass
+class StickyRouting:
+    """Route messages sharing a key to the same child processes.
+
+    The key is the pipeline name, or the value of the `tag` message tag when
+    the message has it. Each key is hashed onto `processes` children, so
+    per-process caches are only warmed in a few of them. When all of these
+    children are saturated, the message falls back to the least busy child
+    with spare capacity, if any.
+    """
+
+    tag: t.Optional[str] = None
+    processes: int = 1
+
+    def key(self, message: PipelineMessage) -> str:
+        if self.tag and (value := message.message.tags.get(self.tag)) is not None:
+            return value
+        return message.info.name
+
+    def preferred(self, key: str, count: int) -> list[int]:
+        start = zlib.crc32(key.encode())
+        return [(start + i) % count for i in range(min(max(self.processes, 1), count))]
+
+    def select(
+        self, message: PipelineMessage, loads: Sequence[int], *, capacity: int
+    ) -> tuple[int, bool]:
+        """Return the index of the child to run `message` on, and whether it is
+        a fallback from the preferred children."""
+        preferred = self.preferred(self.key(message), len(loads))
+        index = min(preferred, key=loads.__getitem__)
+        if loads[index] < capacity:
+            return index, False
+
+        fallback = min(range(len(loads)), key=loads.__getitem__)
+        if loads[fallback] < capacity:
+            return fallback, True
+        # Every child is saturated, wait for one of the preferred ones.
+        return index, False
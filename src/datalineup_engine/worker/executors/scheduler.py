@@ -2,12 +2,14 @@ import typing as t
 
 import asyncio
 import dataclasses
+import heapq
+import itertools
 from collections.abc import AsyncGenerator
 from collections.abc import AsyncIterator
-from collections.abc import Coroutine
+from collections.abc import Iterable
 
-from datalineup_engine.utils.asyncutils import TasksGroup
 from datalineup_engine.utils.log import getLogger
+from datalineup_engine.worker.resources.manager import ResourcesManager
 
 T = t.TypeVar("T")
 
@@ -30,28 +32,53 @@ class ScheduleSlot(t.Generic[T]):
     future: asyncio.Future[None]
     order: int = 0
     is_running: bool = True
+    resources: frozenset[str] = frozenset()
 
 
 class Scheduler(t.Generic[T]):
+    """Round-robin scheduler over many async generators.
+
+    Each schedulable has a single pending `__anext__` task. Once a task
+    completes, a done callback pushes it on the `ready` heap ordered by the
+    slot's `order`, so picking the next item to yield doesn't depend on the
+    number of schedulables.
+
+    With a `resources_manager`, schedulables added with the resource types
+    their items need are only polled once these resources are available, so
+    an item isn't pulled just to wait on its resources.
+    """
+
     schedule_slots: dict[SchedulableProtocol[T], ScheduleSlot[T]]
     tasks: dict[asyncio.Task, SchedulableProtocol[T]]
+    ready: list[tuple[int, int, asyncio.Task]]
 
-    def __init__(self) -> None:
+    def __init__(
+        self, *, resources_manager: t.Optional[ResourcesManager] = None
+    ) -> None:
         self.logger = getLogger(__name__, self)
+        self.resources_manager = resources_manager
         self.schedule_slots = {}
         self.tasks = {}
-        self.tasks_group = TasksGroup()
+        self.ready = []
+        self.ready_counter = itertools.count()
+        self.updated = asyncio.Event()
         self.is_running: t.Optional[bool] = None
 
-    def add(self, item: SchedulableProtocol[T]) -> asyncio.Future[None]:
+    def add(
+        self, item: SchedulableProtocol[T], *, resources: Iterable[str] = ()
+    ) -> asyncio.Future[None]:
         generator = t.cast(AsyncGenerator[T, None], item.iterable.__aiter__())
         name = f"scheduler.anext({item.name})"
-        anext = t.cast(Coroutine[t.Any, t.Any, T], generator.__anext__())
-        task = asyncio.create_task(anext, name=name)
-        slot = ScheduleSlot(task=task, generator=generator, future=asyncio.Future())
+        required = frozenset(resources)
+        task = asyncio.create_task(self._anext(generator, required), name=name)
+        slot = ScheduleSlot(
+            task=task,
+            generator=generator,
+            future=asyncio.Future(),
+            resources=required,
+        )
         self.schedule_slots[item] = slot
-        self.tasks[task] = item
-        self.tasks_group.add(task)
+        self._watch_task(task, item=item)
         return slot.future
 
     def remove(self, item: SchedulableProtocol[T]) -> None:
@@ -62,7 +89,15 @@ class Scheduler(t.Generic[T]):
     async def close(self) -> None:
         self.is_running = False
 
-        await self.tasks_group.close()
+        pending = [task for task in self.tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        self.tasks.clear()
+        self.ready.clear()
+        self.updated.set()
+
         for item in self.schedule_slots.values():
             self.stop_slot(item)
 
@@ -85,18 +120,16 @@ class Scheduler(t.Generic[T]):
             return
 
         self.is_running = True
-        while self.is_running or self.tasks_group.tasks:
-            done = await self.tasks_group.wait()
-            if not done:
+        while self.is_running or self.ready:
+            if not self.ready:
+                self.updated.clear()
+                await self.updated.wait()
                 continue
-            self.logger.debug(
-                "task ready",
-                extra={"data": {"tasks": ",".join(t.get_name() for t in done)}},
-            )
 
-            for task in sorted(done, key=self.task_order):
-                async for item in self.process_task(task):
-                    yield item
+            _, _, task = heapq.heappop(self.ready)
+            self.logger.debug("task ready", extra={"data": {"tasks": task.get_name()}})
+            async for item in self.process_task(task):
+                yield item
 
     async def process_task(self, task: asyncio.Task) -> AsyncIterator[T]:
         item = self.tasks[task]
@@ -128,7 +161,7 @@ class Scheduler(t.Generic[T]):
             # cancellation. The task is put back in the item for later
             # processing.
             self.tasks[task] = item
-            self.tasks_group.add(task)
+            self._push_ready(task)
             raise
         else:
             # Requeue the __anext__ task to process next item.
@@ -144,14 +177,36 @@ class Scheduler(t.Generic[T]):
         self, *, item: SchedulableProtocol[T], schedule_slot: ScheduleSlot[T]
     ) -> None:
         name = f"scheduler.anext({item.name})"
-        anext = t.cast(Coroutine[t.Any, t.Any, T], schedule_slot.generator.__anext__())
+        anext = self._anext(schedule_slot.generator, schedule_slot.resources)
         new_task = asyncio.create_task(anext, name=name)
-        self.tasks[new_task] = item
-        self.tasks_group.add(new_task)
-
         schedule_slot.task = new_task
         schedule_slot.order += 1
 
+        self._watch_task(new_task, item=item)
+
+    async def _anext(
+        self, generator: AsyncGenerator[T, None], resources: frozenset[str]
+    ) -> T:
+        if resources and self.resources_manager:
+            await self.resources_manager.wait_available(resources)
+        return await generator.__anext__()
+
+    def _watch_task(self, task: asyncio.Task, *, item: SchedulableProtocol[T]) -> None:
+        self.tasks[task] = item
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        # The task might have been dropped by `close` before its callback ran.
+        if task in self.tasks:
+            self._push_ready(task)
+
+    def _push_ready(self, task: asyncio.Task) -> None:
+        # The counter keeps tasks with the same order in completion order and
+        # avoids comparing the tasks themselves.
+        entry = (self.task_order(task), next(self.ready_counter), task)
+        heapq.heappush(self.ready, entry)
+        self.updated.set()
+
     def task_order(self, task: asyncio.Task) -> int:
         item = self.tasks[task]
         schedule_slot = self.schedule_slots.get(item)
@@ -0,0 +1,192 @@
+import typing as t
+
+import dataclasses
+import itertools
+import secrets
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.core import TopicMessage
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+
+SEGMENT_PREFIX: t.Final[str] = "datalineup-"
+
+
+@dataclasses.dataclass(frozen=True)
+class SharedPayload:
+    """Handle sent through the pool in place of a large str or bytes."""
+
+    name: str
+    size: int
+    is_str: bool = False
+
+
+@dataclasses.dataclass
+class RemoteSharedMemory:
+    """Shared memory transport for a single call to the pool.
+
+    The worker creates the args segments and unlinks them once the call is
+    done. The pool process creates the results segments, named after `prefix`
+    so the worker can find and unlink them even if the pool process crashed
+    before returning them.
+    """
+
+    threshold: int
+    prefix: str
+    exported_bytes: int = 0
+    imported_bytes: int = 0
+    segments: list[str] = dataclasses.field(default_factory=list)
+    # Results segments the worker tried to import, unlinked or not.
+    imported: set[str] = dataclasses.field(default_factory=set)
+
+    def __reduce__(self) -> tuple[t.Any, ...]:
+        # Only send the call parameters, each side tracks its own segments.
+        return (RemoteSharedMemory, (self.threshold, self.prefix))
+
+    def export_message(self, message: PipelineMessage) -> PipelineMessage:
+        return dataclasses.replace(
+            message, message=self._export_topic_message(message.message, kind="a")
+        )
+
+    def import_message(self, message: PipelineMessage) -> PipelineMessage:
+        return dataclasses.replace(
+            message, message=self._import_topic_message(message.message, unlink=False)
+        )
+
+    def export_results(self, results: PipelineResults) -> PipelineResults:
+        outputs = [
+            dataclasses.replace(
+                output, message=self._export_topic_message(output.message, kind="r")
+            )
+            for output in results.outputs
+        ]
+        return dataclasses.replace(results, outputs=outputs)
+
+    def import_results(self, results: PipelineResults) -> PipelineResults:
+        outputs = [
+            dataclasses.replace(
+                output, message=self._import_topic_message(output.message, unlink=True)
+            )
+            for output in results.outputs
+        ]
+        return dataclasses.replace(results, outputs=outputs)
+
+    def release(self) -> None:
+        """Unlink every segment left by this call."""
+        for name in self.segments:
+            unlink_segment(name)
+        self.segments.clear()
+
+        # Results segments are named in sequence. They are unlinked once
+        # imported, so any other segment found here was left by a failed call
+        # or import.
+        for i in itertools.count():
+            name = self._segment_name("r", i)
+            if name not in self.imported and not unlink_segment(name):
+                break
+        self.imported.clear()
+
+    def _segment_name(self, kind: str, i: int) -> str:
+        return f"{self.prefix}-{kind}{i}"
+
+    def _export_topic_message(
+        self, message: TopicMessage, *, kind: str
+    ) -> TopicMessage:
+        args = self._export(message.args, kind=kind)
+        if args is message.args:
+            return message
+        return dataclasses.replace(message, args=args)
+
+    def _import_topic_message(
+        self, message: TopicMessage, *, unlink: bool
+    ) -> TopicMessage:
+        args = self._import(message.args, unlink=unlink)
+        if args is message.args:
+            return message
+        return dataclasses.replace(message, args=args)
+
+    def _export(self, value: t.Any, *, kind: str) -> t.Any:
+        # Containers are copied only when one of their item changed, so the
+        # original message is never mutated.
+        if isinstance(value, dict):
+            items = {k: self._export(v, kind=kind) for k, v in value.items()}
+            if any(items[k] is not v for k, v in value.items()):
+                return items
+            return value
+        if isinstance(value, list):
+            list_items = [self._export(v, kind=kind) for v in value]
+            if any(a is not b for a, b in zip(list_items, value, strict=True)):
+                return list_items
+            return value
+        if isinstance(value, (bytes, str)) and len(value) >= self.threshold:
+            return self._create_segment(value, kind=kind)
+        return value
+
+    def _import(self, value: t.Any, *, unlink: bool) -> t.Any:
+        if isinstance(value, dict):
+            items = {k: self._import(v, unlink=unlink) for k, v in value.items()}
+            if any(items[k] is not v for k, v in value.items()):
+                return items
+            return value
+        if isinstance(value, list):
+            list_items = [self._import(v, unlink=unlink) for v in value]
+            if any(a is not b for a, b in zip(list_items, value, strict=True)):
+                return list_items
+            return value
+        if isinstance(value, SharedPayload):
+            return self._read_segment(value, unlink=unlink)
+        return value
+
+    def _create_segment(
+        self, value: t.Union[bytes, str], *, kind: str
+    ) -> SharedPayload:
+        is_str = isinstance(value, str)
+        data = value.encode() if isinstance(value, str) else value
+        name = self._segment_name(kind, len(self.segments))
+        segment = SharedMemory(name=name, create=True, size=max(len(data), 1))
+        try:
+            t.cast(memoryview, segment.buf)[: len(data)] = data
+        finally:
+            segment.close()
+        self.segments.append(name)
+        self.exported_bytes += len(data)
+        return SharedPayload(name=name, size=len(data), is_str=is_str)
+
+    def _read_segment(self, payload: SharedPayload, *, unlink: bool) -> t.Any:
+        if unlink:
+            self.imported.add(payload.name)
+        segment = SharedMemory(name=payload.name)
+        try:
+            data = bytes(t.cast(memoryview, segment.buf)[: payload.size])
+        finally:
+            segment.close()
+            if unlink:
+                segment.unlink()
+        self.imported_bytes += payload.size
+        return data.decode() if payload.is_str else data
+
+
+class SharedMemoryTransport:
+    """Create a `RemoteSharedMemory` for each call made to a process pool."""
+
+    def __init__(self, *, threshold: int) -> None:
+        self.threshold = threshold
+        # Pool processes must share the worker's resource tracker, otherwise
+        # they would unlink the segments they created when they exit.
+        resource_tracker.ensure_running()
+
+    def new_call(self) -> RemoteSharedMemory:
+        return RemoteSharedMemory(
+            threshold=self.threshold, prefix=SEGMENT_PREFIX + secrets.token_hex(8)
+        )
+
+
+def unlink_segment(name: str) -> bool:
+    try:
+        segment = SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    segment.close()
+    segment.unlink()
+    return True
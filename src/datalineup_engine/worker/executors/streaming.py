@@ -0,0 +1,70 @@
+import typing as t
+
+import asyncio
+
+from datalineup_engine.core import PipelineOutput
+
+
+class OutputStream:
+    """Bounded buffer of the outputs a pipeline yields while it runs.
+
+    Executors supporting streaming put outputs in the stream instead of
+    returning them in `PipelineResults`, so they can be published while the
+    pipeline is still running. Once the buffer is full, the pipeline waits for
+    the outputs to be published.
+    """
+
+    def __init__(self, *, buffer_size: int) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[t.Optional[PipelineOutput]] = asyncio.Queue(
+            maxsize=buffer_size
+        )
+        self.is_stopped = False
+
+    async def put(self, output: PipelineOutput) -> None:
+        # Outputs yielded after the consumer stopped are dropped.
+        if self.is_stopped:
+            return
+        await self.queue.put(output)
+
+    def put_threadsafe(self, output: PipelineOutput) -> None:
+        """Put an output from a pool thread, blocking while the buffer is full."""
+        asyncio.run_coroutine_threadsafe(self.put(output), self.loop).result()
+
+    async def close(self) -> None:
+        if self.is_stopped:
+            return
+        await self.queue.put(None)
+
+    async def discard(self) -> None:
+        """End the stream without the outputs waiting to be published."""
+        self.stop()
+        await self.queue.put(None)
+
+    def stop(self) -> None:
+        """Stop consuming outputs, unblocking producers waiting on the buffer."""
+        self.is_stopped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def batches(self) -> t.AsyncIterator[list[PipelineOutput]]:
+        """Iterate over the outputs, with all the buffered ones at once."""
+        async for output in self:
+            batch = [output]
+            while not self.queue.empty():
+                if (buffered := self.queue.get_nowait()) is None:
+                    self.stop()
+                    yield batch
+                    return
+                batch.append(buffered)
+            yield batch
+
+    def __aiter__(self) -> "OutputStream":
+        return self
+
+    async def __anext__(self) -> PipelineOutput:
+        output = await self.queue.get()
+        if output is None:
+            self.stop()
+            raise StopAsyncIteration
+        return output
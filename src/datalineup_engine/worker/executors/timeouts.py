@@ -0,0 +1,84 @@
+import typing as t
+
+import asyncio
+import contextlib
+import dataclasses
+import multiprocessing
+import multiprocessing.sharedctypes
+import multiprocessing.synchronize
+import os
+import signal
+
+from .bootstrap import RemoteException
+
+
+@dataclasses.dataclass
+class TimeoutOptions:
+    """Timeout of a single message, read from the `process_executor` config
+    namespace so jobs and messages can override it."""
+
+    timeout: t.Optional[float] = None
+    timeout_grace: float = 5
+
+
+@dataclasses.dataclass(eq=False)
+class ChildControl:
+    """Cancel or kill the call running in the child of a single child pool.
+
+    The child records its pid once started, so only that process gets killed.
+    """
+
+    cancel_event: multiprocessing.synchronize.Event
+    pid: "multiprocessing.sharedctypes.Synchronized[int]"
+
+    @classmethod
+    def create(cls) -> "ChildControl":
+        context = multiprocessing.get_context()
+        return cls(cancel_event=context.Event(), pid=context.Value("i", 0))
+
+    def attach(self) -> None:
+        """Called from the child process initializer."""
+        self.pid.value = os.getpid()
+
+    def reset(self) -> None:
+        self.cancel_event.clear()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def kill(self) -> None:
+        if not self.pid.value:
+            return
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(self.pid.value, signal.SIGKILL)
+
+
+async def wait_timeout(
+    future: asyncio.Future,
+    *,
+    timeout: float,
+    grace: float,
+    on_timeout: t.Callable[[], None],
+) -> None:
+    """Wait up to `timeout` seconds for `future`, then call `on_timeout` to
+    cancel the call and wait up to `grace` more seconds for it to return.
+
+    Raise `asyncio.TimeoutError` once the timeout fired. `future` is still
+    pending if the call ignored the cancellation.
+    """
+    done, _ = await asyncio.wait([future], timeout=timeout)
+    if done:
+        return
+
+    on_timeout()
+    await asyncio.wait([future], timeout=grace)
+    raise asyncio.TimeoutError()
+
+
+def timeout_error(timeout: t.Optional[float]) -> RemoteException:
+    # Raised as a pipeline error, so error channels match timeouts the same
+    # way on every executor.
+    try:
+        raise asyncio.TimeoutError(f"Pipeline timed out after {timeout}s")
+    except asyncio.TimeoutError as e:
+        return RemoteException.from_exception(e)
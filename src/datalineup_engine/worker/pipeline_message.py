@@ -4,10 +4,47 @@ import dataclasses
 
 from datalineup_engine.core import PipelineInfo
 from datalineup_engine.core import TopicMessage
+from datalineup_engine.core.resource import keyed_resource_type
+from datalineup_engine.utils.cache import threadsafe_cache
+from datalineup_engine.utils.inspect import BaseParamsDataclass
 from datalineup_engine.utils.inspect import dataclass_from_params
 from datalineup_engine.utils.inspect import get_import_name
 from datalineup_engine.utils.inspect import import_name
-from datalineup_engine.utils.options import fromdict
+from datalineup_engine.utils.options import compile_fromdict
+
+
+@dataclasses.dataclass
+class PipelinePlan:
+    """Everything `PipelineMessage.execute` resolves from a pipeline name.
+
+    Plans are cached per process, so executing a message doesn't go through
+    the import machinery nor inspect the pipeline arguments again.
+    """
+
+    pipeline: t.Callable
+    args_def: t.Type[BaseParamsDataclass]
+    # Build `args_def` from the message args and meta args, skipping the
+    # validation when they are trivially compatible with the pipeline.
+    bind_args: t.Callable[[dict[str, t.Any], dict[str, t.Any]], BaseParamsDataclass]
+    # Meta arg import name to pipeline argument, filled as meta args are seen.
+    meta_args: dict[str, t.Optional[str]] = dataclasses.field(default_factory=dict)
+
+    def meta_arg(self, meta_name: str) -> t.Optional[str]:
+        try:
+            return self.meta_args[meta_name]
+        except KeyError:
+            arg = self.args_def.find_by_type(import_name(meta_name))
+            self.meta_args[meta_name] = arg
+            return arg
+
+
+@threadsafe_cache
+def pipeline_plan(name: str) -> PipelinePlan:
+    pipeline = t.cast(t.Callable, import_name(name))
+    args_def = dataclass_from_params(pipeline)
+    return PipelinePlan(
+        pipeline=pipeline, args_def=args_def, bind_args=compile_fromdict(args_def)
+    )
 
 
 @dataclasses.dataclass
@@ -23,7 +60,7 @@ class PipelineMessage:
     @property
     def missing_resources(self) -> set[str]:
         return {
-            typ
+            keyed_resource_type(typ, self.message.args)
             for name, typ in self.info.resources.items()
             if name not in self.message.args
         }
@@ -31,6 +68,7 @@ class PipelineMessage:
     def update_with_resources(self, resources: dict[str, dict]) -> None:
         for name, typ in self.info.resources.items():
             if name not in self.message.args:
+                typ = keyed_resource_type(typ, self.message.args)
                 self.message.args[name] = resources[typ]
 
     @property
@@ -45,17 +83,15 @@ class PipelineMessage:
         self.meta_args[get_import_name(meta_type)] = value
 
     def execute(self) -> object:
-        pipeline = self.info.into_pipeline()
-        pipeline_args_def = dataclass_from_params(pipeline)
-        args = dict(self.message.args)
+        plan = pipeline_plan(self.info.name)
+        args = self.message.args
+        meta_args = {}
 
         for meta_name, value in self.meta_args.items():
-            meta_type = import_name(meta_name)
-            arg = pipeline_args_def.find_by_type(meta_type)
-            if arg:
-                args[arg] = value
+            if arg := plan.meta_arg(meta_name):
+                meta_args[arg] = value
 
-        pipeline_args = fromdict(args, pipeline_args_def)
+        pipeline_args = plan.bind_args(args, meta_args)
         return pipeline_args.call(kwargs=args)
 
     def as_remote(self) -> "PipelineMessage":
@@ -3,8 +3,12 @@ import typing as t
 import asyncio
 import contextlib
 import dataclasses
+import heapq
+import itertools
 import time
-from collections import defaultdict
+from collections import Counter
+from collections import OrderedDict
+from collections import deque
 from collections.abc import Iterable
 from functools import cached_property
 
@@ -13,6 +17,9 @@ from limits import parse_many
 from limits.aio import storage
 from limits.aio.strategies import STRATEGIES
 from limits.aio.strategies import RateLimiter
+from opentelemetry.metrics import get_meter
+
+from datalineup_engine.core.resource import KEY_SEPARATOR
 
 
 @dataclasses.dataclass(frozen=True)
@@ -49,11 +56,134 @@ class ResourceUnavailable(Exception):
     pass
 
 
+@dataclasses.dataclass
+class KeyedPoolOptions:
+    # Resources in each key pool, the messages using a key concurrently.
+    concurrency: int = 1
+    default_delay: float = 0
+    # Rate limits shared by the resources of a key, such as "1 per second".
+    rate_limits: list[str] = dataclasses.field(default_factory=list)
+    # Number of keys kept, the least recently used idle keys are evicted.
+    max_keys: int = 10_000
+
+
+class GcraRateLimiter:
+    """In-process rate limiter using the Generic Cell Rate Algorithm.
+
+    It behaves like a token bucket holding `amount` tokens refilled over the
+    limit period, but only keeps a theoretical arrival time by limit. The
+    limiter doesn't reject hits: it tells when a request is allowed to start
+    and when the next one is. A resource is kept unavailable until its next
+    request is allowed. Resources sharing a limiter, like those of a keyed
+    pool, are all kept unavailable until then.
+    """
+
+    def __init__(self, rate_limit_items: list[RateLimitItem]) -> None:
+        self.limits = [
+            (item.get_expiry(), item.get_expiry() / item.amount)
+            for item in rate_limit_items
+        ]
+        self.arrivals = [0.0] * len(self.limits)
+
+    def allowed_at(self, now: float) -> float:
+        """Return when a request made at `now` is allowed."""
+        allowed_at = now
+        for arrival, (period, interval) in zip(self.arrivals, self.limits, strict=True):
+            # Requests are allowed ahead of their arrival time by up to the
+            # limit burst, `amount - 1` intervals.
+            allowed_at = max(allowed_at, arrival - period + interval)
+        return allowed_at
+
+    def hit(self, now: float) -> tuple[float, float]:
+        """Count a request made at `now`.
+
+        Return when the request is allowed to start and when the next one is.
+        """
+        started_at = self.allowed_at(now)
+        for i, (_, interval) in enumerate(self.limits):
+            self.arrivals[i] = max(self.arrivals[i], started_at) + interval
+        return started_at, self.allowed_at(started_at)
+
+
+# Strategies computed locally, without going through the limiter storage.
+LOCAL_STRATEGIES: dict[str, t.Callable[[list[RateLimitItem]], GcraRateLimiter]] = {
+    "gcra": GcraRateLimiter,
+    "token-bucket": GcraRateLimiter,
+}
+
+
+@dataclasses.dataclass
+class ResourceStats:
+    # Exponentially weighted moving averages of the time a resource is used
+    # for, in seconds, and of its failures.
+    duration: t.Optional[float] = None
+    error_rate: float = 0
+
+
+class ResourceSelector:
+    """Select the resource to acquire among the available ones.
+
+    The default selector picks the least recently used resource. Subclasses
+    use the statistics reported by the pipelines using the resources.
+    """
+
+    def __init__(self, *, alpha: float = 0.3) -> None:
+        self.alpha = alpha
+        self.stats: dict[str, ResourceStats] = {}
+
+    def observe(
+        self, resource: ResourceData, *, duration: float, failed: bool
+    ) -> ResourceStats:
+        stats = self.stats.setdefault(resource.name, ResourceStats())
+        if stats.duration is None:
+            stats.duration = duration
+        else:
+            stats.duration += self.alpha * (duration - stats.duration)
+        stats.error_rate += self.alpha * (failed - stats.error_rate)
+        return stats
+
+    def select(self, availables: t.Sequence[ResourceData]) -> int:
+        """Return the index of the resource to acquire in `availables`, which
+        is in least recently used order."""
+        return 0
+
+
+class LatencySelector(ResourceSelector):
+    """Select the resource with the lowest average duration.
+
+    Resources without statistics are selected first, so each one is tried.
+    """
+
+    def select(self, availables: t.Sequence[ResourceData]) -> int:
+        return min(range(len(availables)), key=lambda i: self.score(availables[i]))
+
+    def score(self, resource: ResourceData) -> tuple[float, ...]:
+        stats = self.stats.get(resource.name)
+        return (stats.duration or 0,) if stats else (0,)
+
+
+class ErrorPenaltySelector(LatencySelector):
+    """Select the resource with the lowest error rate, then the fastest one."""
+
+    def score(self, resource: ResourceData) -> tuple[float, ...]:
+        stats = self.stats.get(resource.name)
+        return (stats.error_rate, stats.duration or 0) if stats else (0, 0)
+
+
+SELECTION_POLICIES: dict[str, t.Callable[..., ResourceSelector]] = {
+    "lru": ResourceSelector,
+    "latency": LatencySelector,
+    "errors": ErrorPenaltySelector,
+}
+
+
 class ResourceContext:
     def __init__(self, resource: ResourceData, manager: "ExclusiveResources") -> None:
         self.resource: t.Optional[ResourceData] = resource
         self.manager = manager
-        self.rate_limiter: t.Optional[RateLimiter] = manager.limiters.get(resource.name)
+        self.rate_limiter: t.Optional[t.Union[RateLimiter, GcraRateLimiter]] = (
+            manager.limiters.get(resource.name)
+        )
         self.release_at: t.Optional[float] = None
 
     async def release(self) -> None:
@@ -62,10 +192,7 @@ class ResourceContext:
             return
 
         if self.release_at:
-            asyncio.create_task(
-                self._delayed_release(self.resource),
-                name=f"delayed-release({self.resource.name})",
-            )
+            self.manager.release_later(self.resource, self.release_at)
         else:
             await self.manager.release(self.resource)
 
@@ -74,19 +201,31 @@ class ResourceContext:
     def release_later(self, when: float) -> None:
         self.release_at = when
 
+    def report(self, *, duration: float, failed: bool) -> None:
+        """Report the time the resource was used for and whether it failed."""
+        if not self.resource:
+            return
+        self.manager.observe(self.resource, duration=duration, failed=failed)
+
     def update_state(self, state: dict[str, object]) -> None:
         if self.resource:
             self.resource.state = state
 
-    async def _delayed_release(self, resource: ResourceData) -> None:
-        if self.release_at:
-            await asyncio.sleep(self.release_at - time.time())
-        await self.manager.release(resource)
-
     async def _apply_rate_limit(self, rate_limit_items: list[RateLimitItem]) -> None:
         if not self.rate_limiter or not self.resource:
             return
 
+        if isinstance(self.rate_limiter, GcraRateLimiter):
+            # The resource is unavailable until its next request is allowed, so
+            # this one is allowed right away.
+            now = time.time()
+            _, allowed_at = self.rate_limiter.hit(now)
+            if allowed_at > now and (
+                not self.release_at or allowed_at > self.release_at
+            ):
+                self.release_at = allowed_at
+            return
+
         release_ats: list[int] = []
         for rate_limit_item in rate_limit_items:
             reset_time, remaining = await self.rate_limiter.get_window_stats(
@@ -139,31 +278,183 @@ class ResourcesContext:
         await self.release()
 
 
+class DelayedReleases:
+    """Resources released at a later time, in a single timer heap.
+
+    Resources cooling down after their `default_delay` or rate limit are kept
+    here until they are due, with only one loop timer for the earliest one.
+    """
+
+    def __init__(self) -> None:
+        self.heap: list[tuple[float, int, "ExclusiveResources", ResourceData]] = []
+        self.counter = itertools.count()
+        self.cooling: Counter[str] = Counter()
+        self.timer: t.Optional[asyncio.TimerHandle] = None
+        self.timer_at: t.Optional[float] = None
+
+        self.cooling_counter = get_meter("datalineup.metrics").create_up_down_counter(
+            name="datalineup.resources.cooling_down",
+            description="Number of resources waiting to be released.",
+        )
+
+    def add(
+        self, when: float, resources: "ExclusiveResources", resource: ResourceData
+    ) -> None:
+        heapq.heappush(self.heap, (when, next(self.counter), resources, resource))
+        self.cooling[resource.type] += 1
+        self.cooling_counter.add(1, resources.attributes)
+        if self.timer_at is None or when < self.timer_at:
+            self._schedule(when)
+
+    def cooling_down(self, resource_type: t.Optional[str] = None) -> int:
+        """Number of resources waiting to be released, of a type or of all."""
+        if resource_type is None:
+            return len(self.heap)
+        return self.cooling[resource_type]
+
+    def _schedule(self, when: float) -> None:
+        if self.timer:
+            self.timer.cancel()
+        self.timer_at = when
+        self.timer = asyncio.get_running_loop().call_later(
+            max(when - time.time(), 0), self._release_due
+        )
+
+    def _release_due(self) -> None:
+        self.timer = self.timer_at = None
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, resources, resource = heapq.heappop(self.heap)
+            self.cooling[resource.type] -= 1
+            if not self.cooling[resource.type]:
+                del self.cooling[resource.type]
+            self.cooling_counter.add(-1, resources.attributes)
+            resources.release_nowait(resource)
+        if self.heap:
+            self._schedule(self.heap[0][0])
+
+
 class ExclusiveResources:
-    def __init__(self, limiters_storage: storage.Storage) -> None:
-        self.availables: set[ResourceData] = set()
+    """Resources of a single type, each used by one owner at a time.
+
+    Waiters are served in FIFO order: a released resource is handed directly
+    to the oldest waiter instead of waking up all of them to race for it.
+    """
+
+    def __init__(
+        self,
+        limiters_storage: storage.Storage,
+        *,
+        resource_type: str = "",
+        keyed_type: t.Optional[str] = None,
+        delayed_releases: t.Optional[DelayedReleases] = None,
+    ) -> None:
+        self.type = resource_type
+        # Keyed resources are reported by their keyed type, not by key.
+        self.keyed = keyed_type is not None
+        self.attributes = {"type": keyed_type or resource_type}
+        self.delayed_releases = delayed_releases or DelayedReleases()
+        self.selector = ResourceSelector()
+        self.availables: deque[ResourceData] = deque()
         self.used: set[ResourceData] = set()
-        self.condition = asyncio.Condition(asyncio.Lock())
+        self.waiters: deque[asyncio.Future[ResourceData]] = deque()
+        # Futures set once a resource becomes available to acquire.
+        self.availability_waiters: list[asyncio.Future[None]] = []
         self.resources: dict[str, ResourceData] = {}
         self.limiters_storage: storage.Storage = limiters_storage
-        self.limiters: dict[str, RateLimiter] = {}
+        self.limiters: dict[str, t.Union[RateLimiter, GcraRateLimiter]] = {}
+        # Rate limits shared by all the resources, hit when one is handed over.
+        # They are all unavailable until `gated_until`.
+        self.shared_limiter: t.Optional[GcraRateLimiter] = None
+        self.gated_until: float = 0
+
+        meter = get_meter("datalineup.metrics")
+        self.wait_histogram = meter.create_histogram(
+            name="datalineup.resources.wait",
+            unit="ms",
+            description="Time spent waiting to acquire a resource.",
+        )
+        self.waiters_counter = meter.create_up_down_counter(
+            name="datalineup.resources.waiters",
+            description="Number of tasks waiting to acquire a resource.",
+        )
+        self.duration_histogram = meter.create_histogram(
+            name="datalineup.resources.duration",
+            unit="ms",
+            description="Time a resource is used for by a pipeline.",
+        )
+        self.errors_counter = meter.create_counter(
+            name="datalineup.resources.errors",
+            description="Counts the pipelines that failed using a resource.",
+        )
 
     async def acquire(self, *, wait: bool = True) -> ResourceContext:
-        async with self.condition:
-            if not wait:
-                resource = self.try_acquire()
-                if not resource:
-                    raise ResourceUnavailable()
-                return ResourceContext(resource, self)
-            resource = await self.condition.wait_for(self.try_acquire)
-            # wait_for above always return a non-none value. Assert is there
-            # to make mypy happy.
-            assert resource is not None  # noqa: S101
+        if resource := self.try_acquire():
+            if wait:
+                self.wait_histogram.record(0, self.attributes)
             return ResourceContext(resource, self)
+        if not wait:
+            raise ResourceUnavailable()
+
+        loop = asyncio.get_running_loop()
+        waiter: asyncio.Future[ResourceData] = loop.create_future()
+        self.waiters.append(waiter)
+        self.waiters_counter.add(1, self.attributes)
+        waited_at = loop.time()
+        try:
+            resource = await waiter
+        except asyncio.CancelledError:
+            # The resource might have been handed over right before the
+            # cancellation, give it to the next waiter.
+            if waiter.done() and not waiter.cancelled():
+                self.used.discard(resource := waiter.result())
+                self._hand_over(resource)
+            raise
+        finally:
+            with contextlib.suppress(ValueError):
+                self.waiters.remove(waiter)
+            self.waiters_counter.add(-1, self.attributes)
+
+        self.wait_histogram.record(
+            max(round((loop.time() - waited_at) * 1000), 0), self.attributes
+        )
+        return ResourceContext(resource, self)
+
+    @property
+    def available(self) -> bool:
+        """Whether a resource can be acquired without waiting."""
+        return bool(self.availables) and not self.waiters
+
+    @property
+    def idle(self) -> bool:
+        """Whether every resource is available and nobody waits on them."""
+        return (
+            not self.used
+            and not self.waiters
+            and not self.availability_waiters
+            and len(self.availables) == len(self.resources)
+        )
+
+    async def wait_available(self) -> None:
+        if self.available:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.availability_waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            with contextlib.suppress(ValueError):
+                self.availability_waiters.remove(waiter)
 
     def _build_rate_limiter(
         self, resource_name: str, resource_rate_limit: ResourceRateLimit
     ) -> None:
+        if local_strategy := LOCAL_STRATEGIES.get(resource_rate_limit.strategy):
+            self.limiters[resource_name] = local_strategy(
+                resource_rate_limit.rate_limit_items
+            )
+            return
+
         rate_limiter_class = STRATEGIES.get(resource_rate_limit.strategy)
         if not rate_limiter_class:
             raise ValueError(
@@ -176,37 +467,95 @@ class ExclusiveResources:
         )  # type: ignore[abstract]
 
     async def add(self, resource: ResourceData) -> None:
+        self.add_nowait(resource)
+
+    def add_nowait(self, resource: ResourceData) -> None:
         if resource.name in self.resources:
             raise ValueError("Cannot add a resource twice")
 
-        async with self.condition:
-            self.availables.add(resource)
-            self.resources[resource.name] = resource
-            if resource.rate_limit:
-                self._build_rate_limiter(resource.name, resource.rate_limit)
-
-            self.condition.notify()
+        self.resources[resource.name] = resource
+        if resource.rate_limit and not self.shared_limiter:
+            self._build_rate_limiter(resource.name, resource.rate_limit)
+        self._hand_over(resource)
 
     async def remove(self, resource_name: str) -> None:
         resource = self.resources.pop(resource_name, None)
         if resource:
-            self.availables.discard(resource)
+            with contextlib.suppress(ValueError):
+                self.availables.remove(resource)
             self.used.discard(resource)
             self.limiters.pop(resource.name, None)
 
     def try_acquire(self) -> t.Optional[ResourceData]:
-        if self.availables:
-            resource = self.availables.pop()
+        # Resources only go to the waiters while some are queued.
+        if self.availables and not self.waiters:
+            index = self.selector.select(self.availables)
+            resource = self.availables[index]
+            del self.availables[index]
             self.used.add(resource)
+            self._hit_shared_limiter()
             return resource
         return None
 
+    def observe(self, resource: ResourceData, *, duration: float, failed: bool) -> None:
+        self.selector.observe(resource, duration=duration, failed=failed)
+        attributes = self.attributes
+        if not self.keyed:
+            attributes = attributes | {"name": resource.name}
+        self.duration_histogram.record(max(round(duration * 1000), 0), attributes)
+        if failed:
+            self.errors_counter.add(1, attributes)
+
     async def release(self, resource: ResourceData) -> None:
+        self.release_nowait(resource)
+
+    def release_nowait(self, resource: ResourceData) -> None:
         if resource in self.used:
-            async with self.condition:
-                self.used.remove(resource)
-                self.availables.add(resource)
-                self.condition.notify()
+            self.used.remove(resource)
+            self._hand_over(resource)
+
+    def release_later(self, resource: ResourceData, when: float) -> None:
+        if when <= time.time():
+            self.release_nowait(resource)
+        else:
+            self.delayed_releases.add(when, self, resource)
+
+    def _hand_over(self, resource: ResourceData) -> None:
+        """Give a free resource to the oldest waiter, or make it available."""
+        if resource.name not in self.resources:
+            return
+        if self.gated_until > time.time():
+            self.used.add(resource)
+            self.delayed_releases.add(self.gated_until, self, resource)
+            return
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.used.add(resource)
+                waiter.set_result(resource)
+                self._hit_shared_limiter()
+                return
+        self.availables.append(resource)
+
+        waiters, self.availability_waiters = self.availability_waiters, []
+        for availability_waiter in waiters:
+            if not availability_waiter.done():
+                availability_waiter.set_result(None)
+
+    def _hit_shared_limiter(self) -> None:
+        """Count an acquisition on the shared limiter, and keep the available
+        resources until the next acquisition is allowed."""
+        if not self.shared_limiter:
+            return
+        now = time.time()
+        _, allowed_at = self.shared_limiter.hit(now)
+        if allowed_at <= now:
+            return
+        self.gated_until = allowed_at
+        while self.availables:
+            resource = self.availables.popleft()
+            self.used.add(resource)
+            self.delayed_releases.add(allowed_at, self, resource)
 
 
 class ResourcesManager:
@@ -214,12 +563,128 @@ class ResourcesManager:
 
     def __init__(self) -> None:
         self.limiters_storage: storage.Storage = storage.MemoryStorage()
-        self.resources: dict[str, ExclusiveResources] = defaultdict(
-            lambda: ExclusiveResources(self.limiters_storage)
-        )
+        self.delayed_releases = DelayedReleases()
+        self.selectors: dict[str, t.Callable[[], ResourceSelector]] = {}
+        self.default_selector: t.Callable[[], ResourceSelector] = ResourceSelector
+        self.resources: dict[str, ExclusiveResources] = {}
+        # Keyed resource types options, and their keys in LRU order.
+        self.keyed_pools: dict[str, KeyedPoolOptions] = {}
+        self.keys: dict[str, OrderedDict[str, None]] = {}
+
+    def _resources(self, resource_type: str) -> ExclusiveResources:
+        base_type, separator, key = resource_type.partition(KEY_SEPARATOR)
+        pool = self.keyed_pools.get(base_type) if separator else None
+        if (resources := self.resources.get(resource_type)) is None:
+            resources = self.resources[resource_type] = ExclusiveResources(
+                self.limiters_storage,
+                resource_type=resource_type,
+                keyed_type=base_type if pool else None,
+                delayed_releases=self.delayed_releases,
+            )
+            resources.selector = self.selectors.get(
+                resource_type, self.default_selector
+            )()
+            if pool:
+                self._fill_key_pool(resources, key=key, options=pool)
+        if pool:
+            self._touch_key(base_type, resource_type, max_keys=pool.max_keys)
+        return resources
+
+    def add_keyed_pool(self, resource_type: str, options: KeyedPoolOptions) -> None:
+        """Create a pool of resources on demand for each key of a keyed
+        resource type."""
+        if resource_type in self.keyed_pools:
+            raise ValueError("Cannot add a keyed resource type twice")
+        self.keyed_pools[resource_type] = options
+        self.keys[resource_type] = OrderedDict()
+
+    def remove_keyed_pool(self, resource_type: str) -> None:
+        self.keyed_pools.pop(resource_type, None)
+        for key_type in self.keys.pop(resource_type, {}):
+            self.resources.pop(key_type, None)
+
+    def _fill_key_pool(
+        self, resources: ExclusiveResources, *, key: str, options: KeyedPoolOptions
+    ) -> None:
+        rate_limit = None
+        if options.rate_limits:
+            rate_limit = ResourceRateLimit(
+                rate_limits=options.rate_limits, strategy="gcra"
+            )
+            # The key resources share their rate limits.
+            resources.shared_limiter = GcraRateLimiter(rate_limit.rate_limit_items)
+        for i in range(options.concurrency):
+            resources.add_nowait(
+                ResourceData(
+                    name=f"{key}#{i}",
+                    type=resources.type,
+                    data={"key": key},
+                    default_delay=options.default_delay,
+                    rate_limit=rate_limit,
+                )
+            )
+
+    def _touch_key(self, base_type: str, resource_type: str, *, max_keys: int) -> None:
+        keys = self.keys[base_type]
+        keys[resource_type] = None
+        keys.move_to_end(resource_type)
+        if len(keys) <= max_keys:
+            return
+
+        # Keys in use, or cooling down from their rate limits, are kept even
+        # past the limit, as is the key being acquired.
+        excess = len(keys) - max_keys
+        evicted: list[str] = []
+        for key_type in keys:
+            if len(evicted) >= excess:
+                break
+            if key_type == resource_type:
+                continue
+            resources = self.resources.get(key_type)
+            if resources is None or resources.idle:
+                evicted.append(key_type)
+        for key_type in evicted:
+            del keys[key_type]
+            self.resources.pop(key_type, None)
+
+    def set_selector(
+        self,
+        selector: t.Callable[[], ResourceSelector],
+        *,
+        resource_type: t.Optional[str] = None,
+    ) -> None:
+        """Set how resources of a type, or of all types by default, are
+        selected when acquired."""
+        if resource_type is None:
+            self.default_selector = selector
+        else:
+            self.selectors[resource_type] = selector
+        for typ, resources in self.resources.items():
+            if typ == resource_type or (
+                resource_type is None and typ not in self.selectors
+            ):
+                resources.selector = selector()
+
+    def available(self, resource_types: Iterable[str]) -> bool:
+        """Whether resources of all these types can be acquired right away."""
+        return all(self._resources(typ).available for typ in resource_types)
+
+    async def wait_available(self, resource_types: Iterable[str]) -> None:
+        """Wait until resources of all these types can be acquired right away.
+
+        The resources aren't acquired: they might be taken by someone else by
+        the time the caller tries to.
+        """
+        resources = [self._resources(typ) for typ in sorted(resource_types)]
+        while unavailable := next((r for r in resources if not r.available), None):
+            await unavailable.wait_available()
+
+    def cooling_down(self, resource_type: t.Optional[str] = None) -> int:
+        """Number of resources waiting on a delayed release."""
+        return self.delayed_releases.cooling_down(resource_type)
 
     async def acquire(self, resource_type: str, wait: bool = True) -> ResourceContext:
-        return await self.resources[resource_type].acquire(wait=wait)
+        return await self._resources(resource_type).acquire(wait=wait)
 
     async def acquire_many(
         self, resource_types: Iterable[str], wait: bool = True
@@ -239,10 +704,10 @@ class ResourcesManager:
         return ResourcesContext(resources, stack)
 
     async def release(self, resource: ResourceData) -> None:
-        await self.resources[resource.type].release(resource)
+        await self._resources(resource.type).release(resource)
 
     async def add(self, resource: ResourceData) -> None:
-        await self.resources[resource.type].add(resource)
+        await self._resources(resource.type).add(resource)
 
     async def remove(self, resource: ResourceKey) -> None:
-        await self.resources[resource.type].remove(resource.name)
+        await self._resources(resource.type).remove(resource.name)
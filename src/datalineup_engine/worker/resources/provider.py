@@ -8,6 +8,7 @@ from collections.abc import Collection
 from datalineup_engine.core.api import ResourcesProviderItem
 from datalineup_engine.utils.log import getLogger
 from datalineup_engine.utils.options import OptionsSchema
+from datalineup_engine.worker.resources.manager import KeyedPoolOptions
 from datalineup_engine.worker.resources.manager import ResourceData
 from datalineup_engine.worker.resources.manager import ResourceKey
 from datalineup_engine.worker.resources.manager import ResourceRateLimit
@@ -147,6 +148,30 @@ class StaticResourcesProvider(ResourcesProvider["StaticResourcesProvider.Options
             await self.add(resource)
 
 
+class KeyedResourcesProvider(ResourcesProvider["KeyedResourcesProvider.Options"]):
+    """Provide a pool of resources for each key of a `KeyedResource` type.
+
+    Pools are created as messages use new keys, so each key gets its own
+    concurrency and rate limits without declaring them. Idle keys are evicted
+    once there are more than `max_keys`.
+    """
+
+    @dataclasses.dataclass
+    class Options(KeyedPoolOptions):
+        pass
+
+    async def open(self) -> None:
+        self.services.s.resources_manager.add_keyed_pool(
+            self.definition.resource_type, self.options
+        )
+
+    async def close(self) -> None:
+        self.services.s.resources_manager.remove_keyed_pool(
+            self.definition.resource_type
+        )
+
+
 BUILTINS: dict[str, t.Type[ResourcesProvider]] = {
+    "KeyedResourcesProvider": KeyedResourcesProvider,
     "StaticResourcesProvider": StaticResourcesProvider,
 }
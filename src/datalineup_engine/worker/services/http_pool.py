@@ -0,0 +1,267 @@
+import typing as t
+
+import asyncio
+import contextlib
+import dataclasses
+import multiprocessing.util
+import weakref
+from collections import defaultdict
+from collections.abc import Generator
+from functools import partial
+from types import SimpleNamespace
+
+import aiohttp
+from opentelemetry.metrics import get_meter
+
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.core.pipeline import PipelineEvent
+from datalineup_engine.utils.options import json_serializer
+from datalineup_engine.worker.executors.bootstrap import PipelineBootstrap
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+from datalineup_engine.worker.services import BaseServices
+from datalineup_engine.worker.services import Service
+from datalineup_engine.worker.services.hooks import PipelineEventsEmitted
+
+# Pools created in this process, closed with the service or the process.
+_pools: "weakref.WeakSet[HttpPool]" = weakref.WeakSet()
+
+
+@dataclasses.dataclass
+class Options:
+    # Maximum number of connections, in total and to a single host.
+    limit: int = 100
+    limit_per_host: int = 10
+    # Seconds DNS resolutions are cached, None to cache them forever.
+    dns_cache_ttl: t.Optional[int] = 300
+    # Seconds idle connections are kept alive.
+    keepalive_timeout: float = 15
+
+
+@dataclasses.dataclass
+class HostStats:
+    requests: int = 0
+    connections_created: int = 0
+    connections_reused: int = 0
+    # Requests that waited for a connection because of the pool limits.
+    queued: int = 0
+    dns_cache_hits: int = 0
+    dns_cache_misses: int = 0
+
+
+@dataclasses.dataclass
+class HttpPoolStats(PipelineEvent):
+    """Pool statistics collected since the last reported ones, by host."""
+
+    hosts: dict[str, HostStats]
+
+
+class HttpPool:
+    """HTTP client shared by the pipelines of an executor process.
+
+    Pipelines get it by annotating an argument with `HttpPool`. Its session
+    keeps connections alive and caches DNS resolutions across messages::
+
+        async def crawl(url: str, http: HttpPool) -> TopicMessage:
+            async with http.session.get(url) as response:
+                return TopicMessage(args={"body": await response.text()})
+    """
+
+    def __init__(self, options: Options) -> None:
+        self.options = options
+        self.stats: defaultdict[str, HostStats] = defaultdict(HostStats)
+        self._session: t.Optional[aiohttp.ClientSession] = None
+        self._loop: t.Optional[asyncio.AbstractEventLoop] = None
+
+        self.trace_config = aiohttp.TraceConfig()
+        # aiohttp signals aren't typed to accept methods.
+        signals: list[tuple[t.Any, t.Callable]] = [
+            (self.trace_config.on_request_start, self.on_request_start),
+            (self.trace_config.on_connection_create_end, self.on_connection_created),
+            (self.trace_config.on_connection_reuseconn, self.on_connection_reused),
+            (self.trace_config.on_connection_queued_start, self.on_queued),
+            (self.trace_config.on_dns_cache_hit, self.on_dns_cache_hit),
+            (self.trace_config.on_dns_cache_miss, self.on_dns_cache_miss),
+        ]
+        for signal, callback in signals:
+            signal.append(callback)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The pooled session, bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.options.limit,
+                    limit_per_host=self.options.limit_per_host,
+                    ttl_dns_cache=self.options.dns_cache_ttl,
+                    keepalive_timeout=self.options.keepalive_timeout,
+                ),
+                json_serialize=json_serializer,
+                trace_configs=[self.trace_config],
+            )
+            self._loop = loop
+        return self._session
+
+    @classmethod
+    def on_executor_initialized(
+        cls, bootstrapper: PipelineBootstrap, *, options: Options
+    ) -> None:
+        pool = cls(options)
+        _pools.add(pool)
+        multiprocessing.util.Finalize(None, pool.close_sync, exitpriority=10)
+        bootstrapper.pipeline_hook.register(pool.on_pipeline_executed)
+
+    def on_pipeline_executed(
+        self, message: PipelineMessage
+    ) -> Generator[None, PipelineResults, None]:
+        message.set_meta_arg(meta_type=HttpPool, value=self)
+        results = yield
+        if self.stats:
+            stats, self.stats = self.stats, defaultdict(HostStats)
+            results.events.append(HttpPoolStats(hosts=dict(stats)))
+
+    async def close(self) -> None:
+        if self._session and self._loop is asyncio.get_running_loop():
+            session, self._session = self._session, None
+            await session.close()
+        else:
+            self.close_sync()
+
+    def close_sync(self) -> None:
+        session, self._session = self._session, None
+        if session is None or session.closed or self._loop is None:
+            return
+        if not self._loop.is_closed() and not self._loop.is_running():
+            self._loop.run_until_complete(session.close())
+            return
+        # The session loop is gone, nothing can await the connections anymore.
+        connector = session.connector
+        session.detach()
+        if connector:
+            with contextlib.suppress(Exception):
+                connector._close()
+
+    async def on_request_start(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceRequestStartParams,
+    ) -> None:
+        # The context is kept for the whole request, so the connection events
+        # are attributed to the request host.
+        context.host = params.url.host or ""
+        self.stats[context.host].requests += 1
+
+    async def on_connection_created(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: object
+    ) -> None:
+        self.stats[context.host].connections_created += 1
+
+    async def on_connection_reused(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: object
+    ) -> None:
+        self.stats[context.host].connections_reused += 1
+
+    async def on_queued(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: object
+    ) -> None:
+        self.stats[context.host].queued += 1
+
+    async def on_dns_cache_hit(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceDnsCacheHitParams,
+    ) -> None:
+        self.stats[params.host].dns_cache_hits += 1
+
+    async def on_dns_cache_miss(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceDnsCacheMissParams,
+    ) -> None:
+        self.stats[params.host].dns_cache_misses += 1
+
+
+class ExecutorHttpPool(Service[BaseServices, Options]):
+    """Give executors pipelines a pooled `HttpPool` client.
+
+    Each executor process gets its own pool. The pools statistics are sent
+    back with the pipelines results and reported as metrics by host.
+    """
+
+    name = "executor_http_pool"
+
+    Options = Options
+
+    async def open(self) -> None:
+        self.services.hooks.executor_initialized.register(
+            partial(HttpPool.on_executor_initialized, options=self.options)
+        )
+        self.services.hooks.pipeline_events_emitted.register(
+            self.on_pipeline_events_emitted
+        )
+
+        meter = get_meter("datalineup.metrics")
+        self.requests_counter = meter.create_counter(
+            name="datalineup.executor.http_pool.requests",
+            description="Counts the requests sent by the executors HTTP pools.",
+        )
+        self.connections_counter = meter.create_counter(
+            name="datalineup.executor.http_pool.connections",
+            description="""
+            Counts the connections acquired by the executors HTTP pools, by
+            whether they were created or reused.
+            """,
+        )
+        self.queued_counter = meter.create_counter(
+            name="datalineup.executor.http_pool.queued",
+            description="""
+            Counts the requests that waited for a connection because of the
+            executors HTTP pools limits.
+            """,
+        )
+        self.dns_counter = meter.create_counter(
+            name="datalineup.executor.http_pool.dns",
+            description="Counts the DNS cache hits and misses by host.",
+        )
+
+    async def close(self) -> None:
+        for pool in list(_pools):
+            await pool.close()
+
+    async def on_pipeline_events_emitted(self, event: PipelineEventsEmitted) -> None:
+        executor = event.xmsg.queue.definition.executor
+        for stats in event.events:
+            if not isinstance(stats, HttpPoolStats):
+                continue
+            for host, host_stats in stats.hosts.items():
+                params = {"executor": executor, "host": host}
+                for counter, value, attributes in (
+                    (self.requests_counter, host_stats.requests, params),
+                    (
+                        self.connections_counter,
+                        host_stats.connections_created,
+                        params | {"state": "created"},
+                    ),
+                    (
+                        self.connections_counter,
+                        host_stats.connections_reused,
+                        params | {"state": "reused"},
+                    ),
+                    (self.queued_counter, host_stats.queued, params),
+                    (
+                        self.dns_counter,
+                        host_stats.dns_cache_hits,
+                        params | {"cache": "hit"},
+                    ),
+                    (
+                        self.dns_counter,
+                        host_stats.dns_cache_misses,
+                        params | {"cache": "miss"},
+                    ),
+                ):
+                    if value:
+                        counter.add(value, attributes)
@@ -0,0 +1,48 @@
+import typing as t
+
+import dataclasses
+from functools import partial
+
+from datalineup_engine.worker.resources.manager import SELECTION_POLICIES
+from datalineup_engine.worker.resources.manager import ResourceSelector
+from datalineup_engine.worker.services import BaseServices
+from datalineup_engine.worker.services import Service
+
+
+@dataclasses.dataclass
+class Options:
+    # Policy used for the resource types not set in `types`. One of `lru`,
+    # `latency` or `errors`.
+    policy: str = "lru"
+    # Policy by resource type.
+    types: dict[str, str] = dataclasses.field(default_factory=dict)
+    # Weight of the last usage in the resources average duration and error rate.
+    alpha: float = 0.3
+
+
+class ResourcesSelection(Service[BaseServices, Options]):
+    """Select which resource of a type to acquire from their past usage.
+
+    With the `latency` policy, the resource with the lowest average usage
+    duration is acquired. With the `errors` policy, the resource with the
+    lowest error rate is, then the fastest. Pipelines can report a resource
+    failure with `ResourceUsed(failed=True)`.
+    """
+
+    name = "resources_selection"
+
+    Options = Options
+
+    async def open(self) -> None:
+        resources_manager = self.services.resources_manager
+        resources_manager.set_selector(self.selector(self.options.policy))
+        for resource_type, policy in self.options.types.items():
+            resources_manager.set_selector(
+                self.selector(policy), resource_type=resource_type
+            )
+
+    def selector(self, policy: str) -> t.Callable[[], ResourceSelector]:
+        selector_class = SELECTION_POLICIES.get(policy)
+        if not selector_class:
+            raise ValueError(f"Invalid resource selection policy: {policy}")
+        return partial(selector_class, alpha=self.options.alpha)
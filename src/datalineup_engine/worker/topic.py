@@ -6,6 +6,7 @@ import abc
 import asyncio
 import contextlib
 from collections.abc import AsyncGenerator
+from collections.abc import Sequence
 from datetime import timedelta
 
 from datalineup_engine.core import TopicMessage
@@ -29,6 +30,28 @@ class Topic(OptionsSchema):
     async def publish(self, message: TopicMessage, wait: bool) -> bool:
         raise NotImplementedError()
 
+    async def publish_many(
+        self, messages: Sequence[TopicMessage], wait: bool
+    ) -> list[bool]:
+        """Publish `messages` in order and return whether each one was.
+
+        Without `wait`, publishing stops at the first message that can't be
+        published, and the following ones are reported as unpublished. Topics
+        able to publish a batch at once should override this.
+        """
+        published = [False] * len(messages)
+        for i, message in enumerate(messages):
+            if wait:
+                published[i] = await self.publish(message, wait=True)
+                continue
+            try:
+                published[i] = await self.publish(message, wait=False)
+            except Exception:
+                published[i] = False
+            if not published[i]:
+                break
+        return published
+
     async def open(self) -> None:
         pass
 
@@ -5,6 +5,7 @@ import asyncio
 import dataclasses
 from collections.abc import AsyncGenerator
 from collections.abc import AsyncIterator
+from collections.abc import Sequence
 from contextlib import asynccontextmanager
 
 from datalineup_engine.core import TopicMessage
@@ -55,6 +56,21 @@ class MemoryTopic(Topic):
                 return False
         return True
 
+    async def publish_many(
+        self, messages: Sequence[TopicMessage], wait: bool
+    ) -> list[bool]:
+        queue = get_queue(self.options.name, maxsize=self.options.buffer_size)
+        published = [False] * len(messages)
+        for i, message in enumerate(messages):
+            if wait:
+                await queue.put(message)
+            elif queue.full():
+                break
+            else:
+                queue.put_nowait(message)
+            published[i] = True
+        return published
+
 
 def get_queue(queue_id: str, *, maxsize: int = 100) -> asyncio.Queue:
     if queue_id not in _memory_queues:
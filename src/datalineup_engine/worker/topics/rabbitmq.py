@@ -8,6 +8,7 @@ import json
 import pickle  # noqa: S403
 from collections.abc import AsyncGenerator
 from collections.abc import AsyncIterator
+from collections.abc import Sequence
 from contextlib import asynccontextmanager
 from datetime import timedelta
 
@@ -181,19 +182,7 @@ class RabbitMQTopic(Topic):
                 try:
                     await self.ensure_queue()  # Ensure the queue is created.
                     exchange = await self.exchange
-                    await asyncio.wait_for(
-                        exchange.publish(
-                            aio_pika.Message(
-                                body=body,
-                                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                                content_type=self.options.serializer.content_type,
-                                expiration=message.expire_after,
-                            ),
-                            routing_key=self.options.routing_key
-                            or self.options.queue_name,
-                        ),
-                        timeout=self.PUBLISH_TIMEOUT.total_seconds(),
-                    )
+                    await self._publish_body(exchange, body, message)
                     self.publish_bytes_counter.add(len(body), {"topic": self.name})
                     return True
                 except aio_pika.exceptions.DeliveryError as e:
@@ -339,6 +328,83 @@ class RabbitMQTopic(Topic):
         self.is_closed = True
         await self.exit_stack.aclose()
 
+    async def publish_many(
+        self, messages: Sequence[TopicMessage], wait: bool
+    ) -> list[bool]:
+        """Publish a batch of messages before waiting for their confirmations.
+
+        Without `wait`, messages that are nacked, or that fail like a
+        `publish` without `wait` would raise, are reported as unpublished and
+        the failures are logged. The executor then publishes them again with
+        `wait`, which raises on errors like before.
+        """
+        if self.is_closed:
+            raise TopicClosedError()
+
+        # Blocking publishes go through the retry logic, one at a time.
+        if wait:
+            return await super().publish_many(messages, wait=True)
+
+        if self._publish_lock.locked_reservations():
+            return [False] * len(messages)
+
+        async with self._publish_lock.reserve():
+            try:
+                await self.ensure_queue()
+                exchange = await self.exchange
+            except Exception:
+                self.logger.exception("Failed to publish")
+                return [False] * len(messages)
+
+            # Publish the whole batch before waiting for the confirmations.
+            bodies = [self._serialize(message) for message in messages]
+            results = await asyncio.gather(
+                *[
+                    self._publish_body(exchange, body, message)
+                    for body, message in zip(bodies, messages, strict=True)
+                ],
+                return_exceptions=True,
+            )
+
+        published = []
+        for body, result in zip(bodies, results, strict=True):
+            if isinstance(result, BaseException):
+                # Only nacks from a full queue are expected.
+                if not self._is_nack(result):
+                    self.logger.error("Failed to publish", exc_info=result)
+                published.append(False)
+                continue
+            self.publish_bytes_counter.add(len(body), {"topic": self.name})
+            published.append(True)
+        return published
+
+    @staticmethod
+    def _is_nack(error: BaseException) -> bool:
+        return (
+            isinstance(error, aio_pika.exceptions.DeliveryError)
+            and not isinstance(error, aio_pika.exceptions.PublishError)
+            and error.frame.name == "Basic.Nack"
+        )
+
+    async def _publish_body(
+        self,
+        exchange: aio_pika.abc.AbstractExchange,
+        body: bytes,
+        message: TopicMessage,
+    ) -> None:
+        await asyncio.wait_for(
+            exchange.publish(
+                aio_pika.Message(
+                    body=body,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    content_type=self.options.serializer.content_type,
+                    expiration=message.expire_after,
+                ),
+                routing_key=self.options.routing_key or self.options.queue_name,
+            ),
+            timeout=self.PUBLISH_TIMEOUT.total_seconds(),
+        )
+
     def _serialize(self, message: TopicMessage) -> bytes:
         if self.options.serializer == RabbitMQSerializer.PICKLE:
             serialized_message = pickle.dumps(message)
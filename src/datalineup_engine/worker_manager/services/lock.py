@@ -7,6 +7,7 @@ from datalineup_engine.core.api import LockInput
 from datalineup_engine.core.api import LockResponse
 from datalineup_engine.core.api import ResourceItem
 from datalineup_engine.core.api import ResourcesProviderItem
+from datalineup_engine.core.resource import declared_base_type
 from datalineup_engine.models.queue import Queue
 from datalineup_engine.stores import jobs_store
 from datalineup_engine.stores import queues_store
@@ -85,7 +86,9 @@ def lock_jobs(
         item_resources_providers: dict[str, ResourcesProviderItem] = {}
         missing_resource = False
         for resource_type in item.queue_item.pipeline.info.resources.values():
-            pipeline_resources = static_definitions.resources_by_type.get(resource_type)
+            pipeline_resources = static_definitions.resources_by_type.get(
+                declared_base_type(resource_type)
+            )
 
             if not pipeline_resources:
                 logger.error(
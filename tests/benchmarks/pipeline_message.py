@@ -0,0 +1,97 @@
+"""Compare `PipelineMessage.execute` with and without the cached pipeline plan.
+
+Before the plan, every message imported its pipeline and its meta args types,
+then looked up the meta args in the pipeline arguments and validated all the
+arguments with pydantic. This benchmark measures the per-call overhead of both
+paths, first resolving the pipeline alone, then executing a whole message.
+
+Run with: python -m tests.benchmarks.pipeline_message
+"""
+
+import argparse
+import timeit
+
+from datalineup_engine.core import PipelineInfo
+from datalineup_engine.core import TopicMessage
+from datalineup_engine.core.pipeline import CancellationToken
+from datalineup_engine.utils.inspect import dataclass_from_params
+from datalineup_engine.utils.inspect import import_name
+from datalineup_engine.utils.options import fromdict
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+from datalineup_engine.worker.pipeline_message import pipeline_plan
+
+
+def pipeline(
+    url: str,
+    depth: int,
+    message: TopicMessage,
+    token: CancellationToken,
+    tag: str = "",
+) -> int:
+    return depth
+
+
+def uncached_resolve(message: PipelineMessage) -> None:
+    pipeline = message.info.into_pipeline()
+    pipeline_args_def = dataclass_from_params(pipeline)
+    for meta_name in message.meta_args:
+        pipeline_args_def.find_by_type(import_name(meta_name))
+
+
+def cached_resolve(message: PipelineMessage) -> None:
+    plan = pipeline_plan(message.info.name)
+    for meta_name in message.meta_args:
+        plan.meta_arg(meta_name)
+
+
+def uncached_execute(message: PipelineMessage) -> object:
+    """`PipelineMessage.execute` before the pipeline plan."""
+    pipeline = message.info.into_pipeline()
+    pipeline_args_def = dataclass_from_params(pipeline)
+    args = dict(message.message.args)
+
+    for meta_name, value in message.meta_args.items():
+        meta_type = import_name(meta_name)
+        arg = pipeline_args_def.find_by_type(meta_type)
+        if arg:
+            args[arg] = value
+
+    pipeline_args = fromdict(args, pipeline_args_def)
+    return pipeline_args.call(kwargs=args)
+
+
+def make_message() -> PipelineMessage:
+    message = PipelineMessage(
+        info=PipelineInfo.from_pipeline(pipeline),
+        message=TopicMessage(args={"url": "https://example.com", "depth": 2}),
+    )
+    message.set_meta_arg(meta_type=TopicMessage, value=message.message)
+    message.set_meta_arg(meta_type=CancellationToken, value=CancellationToken())
+    return message
+
+
+def per_call_us(func: object, message: PipelineMessage, *, number: int) -> float:
+    timer = timeit.Timer(lambda: func(message))  # type: ignore[operator]
+    return min(timer.repeat(repeat=5, number=number)) / number * 1_000_000
+
+
+def main(*, number: int) -> None:
+    message = make_message()
+    # Warm up the caches shared by both paths.
+    assert uncached_execute(message) == message.execute() == 2
+
+    print(f"{'':>10} {'uncached (us)':>14} {'plan (us)':>10}")
+    for name, uncached, cached in [
+        ("resolve", uncached_resolve, cached_resolve),
+        ("execute", uncached_execute, PipelineMessage.execute),
+    ]:
+        old = per_call_us(uncached, message, number=number)
+        new = per_call_us(cached, message, number=number)
+        print(f"{name:>10} {old:>14.2f} {new:>10.2f}  x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=10_000)
+    args = parser.parse_args()
+    main(number=args.number)
@@ -0,0 +1,59 @@
+"""Compare the `limits` storage rate limiters with the local GCRA one.
+
+Rate limited resources hit their limiter every time they are acquired. This
+benchmark acquires and releases many rate limited resources, with limits
+high enough to never delay them, and measures how many acquisitions each
+strategy handles per second.
+
+Run with: python -m tests.benchmarks.resources
+"""
+
+import argparse
+import asyncio
+import time
+
+from datalineup_engine.worker.resources.manager import ResourceData
+from datalineup_engine.worker.resources.manager import ResourceRateLimit
+from datalineup_engine.worker.resources.manager import ResourcesManager
+
+
+async def run_once(strategy: str, *, resources: int, acquisitions: int) -> float:
+    manager = ResourcesManager()
+    for i in range(resources):
+        await manager.add(
+            ResourceData(
+                name=f"bench-{i}",
+                type="bench",
+                data={},
+                rate_limit=ResourceRateLimit(
+                    rate_limits=["1000000 per second", "1000000000 per day"],
+                    strategy=strategy,
+                ),
+            )
+        )
+
+    start = time.perf_counter()
+    for _ in range(acquisitions):
+        async with await manager.acquire("bench"):
+            pass
+    elapsed = time.perf_counter() - start
+    return acquisitions / elapsed
+
+
+async def main(sizes: list[int], *, acquisitions: int) -> None:
+    strategies = ["fixed-window", "moving-window", "gcra"]
+    print(f"{'resources':>10}" + "".join(f"{s + ' (acq/s)':>22}" for s in strategies))
+    for size in sizes:
+        rates = [
+            await run_once(strategy, resources=size, acquisitions=acquisitions)
+            for strategy in strategies
+        ]
+        print(f"{size:>10}" + "".join(f"{rate:>22.0f}" for rate in rates))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1_000])
+    parser.add_argument("--acquisitions", type=int, default=20_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, acquisitions=args.acquisitions))
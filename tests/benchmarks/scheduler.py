@@ -0,0 +1,125 @@
+"""Compare the ready-queue `Scheduler` with the previous `asyncio.wait` one.
+
+Most queues held by a worker are idle: their topic has no message and their
+`__anext__` task stays pending. This benchmark keeps a few busy schedulables
+among many idle ones and measures how many items each scheduler yields per
+second.
+
+Run with: python -m tests.benchmarks.scheduler
+"""
+
+import typing as t
+
+import argparse
+import asyncio
+import time
+from collections.abc import AsyncGenerator
+from collections.abc import AsyncIterator
+from collections.abc import Coroutine
+
+from datalineup_engine.utils.asyncutils import TasksGroup
+from datalineup_engine.worker.executors.scheduler import Schedulable
+from datalineup_engine.worker.executors.scheduler import SchedulableProtocol
+from datalineup_engine.worker.executors.scheduler import Scheduler
+from datalineup_engine.worker.executors.scheduler import ScheduleSlot
+
+T = t.TypeVar("T")
+
+
+class WaitScheduler(Scheduler[T]):
+    """The previous scheduler, waiting on every pending task at each step."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.tasks_group = TasksGroup()
+
+    def _watch_task(self, task: asyncio.Task, *, item: SchedulableProtocol[T]) -> None:
+        self.tasks[task] = item
+        self.tasks_group.add(task)
+
+    async def close(self) -> None:
+        self.is_running = False
+        await self.tasks_group.close()
+        for item in self.schedule_slots.values():
+            self.stop_slot(item)
+
+    async def run(self) -> AsyncIterator[T]:
+        self.is_running = True
+        while self.is_running or self.tasks_group.tasks:
+            done = await self.tasks_group.wait()
+            for task in sorted(done, key=self.task_order):
+                async for item in self.process_task(task):
+                    yield item
+
+    async def _requeue_task(
+        self, *, item: SchedulableProtocol[T], schedule_slot: ScheduleSlot[T]
+    ) -> None:
+        anext = t.cast(Coroutine[t.Any, t.Any, T], schedule_slot.generator.__anext__())
+        new_task = asyncio.create_task(anext)
+        schedule_slot.task = new_task
+        schedule_slot.order += 1
+        self._watch_task(new_task, item=item)
+
+
+async def busy() -> AsyncGenerator[int, None]:
+    while True:
+        await asyncio.sleep(0)
+        yield 1
+
+
+async def idle(event: asyncio.Event) -> AsyncGenerator[int, None]:
+    while True:
+        await event.wait()
+        yield 0
+
+
+async def run_once(
+    scheduler_cls: t.Type[Scheduler[int]],
+    *,
+    schedulables: int,
+    busy_count: int,
+    items: int,
+) -> float:
+    scheduler = scheduler_cls()
+    never = asyncio.Event()
+    for i in range(schedulables):
+        iterable = busy() if i < busy_count else idle(never)
+        scheduler.add(Schedulable(iterable=iterable, name=f"bench-{i}"))
+
+    # Let every schedulable reach its first suspension point.
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    count = 0
+    async for _ in scheduler.run():
+        count += 1
+        if count >= items:
+            break
+    elapsed = time.perf_counter() - start
+
+    await scheduler.close()
+    return items / elapsed
+
+
+async def main(sizes: list[int], *, busy_count: int, items: int) -> None:
+    print(f"{'schedulables':>12} {'wait (items/s)':>16} {'ready (items/s)':>16}")
+    for size in sizes:
+        busy_size = min(busy_count, size)
+        old = await run_once(
+            WaitScheduler, schedulables=size, busy_count=busy_size, items=items
+        )
+        new = await run_once(
+            Scheduler, schedulables=size, busy_count=busy_size, items=items
+        )
+        print(f"{size:>12} {old:>16.0f} {new:>16.0f}  x{new / old:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 1_000, 10_000]
+    )
+    parser.add_argument("--busy", type=int, default=4)
+    parser.add_argument("--items", type=int, default=5_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, busy_count=args.busy, items=args.items))
@@ -10,6 +10,7 @@ from datalineup_engine.core.pipeline import PipelineInfo
 from datalineup_engine.core.pipeline import ResourceUsed
 from datalineup_engine.core.topic import TopicMessage
 from datalineup_engine.worker.pipeline_message import PipelineMessage
+from datalineup_engine.worker.pipeline_message import pipeline_plan
 
 
 class FakeResource1(Resource):
@@ -108,6 +109,24 @@ def test_pipeline_kwargs_execute() -> None:
     )
 
 
+def test_pipeline_plan_cached() -> None:
+    info = PipelineInfo.from_pipeline(pipeline)
+    plan = pipeline_plan(info.name)
+    assert pipeline_plan(info.name) is plan
+    assert plan.pipeline is pipeline
+
+    msg = PipelineMessage(info=info, message=TopicMessage(args={}))
+    msg.set_meta_arg(meta_type=MetaType, value=C("c"))
+    msg.set_meta_arg(meta_type=CancellationToken, value=CancellationToken())
+    for _ in range(2):
+        for meta_name in msg.meta_args:
+            plan.meta_arg(meta_name)
+    assert plan.meta_args == {
+        "tests.core.test_pipeline.MetaType": "c",
+        "datalineup_engine.core.pipeline.CancellationToken": None,
+    }
+
+
 def test_cancellation_oken_serialization() -> None:
     token = CancellationToken()
 
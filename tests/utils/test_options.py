@@ -1,8 +1,15 @@
+import typing as t
+
 import dataclasses
 from datetime import datetime
+from unittest.mock import Mock
+
+import pydantic.v1
+import pytest
 
 from datalineup_engine.utils.options import OptionsSchema
 from datalineup_engine.utils.options import asdict
+from datalineup_engine.utils.options import compile_fromdict
 from datalineup_engine.utils.options import fromdict
 from datalineup_engine.utils.options import json_serializer
 
@@ -28,6 +35,14 @@ class BetterObject(Object):
     z: NestedObjectA
 
 
+@dataclasses.dataclass
+class TrivialObject:
+    x: int
+    mock: t.Optional[Mock]
+    y: t.Any = None
+    z: str = "z"
+
+
 class FromObject(OptionsSchema):
     class Options(Object):
         pass
@@ -61,3 +76,39 @@ def test_inheritance() -> None:
     assert b == BetterObject(
         x="foo", y=datetime(2020, 1, 1, 1, 1, 1), z=NestedObjectA(fielda="foo")
     )
+
+
+def test_compile_fromdict(monkeypatch: pytest.MonkeyPatch) -> None:
+    fromdict_spy = Mock(wraps=fromdict)
+    monkeypatch.setattr("datalineup_engine.utils.options.fromdict", fromdict_spy)
+    bind = compile_fromdict(TrivialObject)
+    mock = Mock()
+
+    # Values validated unchanged skip the validation.
+    assert bind({"x": 1, "mock": mock, "y": [1]}, {}) == TrivialObject(
+        x=1, mock=mock, y=[1]
+    )
+    assert bind({"x": 1, "mock": None, "z": "a"}, {}) == TrivialObject(
+        x=1, mock=None, z="a"
+    )
+    fromdict_spy.assert_not_called()
+
+    # Anything else is fully validated.
+    assert bind({"x": "1", "mock": None}, {}) == TrivialObject(x=1, mock=None)
+    assert bind({"x": True, "mock": None}, {}) == TrivialObject(x=1, mock=None)
+    with pytest.raises(pydantic.v1.ValidationError):
+        bind({"x": 1}, {})
+    with pytest.raises(pydantic.v1.ValidationError):
+        bind({"x": 1, "mock": "mock"}, {})
+    assert fromdict_spy.call_count == 4
+
+    # Trusted values only need to be instances of their field type.
+    nested = NestedObjectA(fielda="a")
+    bind = compile_fromdict(BetterObject)
+    now = datetime.now()
+    assert bind({"x": "foo"}, {"y": now, "z": nested}).z is nested
+    assert fromdict_spy.call_count == 4
+    assert bind({"x": "foo"}, {"y": now, "z": {"fielda": "a"}}) == BetterObject(
+        x="foo", y=now, z=nested
+    )
+    assert fromdict_spy.call_count == 5
@@ -4,8 +4,14 @@ from datetime import timedelta
 
 import pytest
 
+from datalineup_engine.core import KeyedResource
+from datalineup_engine.core import PipelineInfo
+from datalineup_engine.core import TopicMessage
 from datalineup_engine.core.api import ResourcesProviderItem
 from datalineup_engine.utils import utcnow
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+from datalineup_engine.worker.resources.manager import ResourceUnavailable
+from datalineup_engine.worker.resources.provider import KeyedResourcesProvider
 from datalineup_engine.worker.resources.provider import PeriodicSyncOptions
 from datalineup_engine.worker.resources.provider import PeriodicSyncProvider
 from datalineup_engine.worker.resources.provider import ProvidedResource
@@ -113,3 +119,64 @@ async def test_periodic_sync_provider(services_manager: ServicesManager) -> None
     assert utcnow() >= (start_date + timedelta(minutes=20))
 
     await provider._close()
+
+
+class Host(KeyedResource):
+    typename = "tests.Host"
+    key_arg = "url"
+    key_host = True
+
+
+def crawl(url: str, host: Host) -> None:
+    pass
+
+
+@pytest.mark.asyncio
+async def test_keyed_resources(services_manager: ServicesManager) -> None:
+    provider = KeyedResourcesProvider(
+        options=KeyedResourcesProvider.Options(concurrency=2),
+        services=services_manager.services,
+        definition=ResourcesProviderItem(
+            name="test-provider",
+            type="KeyedResourcesProvider",
+            resource_type="tests.Host",
+            options={},
+        ),
+    )
+    resources_manager = services_manager.services.s.resources_manager
+    await provider._open()
+
+    info = PipelineInfo.from_pipeline(crawl)
+    assert info.resources == {"host": "tests.Host[url:host]"}
+
+    messages = [
+        PipelineMessage(info=info, message=TopicMessage(args={"url": url}))
+        for url in ("https://a.com/1", "https://a.com/2", "http://a.com:8080/")
+    ]
+    assert messages[0].missing_resources == {"tests.Host/a.com"}
+
+    # Each host is acquired up to the key concurrency.
+    async with await resources_manager.acquire_many(
+        messages[0].missing_resources, wait=False
+    ) as first, await resources_manager.acquire_many(
+        messages[1].missing_resources, wait=False
+    ):
+        with pytest.raises(ResourceUnavailable):
+            await resources_manager.acquire_many(
+                messages[2].missing_resources, wait=False
+            )
+        async with await resources_manager.acquire_many(
+            {"tests.Host/b.com"}, wait=False
+        ):
+            pass
+
+        resource = first["tests.Host/a.com"].resource
+        assert resource and resource.data == {"key": "a.com"}
+
+    messages[0].update_with_resources({"tests.Host/a.com": {"key": "a.com"}})
+    assert messages[0].message.args["host"] == {"key": "a.com"}
+
+    await provider._close()
+
+    assert not resources_manager.keyed_pools
+    assert not resources_manager.resources
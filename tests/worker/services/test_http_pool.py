@@ -0,0 +1,127 @@
+import typing as t
+
+import os
+from collections.abc import AsyncIterator
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import BaseTestServer
+from aiohttp.test_utils import TestServer
+
+from datalineup_engine.config import Config
+from datalineup_engine.core import PipelineInfo
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.core import TopicMessage
+from datalineup_engine.worker.executors import Executor
+from datalineup_engine.worker.executors.async_executor import AsyncExecutor
+from datalineup_engine.worker.executors.executable import ExecutableMessage
+from datalineup_engine.worker.executors.process import PoolType
+from datalineup_engine.worker.executors.process import ProcessExecutor
+from datalineup_engine.worker.services.hooks import PipelineEventsEmitted
+from datalineup_engine.worker.services.http_pool import HostStats
+from datalineup_engine.worker.services.http_pool import HttpPool
+from datalineup_engine.worker.services.http_pool import HttpPoolStats
+from datalineup_engine.worker.services.manager import ServicesManager
+from tests.utils import TimeForwardLoop
+from tests.utils.metrics import MetricsCapture
+
+
+async def fetch_pipeline(url: str, close: bool, http: HttpPool) -> TopicMessage:
+    headers = {"Connection": "close"} if close else {}
+    async with http.session.get(url, headers=headers) as response:
+        return TopicMessage(args={"body": await response.text(), "pid": os.getpid()})
+
+
+@pytest.fixture
+def config(config: Config) -> Config:
+    return config.load_object(
+        {
+            "services_manager": {
+                "services": [
+                    "datalineup_engine.worker.services.http_pool.ExecutorHttpPool",
+                ]
+            }
+        }
+    )
+
+
+@pytest.fixture
+async def http_server() -> AsyncIterator[BaseTestServer]:
+    async def hello(request: web.Request) -> web.Response:
+        return web.Response(text="hello")
+
+    app = web.Application()
+    app.router.add_get("/", hello)
+    async with TestServer(app, host="127.0.0.1") as server:
+        yield server
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("executor_type", ["async", "async_process"])
+async def test_http_pool(
+    services_manager: ServicesManager,
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+    http_server: BaseTestServer,
+    executor_type: str,
+) -> None:
+    running_event_loop.forward_time = False
+    executor: Executor
+    if executor_type == "async":
+        executor = AsyncExecutor(
+            AsyncExecutor.Options(), services=services_manager.services
+        )
+    else:
+        executor = ProcessExecutor(
+            ProcessExecutor.Options(max_workers=1, pool_type=PoolType.ASYNC_PROCESS),
+            services=services_manager.services,
+        )
+
+    url = f"http://localhost:{http_server.port}/"
+    results: list[PipelineResults] = []
+    try:
+        # The first connection is closed, the next one is kept alive.
+        for close in (True, False, False):
+            xmsg = executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(fetch_pipeline),
+                message=TopicMessage(args={"url": url, "close": close}),
+            )
+            results.append(await executor.process_message(xmsg))
+            await services_manager.services.s.hooks.pipeline_events_emitted.emit(
+                PipelineEventsEmitted(events=results[-1].events, xmsg=xmsg)
+            )
+    finally:
+        await executor.close()
+
+    assert {r.outputs[0].message.args["body"] for r in results} == {"hello"}
+    assert len({r.outputs[0].message.args["pid"] for r in results}) == 1
+
+    # Statistics are reported once, with the message that collected them.
+    stats = [e for r in results for e in r.events]
+    assert all(isinstance(e, HttpPoolStats) for e in stats)
+    assert [e.hosts for e in stats] == [  # type: ignore[attr-defined]
+        {"localhost": HostStats(requests=1, connections_created=1, dns_cache_misses=1)},
+        {"localhost": HostStats(requests=1, connections_created=1, dns_cache_hits=1)},
+        {"localhost": HostStats(requests=1, connections_reused=1)},
+    ]
+
+    params = {"executor": xmsg.queue.definition.executor, "host": "localhost"}
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.http_pool.requests",
+        [metrics_capture.create_number_data_point(3, params)],
+    )
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.http_pool.connections",
+        [
+            metrics_capture.create_number_data_point(2, params | {"state": "created"}),
+            metrics_capture.create_number_data_point(1, params | {"state": "reused"}),
+        ],
+    )
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.http_pool.dns",
+        [
+            metrics_capture.create_number_data_point(1, params | {"cache": "miss"}),
+            metrics_capture.create_number_data_point(1, params | {"cache": "hit"}),
+        ],
+    )
@@ -0,0 +1,85 @@
+import pytest
+
+from datalineup_engine.config import Config
+from datalineup_engine.worker.resources.manager import ResourceData
+from datalineup_engine.worker.resources.manager import ResourcesManager
+from datalineup_engine.worker.services.manager import ServicesManager
+from tests.utils import TimeForwardLoop
+from tests.utils.metrics import MetricsCapture
+
+
+@pytest.fixture
+def config(config: Config) -> Config:
+    return config.load_object(
+        {
+            "services_manager": {
+                "services": [
+                    "datalineup_engine.worker.services.resources_selection"
+                    ".ResourcesSelection",
+                ]
+            },
+            "resources_selection": {"policy": "latency", "types": {"E": "errors"}},
+        }
+    )
+
+
+async def use(
+    resources_manager: ResourcesManager,
+    resource_type: str,
+    *,
+    duration: float = 0,
+    failed: bool = False,
+) -> str:
+    async with await resources_manager.acquire(resource_type, wait=False) as context:
+        assert context.resource
+        name = context.resource.name
+        context.report(duration=duration, failed=failed)
+    return name
+
+
+@pytest.mark.asyncio
+async def test_resources_selection(
+    services_manager: ServicesManager,
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+) -> None:
+    resources_manager = services_manager.services.s.resources_manager
+    for typ in ("L", "E"):
+        for name in ("a", "b", "c"):
+            await resources_manager.add(
+                ResourceData(name=f"{typ}-{name}", type=typ, data={})
+            )
+
+    # Every resource is tried once, then the fastest one is selected.
+    for name, duration in (("L-a", 3), ("L-b", 1), ("L-c", 2)):
+        assert await use(resources_manager, "L", duration=duration) == name
+    assert await use(resources_manager, "L", duration=1) == "L-b"
+
+    # Failing resources are avoided, even when faster.
+    for name, failed in (("E-a", True), ("E-b", False), ("E-c", True)):
+        assert await use(resources_manager, "E", failed=failed) == name
+    assert await use(resources_manager, "E", duration=5) == "E-b"
+    assert await use(resources_manager, "E") == "E-b"
+
+    # Resources are still given to any acquirer when the best one is in use.
+    async with await resources_manager.acquire("E", wait=False) as context:
+        assert context.resource and context.resource.name == "E-b"
+        assert await use(resources_manager, "E") in {"E-a", "E-c"}
+
+    metrics_capture.assert_metric_expected(
+        "datalineup.resources.errors",
+        [
+            metrics_capture.create_number_data_point(1, {"type": "E", "name": name})
+            for name in ("E-a", "E-c")
+        ],
+    )
+    metrics_capture.assert_data_point_expected(
+        metrics_capture.create_histogram_data_point(
+            count=2,
+            sum_data_point=2000,
+            max_data_point=1000,
+            min_data_point=1000,
+            attributes={"type": "L", "name": "L-b"},
+        ),
+        metrics_capture.get_metric("datalineup.resources.duration").data.data_points,
+    )
@@ -0,0 +1,397 @@
+import typing as t
+
+import asyncio
+import pickle  # noqa: S403
+
+import fakeredis
+import pytest
+import redis.exceptions
+from arq.connections import ArqRedis
+from arq.constants import in_progress_key_prefix
+from arq.worker import Worker
+from pytest_mock import MockerFixture
+from redis.asyncio import ConnectionPool
+
+from datalineup_engine.core import PipelineInfo
+from datalineup_engine.core import TopicMessage
+from datalineup_engine.worker.executors.arq import executor_healthcheck_key
+from datalineup_engine.worker.executors.arq import healthcheck_interval
+from datalineup_engine.worker.executors.arq import results_key
+from datalineup_engine.worker.executors.arq import worker_healthcheck_key
+from datalineup_engine.worker.executors.arq.executor import ARQExecutor
+from datalineup_engine.worker.executors.arq.executor import MonitoredJob
+from datalineup_engine.worker.executors.arq.executor import PendingJob
+from datalineup_engine.worker.executors.arq.serializer import Compression
+from datalineup_engine.worker.executors.arq.serializer import Serializer
+from datalineup_engine.worker.executors.arq.serializer import SerializerFormat
+from datalineup_engine.worker.executors.arq.serializer import loads
+from datalineup_engine.worker.executors.arq.worker import WorkerHeartbeat
+from datalineup_engine.worker.executors.arq.worker import WorkerSettings
+from datalineup_engine.worker.executors.arq.worker import WorkerType
+from datalineup_engine.worker.executors.bootstrap import RemoteException
+from datalineup_engine.worker.executors.executable import ExecutableMessage
+from datalineup_engine.worker.services.manager import ServicesManager
+from tests.utils import TimeForwardLoop
+
+# ArqRedis.close is deprecated on recent redis versions but is the only way to
+# close the pool on the versions supported by arq.
+pytestmark = pytest.mark.filterwarnings(
+    "ignore:Call to deprecated close:DeprecationWarning"
+)
+
+
+def echo_pipeline(n: int) -> TopicMessage:
+    return TopicMessage(args={"n": n})
+
+
+@pytest.fixture
+def redis_pool_maker() -> t.Callable[[], ConnectionPool]:
+    server = fakeredis.FakeServer()
+
+    def maker() -> ConnectionPool:
+        return ConnectionPool(
+            connection_class=fakeredis.FakeAsyncRedisConnection, server=server
+        )
+
+    return maker
+
+
+@pytest.fixture
+async def arq_redis(
+    redis_pool_maker: t.Callable[[], ConnectionPool],
+) -> t.AsyncIterator[ArqRedis]:
+    redis = ArqRedis(connection_pool=redis_pool_maker())
+    yield redis
+    await redis.close(close_connection_pool=True)
+
+
+@pytest.fixture
+async def arq_executor_maker(
+    services_manager: ServicesManager,
+    redis_pool_maker: t.Callable[[], ConnectionPool],
+    arq_redis: ArqRedis,
+) -> t.AsyncIterator[t.Callable[..., ARQExecutor]]:
+    executors = []
+
+    def maker(**kwargs: t.Any) -> ARQExecutor:
+        executor = ARQExecutor(
+            ARQExecutor.Options(
+                redis_url="redis://localhost", concurrency=10, **kwargs
+            ),
+            services=services_manager.services,
+        )
+        executor.name = "arq"
+        executor.create_connection_pool = (  # type: ignore[method-assign]
+            redis_pool_maker
+        )
+        executors.append(executor)
+        return executor
+
+    yield maker
+    for executor in executors:
+        await executor.close()
+        # fakeredis keeps a cancelled BLPOP blocked until it pops an item.
+        await arq_redis.rpush(  # type: ignore[misc]
+            results_key(executor.worker_id), b""
+        )
+    await asyncio.sleep(0)
+
+
+@pytest.fixture
+def arq_executor(arq_executor_maker: t.Callable[..., ARQExecutor]) -> ARQExecutor:
+    return arq_executor_maker()
+
+
+@pytest.fixture
+async def arq_worker(
+    arq_redis: ArqRedis, monkeypatch: pytest.MonkeyPatch
+) -> t.AsyncIterator[Worker]:
+    async def log_redis_info(*args: t.Any) -> None:
+        # fakeredis doesn't implement INFO.
+        pass
+
+    monkeypatch.setattr("arq.worker.log_redis_info", log_redis_info)
+    worker = Worker(
+        functions=WorkerSettings.functions,
+        on_startup=WorkerSettings.on_startup,  # type: ignore[arg-type]
+        on_shutdown=WorkerSettings.on_shutdown,  # type: ignore[arg-type]
+        redis_pool=arq_redis,
+        job_deserializer=WorkerSettings.job_deserializer,
+        ctx={"worker_type": WorkerType.THREAD, "worker_concurrency": 2},
+        handle_signals=False,
+        poll_delay=0.01,
+    )
+    task = asyncio.create_task(worker.async_run())
+    yield worker
+    await worker.close()
+    task.cancel()
+    await asyncio.wait([task])
+
+
+@pytest.mark.asyncio
+async def test_arq_executor_process_message(
+    arq_executor: ARQExecutor,
+    arq_worker: Worker,
+    arq_redis: ArqRedis,
+    executable_maker: t.Callable[..., ExecutableMessage],
+) -> None:
+    results = await asyncio.gather(
+        *[
+            arq_executor.process_message(
+                executable_maker(
+                    pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+                    message=TopicMessage(args={"n": n}),
+                )
+            )
+            for n in range(5)
+        ]
+    )
+    assert [r.outputs[0].message.args for r in results] == [{"n": n} for n in range(5)]
+
+    with pytest.raises(RemoteException) as excinfo:
+        await arq_executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+                message=TopicMessage(args={}),
+            )
+        )
+    assert excinfo.value.remote_traceback.exc_type == "ValidationError"
+
+    # A single healthcheck is kept for all the jobs of the executor.
+    assert await arq_redis.get(worker_healthcheck_key(arq_executor.worker_id))
+    assert arq_executor.monitored_jobs == {}
+    assert arq_executor.results == {}
+
+
+@pytest.mark.parametrize(
+    "format, compression",
+    [
+        (SerializerFormat.PICKLE, None),
+        (SerializerFormat.PICKLE, Compression.ZSTD),
+        (SerializerFormat.MSGPACK, None),
+        (SerializerFormat.MSGPACK, Compression.LZ4),
+    ],
+)
+def test_arq_serializer(
+    format: SerializerFormat, compression: t.Optional[Compression]
+) -> None:
+    serializer = Serializer(
+        format=format, compression=compression, compression_threshold=1024
+    )
+
+    small = {"n": 1, "message": TopicMessage(args={"n": 1})}
+    assert loads(serializer.dumps(small)) == small
+
+    large = {"data": bytearray(b"a" * 100_000), "items": ["b" * 100] * 100}
+    data = serializer.dumps(large)
+    assert loads(data) == large
+    if compression:
+        assert len(data) < 10_000
+
+    # Payloads from executors without a serializer are plain pickles.
+    assert loads(pickle.dumps(small)) == small
+
+
+@pytest.mark.asyncio
+async def test_arq_executor_serializer(
+    arq_executor_maker: t.Callable[..., ARQExecutor],
+    arq_worker: Worker,
+    executable_maker: t.Callable[..., ExecutableMessage],
+) -> None:
+    executor = arq_executor_maker(
+        serializer=SerializerFormat.MSGPACK,
+        compression=Compression.ZSTD,
+        compression_threshold=0,
+    )
+
+    results = await executor.process_message(
+        executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+            message=TopicMessage(args={"n": 1}),
+        )
+    )
+    assert results.outputs[0].message.args == {"n": 1}
+
+
+@pytest.mark.asyncio
+async def test_arq_executor_enqueue_batch(
+    arq_executor: ARQExecutor,
+    arq_worker: Worker,
+    executable_maker: t.Callable[..., ExecutableMessage],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    batches: list[int] = []
+    enqueue_jobs = arq_executor.enqueue_jobs
+
+    async def spy_enqueue_jobs(redis_queue: ArqRedis, jobs: list[PendingJob]) -> None:
+        batches.append(len(jobs))
+        await enqueue_jobs(redis_queue, jobs)
+
+    monkeypatch.setattr(arq_executor, "enqueue_jobs", spy_enqueue_jobs)
+
+    def message(n: int) -> ExecutableMessage:
+        return executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+            message=TopicMessage(args={"n": n}),
+        )
+
+    await arq_executor.process_message(message(0))
+    results = await asyncio.gather(
+        *[arq_executor.process_message(message(n)) for n in range(10)]
+    )
+    assert [r.outputs[0].message.args for r in results] == [{"n": n} for n in range(10)]
+    # Messages processed concurrently are enqueued in a single round-trip.
+    assert batches == [1, 10]
+
+
+@pytest.mark.asyncio
+async def test_arq_executor_results_latency(
+    arq_executor: ARQExecutor,
+    arq_worker: Worker,
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    running_event_loop.forward_time = False
+
+    # Results are pushed by the worker, so the latency isn't bound to the
+    # 0.5s delay `Job.result` polls with.
+    start = running_event_loop.time()
+    for n in range(5):
+        await arq_executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+                message=TopicMessage(args={"n": n}),
+            )
+        )
+    assert (running_event_loop.time() - start) / 5 < 0.25
+
+
+@pytest.mark.asyncio
+async def test_arq_executor_heartbeat_job_died(
+    arq_executor: ARQExecutor, arq_redis: ArqRedis
+) -> None:
+    redis_queue = await arq_executor.redis_queue
+    await arq_executor.start(redis_queue)
+
+    queued = MonitoredJob(job_id="queued")
+    running = MonitoredJob(job_id="running")
+    died = MonitoredJob(job_id="died")
+    arq_executor.monitored_jobs = {job.job_id: job for job in (queued, running, died)}
+    await arq_redis.set(executor_healthcheck_key("running"), b"healthy")
+    await arq_redis.set(in_progress_key_prefix + "running", b"1")
+    await arq_redis.set(in_progress_key_prefix + "died", b"1")
+
+    # A job in progress gets a beat of grace to set its healthcheck.
+    await arq_executor.beat(redis_queue)
+    assert not any(job.died.is_set() for job in (queued, running, died))
+
+    await arq_executor.beat(redis_queue)
+    assert not queued.died.is_set()
+    assert not running.died.is_set()
+    assert died.died.is_set()
+
+
+@pytest.mark.asyncio
+async def test_arq_executor_heartbeat_redis_error(
+    arq_executor: ARQExecutor,
+    running_event_loop: TimeForwardLoop,
+    mocker: MockerFixture,
+) -> None:
+    redis_queue = await arq_executor.redis_queue
+    heartbeat_task, _ = await arq_executor.start(redis_queue)
+    beat = mocker.patch.object(
+        arq_executor,
+        "beat",
+        side_effect=[redis.exceptions.ConnectionError("down"), None],
+    )
+
+    # The heartbeat keeps beating after a transient error.
+    await asyncio.sleep(healthcheck_interval * 2 + 1)
+    assert beat.call_count == 2
+    assert not heartbeat_task.done()
+
+
+@pytest.mark.asyncio
+async def test_arq_executor_results_redis_error(
+    arq_executor: ARQExecutor,
+    arq_worker: Worker,
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    mocker: MockerFixture,
+) -> None:
+    running_event_loop.forward_time = False
+    arq_executor.options.redis_conn_retry_delay = 0.1
+    redis_queue = await arq_executor.redis_queue
+    blpop = redis_queue.blpop
+    calls = 0
+
+    async def failing_blpop(*args: t.Any, **kwargs: t.Any) -> t.Any:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise redis.exceptions.ConnectionError("down")
+        return await blpop(*args, **kwargs)  # type: ignore[misc]
+
+    mocker.patch.object(redis_queue, "blpop", side_effect=failing_blpop)
+
+    # The results reception keeps going after a transient error.
+    results = await arq_executor.process_message(
+        executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+            message=TopicMessage(args={"n": 1}),
+        )
+    )
+    assert results.outputs[0].message.args == {"n": 1}
+    assert calls > 1
+    assert arq_executor.results_task and not arq_executor.results_task.done()
+
+
+@pytest.mark.asyncio
+async def test_arq_executor_results_undecodable(
+    arq_executor: ARQExecutor,
+    arq_redis: ArqRedis,
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    running_event_loop.forward_time = False
+    redis_queue = await arq_executor.redis_queue
+    _, results_task = await arq_executor.start(redis_queue)
+    loop = asyncio.get_running_loop()
+    broken = arq_executor.results["broken"] = loop.create_future()
+    valid = arq_executor.results["valid"] = loop.create_future()
+
+    # Only the job whose result can't be deserialized fails.
+    await arq_redis.rpush(  # type: ignore[misc]
+        results_key(arq_executor.worker_id),
+        b"broken:garbage",
+        b"valid:" + pickle.dumps({"success": True, "result": "ok"}),
+    )
+    with pytest.raises(pickle.UnpicklingError):
+        await asyncio.wait_for(broken, timeout=5)
+    assert await asyncio.wait_for(valid, timeout=5) == "ok"
+    assert not results_task.done()
+
+
+@pytest.mark.asyncio
+async def test_arq_worker_heartbeat(arq_redis: ArqRedis) -> None:
+    heartbeat = WorkerHeartbeat(arq_redis)
+    await arq_redis.set(worker_healthcheck_key("alive"), b"healthy")
+
+    async with heartbeat.watch(job_id="a", worker_id="alive") as alive_a:
+        async with heartbeat.watch(job_id="b", worker_id="alive") as alive_b:
+            async with heartbeat.watch(job_id="c", worker_id="dead") as dead:
+                await arq_redis.delete(executor_healthcheck_key("a"))
+                await heartbeat.beat()
+
+                assert not alive_a.is_set()
+                assert not alive_b.is_set()
+                assert dead.is_set()
+                assert (
+                    await arq_redis.mget(
+                        [executor_healthcheck_key(job_id) for job_id in "abc"]
+                    )
+                    == [b"healthy"] * 3
+                )
+                assert await arq_redis.pttl(executor_healthcheck_key("a")) > 0
+
+    assert heartbeat.jobs == {}
+    assert heartbeat.watchers == {}
@@ -0,0 +1,166 @@
+import typing as t
+
+import asyncio
+from collections.abc import AsyncIterator
+from collections.abc import Generator
+
+import pytest
+
+from datalineup_engine.core import PipelineInfo
+from datalineup_engine.core import PipelineOutput
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.core import TopicMessage
+from datalineup_engine.worker.executors import BUILTINS
+from datalineup_engine.worker.executors.async_executor import AsyncExecutor
+from datalineup_engine.worker.executors.bootstrap import PipelineBootstrap
+from datalineup_engine.worker.executors.bootstrap import RemoteException
+from datalineup_engine.worker.executors.executable import ExecutableMessage
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+from datalineup_engine.worker.services.manager import ServicesManager
+from tests.utils import TimeForwardLoop
+
+
+async def echo_pipeline(n: int) -> TopicMessage:
+    await asyncio.sleep(1)
+    return TopicMessage(args={"n": n})
+
+
+async def stream_pipeline(n: int) -> AsyncIterator[PipelineOutput]:
+    for i in range(n):
+        await asyncio.sleep(0)
+        yield PipelineOutput(channel="out", message=TopicMessage(args={"i": i}))
+
+
+async def blocked_pipeline() -> None:
+    await asyncio.sleep(3600)
+
+
+@pytest.fixture
+async def async_executor_maker(
+    services_manager: ServicesManager,
+) -> t.AsyncIterator[t.Callable[..., AsyncExecutor]]:
+    executors = []
+
+    def maker(**kwargs: t.Any) -> AsyncExecutor:
+        executor = AsyncExecutor(
+            AsyncExecutor.Options(**kwargs), services=services_manager.services
+        )
+        executors.append(executor)
+        return executor
+
+    yield maker
+    for executor in executors:
+        await executor.close()
+
+
+def test_async_executor_builtin() -> None:
+    assert BUILTINS["AsyncExecutor"] is AsyncExecutor
+
+
+@pytest.mark.asyncio
+async def test_async_executor_process_message(
+    async_executor_maker: t.Callable[..., AsyncExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    services_manager: ServicesManager,
+) -> None:
+    executed: list[t.Union[PipelineResults, Exception]] = []
+
+    def on_pipeline_executed(
+        message: PipelineMessage,
+    ) -> Generator[None, PipelineResults, None]:
+        try:
+            executed.append((yield))
+        except Exception as e:
+            executed.append(e)
+
+    def on_executor_initialized(bootstrapper: PipelineBootstrap) -> None:
+        bootstrapper.pipeline_hook.register(on_pipeline_executed)
+
+    services_manager.services.s.hooks.executor_initialized.register(
+        on_executor_initialized
+    )
+    executor = async_executor_maker()
+
+    results = await executor.process_message(
+        executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+            message=TopicMessage(args={"n": 1}),
+        )
+    )
+    assert [(o.channel, o.message.args) for o in results.outputs] == [
+        ("default", {"n": 1})
+    ]
+
+    results = await executor.process_message(
+        executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(stream_pipeline),
+            message=TopicMessage(args={"n": 2}),
+        )
+    )
+    assert [(o.channel, o.message.args) for o in results.outputs] == [
+        ("out", {"i": 0}),
+        ("out", {"i": 1}),
+    ]
+
+    with pytest.raises(RemoteException) as excinfo:
+        await executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+                message=TopicMessage(args={}),
+            )
+        )
+    assert excinfo.value.remote_traceback.exc_type == "ValidationError"
+
+    assert len(executed) == 3
+    assert isinstance(executed[2], Exception)
+
+
+@pytest.mark.asyncio
+async def test_async_executor_concurrency(
+    async_executor_maker: t.Callable[..., AsyncExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    executor = async_executor_maker(concurrency=50)
+    assert executor.concurrency == 50
+
+    # All messages run concurrently on the loop, so they complete after a
+    # single pipeline delay.
+    start = running_event_loop.time()
+    results = await asyncio.gather(
+        *[
+            executor.process_message(
+                executable_maker(
+                    pipeline_info=PipelineInfo.from_pipeline(echo_pipeline),
+                    message=TopicMessage(args={"n": n}),
+                )
+            )
+            for n in range(50)
+        ]
+    )
+    assert running_event_loop.time() - start == pytest.approx(1, abs=0.1)
+    assert [r.outputs[0].message.args["n"] for r in results] == list(range(50))
+
+
+@pytest.mark.asyncio
+async def test_async_executor_timeout(
+    async_executor_maker: t.Callable[..., AsyncExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+) -> None:
+    executor = async_executor_maker(timeout=10)
+    pipeline_info = PipelineInfo.from_pipeline(blocked_pipeline)
+
+    with pytest.raises(RemoteException) as excinfo:
+        await executor.process_message(executable_maker(pipeline_info=pipeline_info))
+    assert excinfo.value.remote_traceback.exc_type == "TimeoutError"
+
+    # The timeout can be overridden from the message config.
+    message = TopicMessage(args={}, config={"async_executor": {"timeout": 0.5}})
+    task = asyncio.create_task(
+        executor.process_message(
+            executable_maker(pipeline_info=pipeline_info, message=message)
+        )
+    )
+    done, _ = await asyncio.wait([task], timeout=1)
+    assert task in done
+    assert isinstance(task.exception(), RemoteException)
@@ -1,16 +1,69 @@
+import typing as t
 from typing import Optional
 
+import asyncio
 import pickle  # noqa: S403
 import sys
 
+import pytest
+
+from datalineup_engine.core import PipelineInfo
+from datalineup_engine.core import TopicMessage
+from datalineup_engine.core.pipeline import with_setup
+from datalineup_engine.utils.hooks import EventHook
+from datalineup_engine.worker.executors.bootstrap import PipelineBootstrap
 from datalineup_engine.worker.executors.bootstrap import RemoteException
 from datalineup_engine.worker.executors.bootstrap import wrap_remote_exception
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+from tests.utils.metrics import MetricsCapture
 
 
 class MyError(Exception):
     pass
 
 
+class Model:
+    def __init__(self) -> None:
+        self.closed = False
+
+
+class Client:
+    pass
+
+
+models: list[Model] = []
+closed: list[object] = []
+client_failures: list[str] = []
+
+
+def load_model() -> Model:
+    model = Model()
+    models.append(model)
+    return model
+
+
+def close_model(model: Model) -> None:
+    closed.append(model)
+
+
+def connect_client():  # type: ignore[no-untyped-def]
+    # Without annotation, the state is injected by its own type.
+    if client_failures:
+        raise ValueError(client_failures.pop())
+    return Client()
+
+
+@with_setup(load_model, teardown=close_model)
+@with_setup(connect_client, teardown=closed.append)
+def setup_pipeline(n: int, model: Model, client: Client) -> TopicMessage:
+    return TopicMessage(args={"n": n, "model": model, "client": client})
+
+
+@with_setup(load_model, teardown=close_model)
+def other_setup_pipeline(model: Model) -> TopicMessage:
+    return TopicMessage(args={"model": model})
+
+
 def raises(
     e: Exception,
     *,
@@ -110,3 +163,82 @@ def test_remote_exception() -> None:
         assert e.remote_traceback.stack[-1].line.strip() == "raise e from cause"
         assert e.remote_traceback.stack[-1].locals
         assert e.remote_traceback.stack[-1].locals["x"] == "{'foo': 'bar'}"
+
+
+def test_pipeline_setup(metrics_capture: MetricsCapture) -> None:
+    bootstrapper = PipelineBootstrap(initialized_hook=EventHook())
+    models.clear()
+    closed.clear()
+    client_failures[:] = ["connection refused"]
+
+    def run(pipeline: t.Callable, **args: t.Any) -> dict[str, t.Any]:
+        message = PipelineMessage(
+            info=PipelineInfo.from_pipeline(pipeline),
+            message=TopicMessage(args=args),
+        )
+        return bootstrapper.bootstrap_pipeline(message).outputs[0].message.args
+
+    # A failed setup is retried by the next message.
+    with pytest.raises(ValueError, match="connection refused"):
+        run(setup_pipeline, n=1)
+    assert len(models) == 1
+
+    first = run(setup_pipeline, n=1)
+    second = run(setup_pipeline, n=2)
+    other = run(other_setup_pipeline)
+    assert models == [first["model"]]
+    assert second["model"] is first["model"] is other["model"]
+    assert isinstance(first["client"], Client)
+    assert second["client"] is first["client"]
+
+    metrics_capture.assert_metric_expected(
+        "datalineup.pipeline.setup.duration",
+        [
+            metrics_capture.create_histogram_data_point(
+                count=3,
+                sum_data_point=0,
+                max_data_point=0,
+                min_data_point=0,
+                attributes={
+                    "pipeline": PipelineInfo.from_pipeline(setup_pipeline).name
+                },
+            ),
+        ],
+        est_value_delta=1000,
+    )
+
+    # Teardowns run in the reverse order, once per setup.
+    bootstrapper.close()
+    assert closed == [first["client"], first["model"]]
+    bootstrapper.close()
+    assert len(closed) == 2
+
+
+async def sleeping_pipeline() -> None:
+    await asyncio.sleep(10)
+
+
+@pytest.mark.asyncio
+async def test_async_pipeline_cancelled() -> None:
+    bootstrapper = PipelineBootstrap(initialized_hook=EventHook())
+    closed_handlers: list[str] = []
+
+    def handler(message: PipelineMessage) -> t.Generator[None, t.Any, None]:
+        try:
+            yield
+        finally:
+            closed_handlers.append(message.info.name)
+
+    bootstrapper.pipeline_hook.register(handler)
+    message = PipelineMessage(
+        info=PipelineInfo.from_pipeline(sleeping_pipeline),
+        message=TopicMessage(args={}),
+    )
+    task = asyncio.create_task(bootstrapper.bootstrap_async_pipeline(message))
+    await asyncio.sleep(1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # Handlers are closed even though the pipeline didn't end with an error.
+    assert closed_handlers == [message.info.name]
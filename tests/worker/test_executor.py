@@ -3,6 +3,9 @@ from typing import Callable
 from typing import cast
 
 import asyncio
+import contextvars
+import logging
+import threading
 from functools import partial
 from unittest.mock import AsyncMock
 
@@ -16,15 +19,26 @@ from datalineup_engine.core.api import ComponentDefinition
 from datalineup_engine.core.api import ErrorHandler
 from datalineup_engine.core.api import RepublishOptions
 from datalineup_engine.core.error import ErrorMessageArgs
+from datalineup_engine.utils.options import fromdict
 from datalineup_engine.worker.error_handling import HandledError
 from datalineup_engine.worker.executors import Executor
+from datalineup_engine.worker.executors.async_executor import AsyncExecutor
+from datalineup_engine.worker.executors.concurrency import BASELINE_WINDOW
+from datalineup_engine.worker.executors.concurrency import AdaptiveConcurrency
+from datalineup_engine.worker.executors.concurrency import AdaptiveConcurrencyOptions
 from datalineup_engine.worker.executors.executable import ExecutableMessage
+from datalineup_engine.worker.executors.manager import ExecutorWorker
 from datalineup_engine.worker.executors.parkers import Parkers
+from datalineup_engine.worker.executors.process import PoolType
+from datalineup_engine.worker.executors.process import ProcessExecutor
 from datalineup_engine.worker.executors.queue import ExecutorQueue
 from datalineup_engine.worker.resources.manager import ResourceData
+from datalineup_engine.worker.services.hooks import MessagePublished
+from datalineup_engine.worker.services.manager import ServicesManager
 from datalineup_engine.worker.topics.memory import MemoryTopic
 from datalineup_engine.worker.topics.memory import get_queue
 from tests.utils import TimeForwardLoop
+from tests.utils.metrics import MetricsCapture
 from tests.worker.conftest import FakeResource
 
 
@@ -401,3 +415,574 @@ async def test_executor_error_handler_republish(
     assert retry_queue.qsize() == 0
     assert len(exc_infos) == 1
     assert repr(exc_infos[0][1]) == "Exception('TEST_EXCEPTION')"
+
+
+def test_adaptive_concurrency_aimd() -> None:
+    controller = AdaptiveConcurrency(
+        AdaptiveConcurrencyOptions(min_concurrency=2, initial_concurrency=3),
+        executor_name="default",
+        max_concurrency=8,
+    )
+    assert controller.limit == 3
+    controller.in_flight = 8
+
+    # Grows while latency stays stable.
+    for _ in range(100):
+        controller.add_sample(latency=1, failed=False)
+    assert controller.limit == 8
+
+    # Shrinks when latency spikes, but once per window of in-flight messages.
+    controller.add_sample(latency=10, failed=False)
+    assert controller.limit == 7
+    controller.add_sample(latency=10, failed=False)
+    assert controller.limit == 7
+    for _ in range(100):
+        controller.add_sample(latency=10, failed=False)
+        if controller.limit == 2:
+            break
+    assert controller.limit == 2
+
+    # At the minimum, the latency becomes the new baseline.
+    for _ in range(100):
+        controller.add_sample(latency=10, failed=False)
+    assert controller.limit == 8
+
+    # A single error is tolerated, but not a high error rate.
+    controller = AdaptiveConcurrency(
+        AdaptiveConcurrencyOptions(initial_concurrency=4),
+        executor_name="default",
+        max_concurrency=8,
+    )
+    controller.in_flight = 8
+    for _ in range(10):
+        controller.add_sample(latency=1, failed=False)
+    assert controller.limit == 6
+    controller.add_sample(latency=1, failed=True)
+    assert controller.limit == 6
+    controller.add_sample(latency=1, failed=True)
+    assert controller.limit == 5
+
+
+def test_adaptive_concurrency_fast_failure() -> None:
+    controller = AdaptiveConcurrency(
+        AdaptiveConcurrencyOptions(initial_concurrency=4),
+        executor_name="default",
+        max_concurrency=8,
+    )
+    controller.in_flight = 8
+
+    # A fast failure doesn't become the baseline.
+    controller.add_sample(latency=0.01, failed=True)
+    for _ in range(50):
+        controller.add_sample(latency=1, failed=False)
+    assert controller.baseline_latency == 1
+    assert controller.limit == 8
+
+    # A single fast message is forgotten once out of the window.
+    controller.add_sample(latency=0.01, failed=False)
+    for _ in range(BASELINE_WINDOW):
+        controller.add_sample(latency=1, failed=False)
+    assert controller.baseline_latency == 1
+    assert controller.limit == 8
+
+
+@pytest.mark.asyncio
+async def test_executor_adaptive_concurrency(
+    executable_maker: Callable[[], ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+    metrics_capture: MetricsCapture,
+) -> None:
+    class SaturatingExecutor(FakeExecutor):
+        concurrency = 20
+        name = "default"
+        max_processing = 0
+
+        async def process_message(self, message: ExecutableMessage) -> PipelineResults:
+            # Downstream handles 4 concurrent messages, then queue them.
+            self.processing += 1
+            self.max_processing = max(self.max_processing, self.processing)
+            await asyncio.sleep(max(1, self.processing / 4))
+            self.processing -= 1
+            self.processed += 1
+            return PipelineResults(outputs=[], resources=[])
+
+    executor = SaturatingExecutor()
+    executor_queue = ExecutorQueue(
+        executor=executor,
+        services=services_manager.services,
+        adaptive_concurrency=AdaptiveConcurrencyOptions(min_concurrency=2),
+    )
+    executor_queue.start()
+    assert executor_queue.adaptive_concurrency
+    assert executor_queue.concurrency == 20
+
+    async with running_event_loop.until_idle():
+        for _ in range(500):
+            await executor_queue.submit(executable_maker())
+
+    assert executor.processed == 500
+    # The limit grew past the initial concurrency, but stayed away from the
+    # executor concurrency once latency doubled.
+    assert 4 <= executor.max_processing <= 10
+    limit = executor_queue.adaptive_concurrency.limit
+    assert 4 <= limit <= 10
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.concurrency.limit",
+        [metrics_capture.create_number_data_point(limit, {"executor": "default"})],
+    )
+    await executor_queue.close()
+
+
+async def streaming_pipeline(count: int) -> t.AsyncIterator[TopicMessage]:
+    for i in range(count):
+        yield TopicMessage(args={"i": i})
+        await asyncio.sleep(1)
+
+
+streamed: list[int] = []
+stream_released = threading.Event()
+
+
+async def fast_streaming_pipeline(count: int) -> t.AsyncIterator[TopicMessage]:
+    for i in range(count):
+        streamed.append(i)
+        yield TopicMessage(args={"i": i})
+
+
+async def failing_streaming_pipeline(count: int) -> t.AsyncIterator[TopicMessage]:
+    for i in range(count):
+        yield TopicMessage(args={"i": i})
+        await asyncio.sleep(1)
+    raise ValueError("failed")
+
+
+def thread_streaming_pipeline(count: int) -> t.Iterator[TopicMessage]:
+    for i in range(count):
+        yield TopicMessage(args={"i": i})
+    stream_released.wait(timeout=10)
+    yield TopicMessage(args={"i": count})
+
+
+@pytest.mark.asyncio
+async def test_executor_stream_outputs(
+    executable_maker: Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+) -> None:
+    executor = AsyncExecutor(
+        AsyncExecutor.Options(), services=services_manager.services
+    )
+    executor_queue = ExecutorQueue(
+        executor=executor, services=services_manager.services, output_buffer_size=2
+    )
+    executor_queue.start()
+    output_queue = get_queue("stream")
+    output_topic = MemoryTopic(MemoryTopic.Options(name="stream"))
+
+    await executor_queue.submit(
+        executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(streaming_pipeline),
+            message=TopicMessage(args={"count": 10}),
+            output={"default": [output_topic]},
+        )
+    )
+
+    # Outputs are published while the pipeline is still running.
+    await asyncio.sleep(3.5)
+    assert output_queue.qsize() == 4
+
+    async with running_event_loop.until_idle():
+        pass
+    assert [output_queue.get_nowait().args["i"] for _ in range(10)] == list(range(10))
+    await executor_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_executor_stream_outputs_backpressure(
+    executable_maker: Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+) -> None:
+    streamed.clear()
+    executor = AsyncExecutor(
+        AsyncExecutor.Options(), services=services_manager.services
+    )
+    executor_queue = ExecutorQueue(
+        executor=executor, services=services_manager.services, output_buffer_size=2
+    )
+    executor_queue.start()
+    output_queue = get_queue("stream-blocked", maxsize=1)
+    output_topic = MemoryTopic(MemoryTopic.Options(name="stream-blocked"))
+    parker = Parkers()
+
+    async with running_event_loop.until_idle():
+        await executor_queue.submit(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(fast_streaming_pipeline),
+                message=TopicMessage(args={"count": 10}),
+                output={"default": [output_topic]},
+                parker=parker,
+            )
+        )
+
+    # One output is published, one is blocked on publishing and two are
+    # buffered, so the pipeline waits on its fifth output.
+    assert output_queue.qsize() == 1
+    assert streamed == [0, 1, 2, 3, 4]
+    assert parker.locked()
+
+    for i in range(10):
+        async with running_event_loop.until_idle():
+            assert output_queue.get_nowait().args == {"i": i}
+    assert streamed == list(range(10))
+    assert not parker.locked()
+    await executor_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_executor_stream_outputs_failed(
+    executable_maker: Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+) -> None:
+    executor = AsyncExecutor(
+        AsyncExecutor.Options(), services=services_manager.services
+    )
+    executor_queue = ExecutorQueue(
+        executor=executor, services=services_manager.services, output_buffer_size=10
+    )
+    executor_queue.start()
+    output_queue = get_queue("stream-failed", maxsize=1)
+    output_topic = MemoryTopic(MemoryTopic.Options(name="stream-failed"))
+
+    async with running_event_loop.until_idle():
+        await executor_queue.submit(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(failing_streaming_pipeline),
+                message=TopicMessage(args={"count": 4}),
+                output={"default": [output_topic]},
+            )
+        )
+
+    # The published output and the one being published are kept, the
+    # buffered ones are dropped with the failure.
+    outputs = []
+    for _ in range(4):
+        async with running_event_loop.until_idle():
+            if not output_queue.empty():
+                outputs.append(output_queue.get_nowait().args["i"])
+    assert outputs == [0, 1]
+    await executor_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_executor_stream_outputs_thread_pool(
+    executable_maker: Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+) -> None:
+    running_event_loop.forward_time = False
+    stream_released.clear()
+    executor = ProcessExecutor(
+        ProcessExecutor.Options(max_workers=1, pool_type=PoolType.THREAD),
+        services=services_manager.services,
+    )
+    executor_queue = ExecutorQueue(
+        executor=executor, services=services_manager.services, output_buffer_size=10
+    )
+    executor_queue.start()
+    output_queue = get_queue("stream-thread")
+    output_topic = MemoryTopic(MemoryTopic.Options(name="stream-thread"))
+
+    await executor_queue.submit(
+        executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(thread_streaming_pipeline),
+            message=TopicMessage(args={"count": 3}),
+            output={"default": [output_topic]},
+        )
+    )
+
+    async def wait_outputs(count: int) -> None:
+        while output_queue.qsize() < count:
+            await asyncio.sleep(0.01)
+
+    # The pipeline is blocked in its thread after its third output.
+    await asyncio.wait_for(wait_outputs(3), timeout=5)
+    stream_released.set()
+    await asyncio.wait_for(wait_outputs(4), timeout=5)
+    assert [output_queue.get_nowait().args["i"] for _ in range(4)] == list(range(4))
+    await executor_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_executor_prefetch(
+    executable_maker: Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+    metrics_capture: MetricsCapture,
+) -> None:
+    executor = FakeExecutor()
+    executor_queue = ExecutorQueue(
+        executor=executor, services=services_manager.services, prefetch=3
+    )
+    executor_queue.start()
+    resources_manager = executor_queue.resources_manager
+    for i in range(4):
+        await resources_manager.add(
+            ResourceData(name=f"r{i}", type=FakeResource._typename(), data={})
+        )
+
+    # One message executes while up to three others wait in the queue with
+    # their resources.
+    async with running_event_loop.until_idle():
+        for _ in range(4):
+            await executor_queue.submit(
+                executable_maker(pipeline_info=PipelineInfo.from_pipeline(pipeline))
+            )
+    assert executor.processing == 1
+
+    submit_task = asyncio.create_task(executor_queue.submit(executable_maker()))
+    async with running_event_loop.until_idle():
+        pass
+    assert not submit_task.done()
+
+    await asyncio.sleep(1)
+    async with running_event_loop.until_idle():
+        executor.execute_semaphore.release()
+    assert executor.processed == 1
+    assert executor.processing == 2
+    await submit_task
+
+    executor_name = executable_maker().queue.definition.executor
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.queue.wait",
+        [
+            metrics_capture.create_histogram_data_point(
+                count=2,
+                sum_data_point=1000,
+                max_data_point=1000,
+                min_data_point=0,
+                attributes={"executor": executor_name},
+            )
+        ],
+    )
+
+    # Prefetched messages release their resources when the queue closes.
+    await executor_queue.close()
+    for _ in range(4):
+        await resources_manager.acquire(FakeResource._typename(), wait=False)
+
+
+def test_executor_worker_options(services_manager: ServicesManager) -> None:
+    options = fromdict(
+        {
+            "max_workers": 4,
+            "prefetch": "2",
+            "output_buffer_size": 10,
+            "adaptive_concurrency": {"min_concurrency": 2},
+        },
+        ExecutorWorker.Options,
+    )
+    assert options == ExecutorWorker.Options(
+        adaptive_concurrency=AdaptiveConcurrencyOptions(min_concurrency=2),
+        output_buffer_size=10,
+        prefetch=2,
+    )
+
+    # Invalid options fail before the executor is built.
+    for invalid in (
+        {"prefetch": 0},
+        {"prefetch": -1},
+        {"prefetch": "many"},
+        {"output_buffer_size": 0},
+    ):
+        with pytest.raises(ValueError):
+            ExecutorWorker.from_item(
+                ComponentDefinition(name="e", type="Missing", options=invalid),
+                services=services_manager.services,
+            )
+
+
+@pytest.mark.asyncio
+async def test_executor_resources_duration(
+    executable_maker: Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+    metrics_capture: MetricsCapture,
+) -> None:
+    executor = FakeExecutor()
+    executor_queue = ExecutorQueue(
+        executor=executor, services=services_manager.services, prefetch=1
+    )
+    executor_queue.start()
+    resources_manager = executor_queue.resources_manager
+    for i in range(2):
+        await resources_manager.add(
+            ResourceData(name=f"r{i}", type=FakeResource._typename(), data={})
+        )
+
+    # The second message waits a second in the queue with its resource,
+    # which isn't part of the time it used it for.
+    async with running_event_loop.until_idle():
+        for _ in range(2):
+            await executor_queue.submit(
+                executable_maker(pipeline_info=PipelineInfo.from_pipeline(pipeline))
+            )
+    for _ in range(2):
+        await asyncio.sleep(1)
+        async with running_event_loop.until_idle():
+            executor.execute_semaphore.release()
+    assert executor.processed == 2
+
+    metrics_capture.assert_metric_expected(
+        "datalineup.resources.duration",
+        [
+            metrics_capture.create_histogram_data_point(
+                count=1,
+                sum_data_point=1000,
+                max_data_point=1000,
+                min_data_point=1000,
+                attributes={"type": FakeResource._typename(), "name": name},
+            )
+            for name in ("r0", "r1")
+        ],
+    )
+    await executor_queue.close()
+
+
+def batch_pipeline() -> None: ...
+
+
+class BatchExecutor(FakeExecutor):
+    async def process_message(self, message: ExecutableMessage) -> PipelineResults:
+        return PipelineResults(
+            outputs=[
+                PipelineOutput(channel="default", message=TopicMessage(args={"n": n}))
+                for n in range(3)
+            ],
+            resources=[],
+        )
+
+
+@pytest.mark.asyncio
+async def test_executor_publish_batch(
+    executable_maker: Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+) -> None:
+    class SpyTopic(MemoryTopic):
+        async def publish_many(
+            self, messages: t.Sequence[TopicMessage], wait: bool
+        ) -> list[bool]:
+            batches.append((self.options.name, len(messages), wait))
+            return await super().publish_many(messages, wait)
+
+    batches: list[tuple[str, int, bool]] = []
+    published: list[tuple[str, t.Any]] = []
+    blocked: list[tuple[str, t.Any]] = []
+
+    async def on_message_published(
+        event: MessagePublished,
+    ) -> t.AsyncGenerator[None, None]:
+        yield
+        published.append((event.topic.name, event.output.message.args["n"]))
+
+    async def on_output_blocked(event: MessagePublished) -> None:
+        blocked.append((event.topic.name, event.output.message.args["n"]))
+
+    hooks = services_manager.services.s.hooks
+    hooks.message_published.register(on_message_published)
+    hooks.output_blocked.register(on_output_blocked)
+
+    executor_queue = ExecutorQueue(
+        executor=BatchExecutor(), services=services_manager.services
+    )
+    executor_queue.start()
+    free_queue = get_queue("batch-free")
+    full_queue = get_queue("batch-full", maxsize=1)
+    free_topic = SpyTopic(SpyTopic.Options(name="batch-free"))
+    free_topic.name = "free"
+    full_topic = SpyTopic(SpyTopic.Options(name="batch-full"))
+    full_topic.name = "full"
+    parker = Parkers()
+
+    async with running_event_loop.until_idle():
+        await executor_queue.submit(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(batch_pipeline),
+                output={"default": [free_topic, full_topic]},
+                parker=parker,
+            )
+        )
+
+    # Each topic gets the outputs as a single batch, the full topic only takes
+    # the first one and blocks on the next.
+    assert sorted(batches) == [("batch-free", 3, False), ("batch-full", 3, False)]
+    assert [free_queue.get_nowait().args["n"] for _ in range(3)] == [0, 1, 2]
+    # Topics are published concurrently, each one in order.
+    assert sorted(published, key=lambda p: p[0]) == [
+        ("free", 0),
+        ("free", 1),
+        ("free", 2),
+        ("full", 0),
+    ]
+    assert blocked == [("full", 1)]
+    assert parker.locked()
+
+    for n in range(3):
+        async with running_event_loop.until_idle():
+            assert full_queue.get_nowait().args == {"n": n}
+    assert published[4:] == [("full", 1), ("full", 2)]
+    assert blocked == [("full", 1), ("full", 2)]
+    assert not parker.locked()
+    await executor_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_executor_publish_batch_hooks_scope(
+    executable_maker: Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    services_manager: ServicesManager,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    class BrokenBatchTopic(MemoryTopic):
+        async def publish_many(
+            self, messages: t.Sequence[TopicMessage], wait: bool
+        ) -> list[bool]:
+            raise RuntimeError("broken batch")
+
+    current: contextvars.ContextVar[int] = contextvars.ContextVar("current")
+    published: list[tuple[int, int]] = []
+
+    async def on_message_published(
+        event: MessagePublished,
+    ) -> t.AsyncGenerator[None, None]:
+        n = t.cast(int, event.output.message.args["n"])
+        current.set(n)
+        yield
+        published.append((n, current.get()))
+
+    services_manager.services.s.hooks.message_published.register(on_message_published)
+    executor_queue = ExecutorQueue(
+        executor=BatchExecutor(), services=services_manager.services
+    )
+    executor_queue.start()
+    queue = get_queue("batch-broken")
+    topic = BrokenBatchTopic(BrokenBatchTopic.Options(name="batch-broken"))
+
+    with caplog.at_level(logging.ERROR):
+        async with running_event_loop.until_idle():
+            await executor_queue.submit(
+                executable_maker(
+                    pipeline_info=PipelineInfo.from_pipeline(batch_pipeline),
+                    output={"default": [topic]},
+                )
+            )
+
+    # Each message hooks scope is kept around its own publish, and a failed
+    # batch is logged before falling back to blocking publishes.
+    assert published == [(0, 0), (1, 1), (2, 2)]
+    assert [queue.get_nowait().args["n"] for _ in range(3)] == [0, 1, 2]
+    assert "Failed to publish outputs" in caplog.text
+    await executor_queue.close()
@@ -0,0 +1,858 @@
+import typing as t
+
+import asyncio
+import os
+import pickle  # noqa: S403
+import time
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from datalineup_engine.core import PipelineInfo
+from datalineup_engine.core import PipelineOutput
+from datalineup_engine.core import PipelineResults
+from datalineup_engine.core import TopicMessage
+from datalineup_engine.core.pipeline import CancellationToken
+from datalineup_engine.core.pipeline import with_setup
+from datalineup_engine.worker.executors.async_pool import AsyncProcessPool
+from datalineup_engine.worker.executors.bootstrap import RemoteException
+from datalineup_engine.worker.executors.executable import ExecutableMessage
+from datalineup_engine.worker.executors.process import PoolType
+from datalineup_engine.worker.executors.process import ProcessExecutor
+from datalineup_engine.worker.executors.routing import StickyRouting
+from datalineup_engine.worker.executors.shared_memory import SharedMemoryTransport
+from datalineup_engine.worker.executors.shared_memory import SharedPayload
+from datalineup_engine.worker.executors.shared_memory import unlink_segment
+from datalineup_engine.worker.pipeline_message import PipelineMessage
+from datalineup_engine.worker.services.manager import ServicesManager
+from tests.utils import TimeForwardLoop
+from tests.utils.metrics import MetricsCapture
+
+
+def echo_pipeline(n: int) -> TopicMessage:
+    if n < 0:
+        raise ValueError("negative")
+    return TopicMessage(args={"n": n})
+
+
+def body_pipeline(body: str, raw: bytes) -> TopicMessage:
+    return TopicMessage(args={"body": body.upper(), "raw": raw[::-1], "small": "s"})
+
+
+async def sleep_pipeline(n: int) -> TopicMessage:
+    await asyncio.sleep(0.5)
+    if n < 0:
+        raise ValueError("negative")
+    return TopicMessage(args={"n": n, "pid": os.getpid()})
+
+
+async def cancellable_pipeline(path: str, token: CancellationToken) -> None:
+    Path(path).write_text("started")
+    while not token.is_cancelled:
+        await asyncio.sleep(0.01)
+    Path(path).write_text("cancelled")
+
+
+def cancellable_sync_pipeline(path: str, token: CancellationToken) -> None:
+    while not token.is_cancelled:
+        time.sleep(0.01)
+    Path(path).write_text("cancelled")
+
+
+def stuck_pipeline() -> None:
+    # Ignores cancellation, like a call stuck in a C extension.
+    time.sleep(60)
+
+
+def slow_pipeline(n: int) -> TopicMessage:
+    time.sleep(1)
+    return TopicMessage(args={"n": n})
+
+
+def pid_pipeline() -> TopicMessage:
+    return TopicMessage(args={"pid": os.getpid()})
+
+
+class Cache(dict):
+    pass
+
+
+torn_down: list[Cache] = []
+
+
+def load_cache() -> Cache:
+    return Cache(pid=os.getpid())
+
+
+@with_setup(load_cache, teardown=torn_down.append)
+def cached_pipeline(cache: Cache) -> TopicMessage:
+    cache["hits"] = cache.get("hits", 0) + 1
+    return TopicMessage(args=dict(cache))
+
+
+async def exit_pipeline() -> None:
+    os._exit(1)
+
+
+async def delayed_exit_pipeline() -> None:
+    await asyncio.sleep(0.5)
+    os._exit(1)
+
+
+class BrokenMetaMessage(PipelineMessage):
+    def set_meta_arg(self, *, meta_type: t.Type, value: t.Any) -> None:
+        raise ValueError("broken meta arg")
+
+
+def noop() -> None:
+    pass
+
+
+async def execute_message(message: PipelineMessage) -> PipelineResults:
+    return PipelineResults()
+
+
+def segment_exists(name: str) -> bool:
+    try:
+        SharedMemory(name=name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@pytest.fixture
+async def executor_maker(
+    services_manager: ServicesManager,
+) -> t.AsyncIterator[t.Callable[..., ProcessExecutor]]:
+    executors = []
+
+    def maker(
+        *, max_workers: int = 1, pool_type: PoolType = PoolType.THREAD, **kwargs: t.Any
+    ) -> ProcessExecutor:
+        options = ProcessExecutor.Options(
+            max_workers=max_workers, pool_type=pool_type, **kwargs
+        )
+        executor = ProcessExecutor(options, services=services_manager.services)
+        executors.append(executor)
+        return executor
+
+    yield maker
+    for executor in executors:
+        await executor.close()
+
+
+@pytest.mark.asyncio
+async def test_process_executor_batching(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    mocker: MockerFixture,
+) -> None:
+    executor = executor_maker(batch_size=3, batch_linger_ms=50)
+    assert executor.concurrency == 3
+    spy = mocker.spy(ProcessExecutor, "remote_execute_batch")
+
+    pipeline_info = PipelineInfo.from_pipeline(echo_pipeline)
+    xmsgs = [
+        executable_maker(
+            pipeline_info=pipeline_info, message=TopicMessage(args={"n": n})
+        )
+        for n in (1, -1, 2, 3)
+    ]
+    results = await asyncio.gather(
+        *[executor.process_message(xmsg) for xmsg in xmsgs],
+        return_exceptions=True,
+    )
+
+    # The first three messages are sent together, the last one once the
+    # linger delay expires.
+    assert [len(c.kwargs["messages"]) for c in spy.call_args_list] == [3, 1]
+
+    assert not isinstance(results[0], BaseException)
+    assert results[0].outputs[0].message.args == {"n": 1}
+    assert isinstance(results[1], RemoteException)
+    assert results[1].remote_traceback.exc_type == "ValueError"
+    assert not isinstance(results[2], BaseException)
+    assert results[2].outputs[0].message.args == {"n": 2}
+    assert not isinstance(results[3], BaseException)
+    assert results[3].outputs[0].message.args == {"n": 3}
+
+
+@pytest.mark.asyncio
+async def test_process_executor_batching_cancelled(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    mocker: MockerFixture,
+) -> None:
+    executor = executor_maker(batch_size=2, batch_linger_ms=50)
+    spy = mocker.spy(ProcessExecutor, "remote_execute_batch")
+
+    pipeline_info = PipelineInfo.from_pipeline(echo_pipeline)
+    cancelled = asyncio.create_task(
+        executor.process_message(
+            executable_maker(
+                pipeline_info=pipeline_info, message=TopicMessage(args={"n": 1})
+            )
+        )
+    )
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    results = await executor.process_message(
+        executable_maker(
+            pipeline_info=pipeline_info, message=TopicMessage(args={"n": 2})
+        )
+    )
+    assert results.outputs[0].message.args == {"n": 2}
+    assert [len(c.kwargs["messages"]) for c in spy.call_args_list] == [1]
+
+
+def test_shared_memory_round_trip() -> None:
+    transport = SharedMemoryTransport(threshold=10)
+    worker_call = transport.new_call()
+    args = {"body": "a" * 20, "nested": [{"raw": b"b" * 20}], "small": "c"}
+    message = PipelineMessage(
+        info=PipelineInfo.from_pipeline(body_pipeline),
+        message=TopicMessage(args=args),
+    )
+
+    remote_message = worker_call.export_message(message)
+    # The original message is left untouched.
+    assert message.message.args["body"] == "a" * 20
+    body = remote_message.message.args["body"]
+    assert isinstance(body, SharedPayload)
+    assert remote_message.message.args["small"] == "c"
+    assert worker_call.exported_bytes == 40
+
+    # Pretend to be the pool process.
+    remote_call = pickle.loads(pickle.dumps(worker_call))  # noqa: S301
+    assert remote_call.segments == []
+    assert remote_call.import_message(remote_message).message.args == args
+    remote_results = remote_call.export_results(
+        PipelineResults(
+            outputs=[PipelineOutput(channel="default", message=TopicMessage(args=args))]
+        )
+    )
+
+    results = worker_call.import_results(remote_results)
+    assert results.outputs[0].message.args == args
+    assert worker_call.imported_bytes == 40
+    assert not any(segment_exists(name) for name in remote_call.segments)
+
+    worker_call.release()
+    assert not segment_exists(body.name)
+
+
+def test_shared_memory_release_failed_call() -> None:
+    transport = SharedMemoryTransport(threshold=10)
+    worker_call = transport.new_call()
+
+    # The pool process created results segments but never returned them.
+    remote_call = pickle.loads(pickle.dumps(worker_call))  # noqa: S301
+    remote_call.export_results(
+        PipelineResults(
+            outputs=[
+                PipelineOutput(
+                    channel="default",
+                    message=TopicMessage(args={"a": "a" * 20, "b": b"b" * 20}),
+                )
+            ]
+        )
+    )
+    assert len(remote_call.segments) == 2
+    assert all(segment_exists(name) for name in remote_call.segments)
+
+    worker_call.release()
+    assert not any(segment_exists(name) for name in remote_call.segments)
+
+
+def test_shared_memory_release_failed_import() -> None:
+    transport = SharedMemoryTransport(threshold=10)
+    worker_call = transport.new_call()
+    remote_call = pickle.loads(pickle.dumps(worker_call))  # noqa: S301
+    remote_results = remote_call.export_results(
+        PipelineResults(
+            outputs=[
+                PipelineOutput(
+                    channel="default",
+                    message=TopicMessage(
+                        args={"a": "a" * 20, "b": b"b" * 20, "c": "c" * 20}
+                    ),
+                )
+            ]
+        )
+    )
+
+    # The import failed past the first segment, which got unlinked.
+    unlink_segment(remote_call.segments[1])
+    with pytest.raises(FileNotFoundError):
+        worker_call.import_results(remote_results)
+    assert not segment_exists(remote_call.segments[0])
+    assert segment_exists(remote_call.segments[2])
+
+    worker_call.release()
+    assert not any(segment_exists(name) for name in remote_call.segments)
+
+
+@pytest.mark.asyncio
+async def test_process_executor_shared_memory(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(pool_type=PoolType.PROCESS, shared_memory_threshold=100)
+    executor.name = "shm"
+
+    xmsg = executable_maker(
+        pipeline_info=PipelineInfo.from_pipeline(body_pipeline),
+        message=TopicMessage(args={"body": "a" * 1000, "raw": b"ab" * 500}),
+    )
+    results = await executor.process_message(xmsg)
+    assert results.outputs[0].message.args == {
+        "body": "A" * 1000,
+        "raw": b"ba" * 500,
+        "small": "s",
+    }
+
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.process.shared_memory",
+        [
+            metrics_capture.create_number_data_point(
+                2000, {"executor": "shm", "direction": "execute"}
+            ),
+            metrics_capture.create_number_data_point(
+                2000, {"executor": "shm", "direction": "results"}
+            ),
+        ],
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_executor_async_process(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(
+        max_workers=2, pool_type=PoolType.ASYNC_PROCESS, per_process_concurrency=4
+    )
+    assert executor.concurrency == 8
+
+    pipeline_info = PipelineInfo.from_pipeline(sleep_pipeline)
+    start = running_event_loop.time()
+    results = await asyncio.gather(
+        *[
+            executor.process_message(
+                executable_maker(
+                    pipeline_info=pipeline_info, message=TopicMessage(args={"n": n})
+                )
+            )
+            for n in (1, -1, *range(2, 8))
+        ],
+        return_exceptions=True,
+    )
+    # All messages ran concurrently, four per child process.
+    assert running_event_loop.time() - start < 2
+    assert isinstance(results[1], RemoteException)
+    assert results[1].remote_traceback.exc_type == "ValueError"
+    outputs = [
+        r.outputs[0].message.args for r in results if isinstance(r, PipelineResults)
+    ]
+    assert [o["n"] for o in outputs] == [1, *range(2, 8)]
+    pids = {o["pid"] for o in outputs}
+    assert len(pids) == 2
+    assert os.getpid() not in pids
+
+
+@pytest.mark.asyncio
+async def test_process_executor_async_process_cancel(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    tmp_path: Path,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(pool_type=PoolType.ASYNC_PROCESS)
+    path = tmp_path / "state"
+
+    task = asyncio.create_task(
+        executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(cancellable_pipeline),
+                message=TopicMessage(args={"path": str(path)}),
+            )
+        )
+    )
+    while not path.exists():
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    async def wait_cancelled() -> None:
+        while path.read_text() != "cancelled":
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(wait_cancelled(), timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_process_executor_async_process_died(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(pool_type=PoolType.ASYNC_PROCESS)
+
+    with pytest.raises(BrokenProcessPool):
+        await executor.process_message(
+            executable_maker(pipeline_info=PipelineInfo.from_pipeline(exit_pipeline))
+        )
+
+    # The dead process got replaced.
+    results = await executor.process_message(
+        executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(sleep_pipeline),
+            message=TopicMessage(args={"n": 1}),
+        )
+    )
+    assert results.outputs[0].message.args["n"] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_process_pool_meta_arg_error(
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    running_event_loop.forward_time = False
+    pool = AsyncProcessPool(
+        max_workers=1, concurrency=1, initializer=noop, execute=execute_message
+    )
+    message = BrokenMetaMessage(
+        info=PipelineInfo.from_pipeline(pid_pipeline), message=TopicMessage(args={})
+    )
+    try:
+        # The error is sent back instead of leaving the call pending.
+        with pytest.raises(RemoteException) as excinfo:
+            await asyncio.wait_for(pool.submit(message), timeout=10)
+        assert excinfo.value.remote_traceback.exc_type == "ValueError"
+    finally:
+        await pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_executor_async_process_retiring_died(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(
+        pool_type=PoolType.ASYNC_PROCESS,
+        per_process_concurrency=2,
+        max_tasks_per_child=1,
+    )
+
+    # The child retires after the first message, then dies with the other
+    # message in flight.
+    exiting = asyncio.create_task(
+        executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(delayed_exit_pipeline)
+            )
+        )
+    )
+    first = await executor.process_message(
+        executable_maker(pipeline_info=PipelineInfo.from_pipeline(pid_pipeline))
+    )
+    with pytest.raises(BrokenProcessPool):
+        await exiting
+
+    results = await executor.process_message(
+        executable_maker(pipeline_info=PipelineInfo.from_pipeline(pid_pipeline))
+    )
+    assert (
+        results.outputs[0].message.args["pid"] != first.outputs[0].message.args["pid"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_executor_recycle_max_tasks(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(pool_type=PoolType.PROCESS, max_tasks_per_child=2)
+    executor.name = "recycled"
+
+    pids = []
+    for _ in range(5):
+        results = await executor.process_message(
+            executable_maker(pipeline_info=PipelineInfo.from_pipeline(pid_pipeline))
+        )
+        pids.append(results.outputs[0].message.args["pid"])
+    assert pids[0] == pids[1] != pids[2] == pids[3] != pids[4]
+
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.process.recycles",
+        [
+            metrics_capture.create_number_data_point(
+                2, {"executor": "recycled", "reason": "max_tasks_per_child"}
+            ),
+        ],
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_executor_async_process_recycle_max_rss(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(
+        pool_type=PoolType.ASYNC_PROCESS, per_process_concurrency=3, max_rss_mb=1
+    )
+    executor.name = "recycled"
+
+    def message(n: int) -> ExecutableMessage:
+        return executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(sleep_pipeline),
+            message=TopicMessage(args={"n": n}),
+        )
+
+    # Every child is over the limit, but the messages in flight complete.
+    results = await asyncio.gather(
+        *[executor.process_message(message(n)) for n in range(3)]
+    )
+    pids = {r.outputs[0].message.args["pid"] for r in results}
+    assert len(pids) == 1
+
+    result = await executor.process_message(message(4))
+    assert result.outputs[0].message.args["pid"] not in pids
+
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.process.recycles",
+        [
+            metrics_capture.create_number_data_point(
+                2, {"executor": "recycled", "reason": "max_rss_mb"}
+            ),
+        ],
+    )
+
+
+def test_process_executor_recycle_thread_pool(
+    services_manager: ServicesManager,
+) -> None:
+    with pytest.raises(ValueError):
+        ProcessExecutor(
+            ProcessExecutor.Options(pool_type=PoolType.THREAD, max_tasks_per_child=1),
+            services=services_manager.services,
+        )
+
+
+@pytest.mark.asyncio
+async def test_process_executor_timeout(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(pool_type=PoolType.PROCESS, timeout_grace=0.1)
+    results = await executor.process_message(
+        executable_maker(pipeline_info=PipelineInfo.from_pipeline(pid_pipeline))
+    )
+    pid = results.outputs[0].message.args["pid"]
+
+    # The timeout is set from the message config.
+    start = running_event_loop.time()
+    with pytest.raises(RemoteException) as excinfo:
+        await executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(stuck_pipeline),
+                message=TopicMessage(
+                    args={}, config={"process_executor": {"timeout": 0.2}}
+                ),
+            )
+        )
+    assert excinfo.value.remote_traceback.exc_type == "TimeoutError"
+    assert running_event_loop.time() - start < 5
+
+    # The stuck child got killed and the pool replaced.
+    with pytest.raises(ProcessLookupError):
+        for _ in range(50):
+            os.kill(pid, 0)
+            await asyncio.sleep(0.1)
+    results = await executor.process_message(
+        executable_maker(pipeline_info=PipelineInfo.from_pipeline(pid_pipeline))
+    )
+    assert results.outputs[0].message.args["pid"] not in (pid, os.getpid())
+
+
+@pytest.mark.asyncio
+async def test_process_executor_timeout_single_child(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    tmp_path: Path,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(
+        max_workers=2, pool_type=PoolType.PROCESS, timeout=0.2, timeout_grace=0.5
+    )
+    path = tmp_path / "state"
+
+    # The pipeline gets cancelled through its token.
+    with pytest.raises(RemoteException):
+        await executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(cancellable_sync_pipeline),
+                message=TopicMessage(args={"path": str(path)}),
+            )
+        )
+    assert path.read_text() == "cancelled"
+
+    # Only the child of the stuck message is killed, the other message in
+    # flight completes.
+    results = await asyncio.gather(
+        executor.process_message(
+            executable_maker(pipeline_info=PipelineInfo.from_pipeline(stuck_pipeline))
+        ),
+        executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(slow_pipeline),
+                message=TopicMessage(
+                    args={"n": 1}, config={"process_executor": {"timeout": 5}}
+                ),
+            )
+        ),
+        return_exceptions=True,
+    )
+    assert isinstance(results[0], RemoteException)
+    assert results[0].remote_traceback.exc_type == "TimeoutError"
+    assert isinstance(results[1], PipelineResults)
+    assert results[1].outputs[0].message.args == {"n": 1}
+
+
+@pytest.mark.asyncio
+async def test_process_executor_async_process_timeout(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    tmp_path: Path,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(
+        pool_type=PoolType.ASYNC_PROCESS, timeout=0.2, timeout_grace=1
+    )
+    path = tmp_path / "state"
+
+    # The pipeline gets cancelled through its token.
+    with pytest.raises(RemoteException) as excinfo:
+        await executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(cancellable_pipeline),
+                message=TopicMessage(args={"path": str(path)}),
+            )
+        )
+    assert excinfo.value.remote_traceback.exc_type == "TimeoutError"
+    assert path.read_text() == "cancelled"
+
+    # Pipelines ignoring the cancellation get their child killed.
+    start = running_event_loop.time()
+    with pytest.raises(RemoteException):
+        await executor.process_message(
+            executable_maker(pipeline_info=PipelineInfo.from_pipeline(stuck_pipeline))
+        )
+    assert running_event_loop.time() - start < 5
+
+    results = await executor.process_message(
+        executable_maker(
+            pipeline_info=PipelineInfo.from_pipeline(pid_pipeline),
+        )
+    )
+    assert results.outputs[0].message.args["pid"] != os.getpid()
+
+
+@pytest.mark.asyncio
+async def test_process_executor_async_process_timeout_saturated(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(
+        pool_type=PoolType.ASYNC_PROCESS,
+        per_process_concurrency=1,
+        timeout=0.8,
+        timeout_grace=0.2,
+    )
+
+    # Messages waiting for a slot in the child aren't timed out, nor is the
+    # child killed under them.
+    results = await asyncio.gather(
+        *(
+            executor.process_message(
+                executable_maker(
+                    pipeline_info=PipelineInfo.from_pipeline(sleep_pipeline),
+                    message=TopicMessage(args={"n": n}),
+                )
+            )
+            for n in range(3)
+        )
+    )
+    assert [r.outputs[0].message.args["n"] for r in results] == [0, 1, 2]
+    assert len({r.outputs[0].message.args["pid"] for r in results}) == 1
+
+
+@pytest.mark.asyncio
+async def test_process_executor_thread_timeout(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    tmp_path: Path,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(pool_type=PoolType.THREAD, timeout=0.2)
+    path = tmp_path / "state"
+
+    with pytest.raises(RemoteException) as excinfo:
+        await executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(cancellable_sync_pipeline),
+                message=TopicMessage(args={"path": str(path)}),
+            )
+        )
+    assert excinfo.value.remote_traceback.exc_type == "TimeoutError"
+    assert path.read_text() == "cancelled"
+
+
+def test_sticky_routing_select() -> None:
+    def message(pipeline: t.Callable, **tags: str) -> PipelineMessage:
+        return PipelineMessage(
+            info=PipelineInfo.from_pipeline(pipeline),
+            message=TopicMessage(args={}, tags=tags),
+        )
+
+    routing = StickyRouting(processes=2)
+    preferred = routing.preferred(routing.key(message(echo_pipeline)), 8)
+    assert len(preferred) == 2
+    loads = [0] * 8
+    index, fallback = routing.select(message(echo_pipeline), loads, capacity=1)
+    assert index == preferred[0] and not fallback
+
+    # The least busy preferred child is used, then any child with capacity.
+    loads[preferred[0]] = 1
+    assert routing.select(message(echo_pipeline), loads, capacity=1) == (
+        preferred[1],
+        False,
+    )
+    loads[preferred[1]] = 1
+    index, fallback = routing.select(message(echo_pipeline), loads, capacity=1)
+    assert index not in preferred and fallback
+    # Once every child is saturated, messages wait on their preferred child.
+    assert routing.select(message(echo_pipeline), [1] * 8, capacity=1) == (
+        preferred[0],
+        False,
+    )
+
+    routing = StickyRouting(tag="tenant")
+    assert routing.key(message(echo_pipeline, tenant="a")) == "a"
+    assert routing.key(message(echo_pipeline)) == message(echo_pipeline).info.name
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("pool_type", [PoolType.PROCESS, PoolType.ASYNC_PROCESS])
+async def test_process_executor_sticky_routing(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    pool_type: PoolType,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(
+        max_workers=4, pool_type=pool_type, sticky_routing=StickyRouting(tag="key")
+    )
+
+    async def pid(key: str) -> t.Any:
+        results = await executor.process_message(
+            executable_maker(
+                pipeline_info=PipelineInfo.from_pipeline(pid_pipeline),
+                message=TopicMessage(args={}, tags={"key": key}),
+            )
+        )
+        return results.outputs[0].message.args["pid"]
+
+    pids = {key: await pid(key) for key in "abcdefgh"}
+    assert len(set(pids.values())) > 1
+    for key in "abcdefgh":
+        assert await pid(key) == pids[key]
+
+
+@pytest.mark.asyncio
+async def test_process_executor_sticky_routing_fallback(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+) -> None:
+    running_event_loop.forward_time = False
+    executor = executor_maker(
+        max_workers=2,
+        pool_type=PoolType.ASYNC_PROCESS,
+        per_process_concurrency=1,
+        sticky_routing=StickyRouting(),
+    )
+    executor.name = "sticky"
+
+    # The preferred child is saturated, the second message runs on the other.
+    results = await asyncio.gather(
+        *[
+            executor.process_message(
+                executable_maker(
+                    pipeline_info=PipelineInfo.from_pipeline(sleep_pipeline),
+                    message=TopicMessage(args={"n": n}),
+                )
+            )
+            for n in range(2)
+        ]
+    )
+    assert len({r.outputs[0].message.args["pid"] for r in results}) == 2
+
+    metrics_capture.assert_metric_expected(
+        "datalineup.executor.process.sticky_fallbacks",
+        [metrics_capture.create_number_data_point(1, {"executor": "sticky"})],
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "pool_type", [PoolType.THREAD, PoolType.PROCESS, PoolType.ASYNC_PROCESS]
+)
+async def test_process_executor_pipeline_setup(
+    executor_maker: t.Callable[..., ProcessExecutor],
+    executable_maker: t.Callable[..., ExecutableMessage],
+    running_event_loop: TimeForwardLoop,
+    pool_type: PoolType,
+) -> None:
+    running_event_loop.forward_time = False
+    torn_down.clear()
+    executor = executor_maker(pool_type=pool_type)
+
+    for hits in (1, 2):
+        results = await executor.process_message(
+            executable_maker(pipeline_info=PipelineInfo.from_pipeline(cached_pipeline))
+        )
+        assert results.outputs[0].message.args["hits"] == hits
+
+    await executor.close()
+    if pool_type is PoolType.THREAD:
+        assert torn_down == [{"pid": os.getpid(), "hits": 2}]
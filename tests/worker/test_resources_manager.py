@@ -3,11 +3,13 @@ import time
 
 import pytest
 
+from datalineup_engine.worker.resources.manager import KeyedPoolOptions
 from datalineup_engine.worker.resources.manager import ResourceData
 from datalineup_engine.worker.resources.manager import ResourceRateLimit
 from datalineup_engine.worker.resources.manager import ResourcesManager
 from datalineup_engine.worker.resources.manager import ResourceUnavailable
 from tests.utils import TimeForwardLoop
+from tests.utils.metrics import MetricsCapture
 
 
 @pytest.mark.asyncio
@@ -280,3 +282,215 @@ async def test_resources_manager_with_hourly_rate_limit_and_wait(
         pass
 
     assert (int(time.time()) - time_start) == 3600
+
+
+@pytest.mark.asyncio
+async def test_resources_manager_fifo_waiters(
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+) -> None:
+    r1 = ResourceData(name="r1", type="R", data={})
+    resources_manager = ResourcesManager()
+    await resources_manager.add(r1)
+    resource = await resources_manager.acquire("R")
+
+    acquired: list[int] = []
+
+    async def waiter(i: int) -> None:
+        async with await resources_manager.acquire("R"):
+            acquired.append(i)
+            await asyncio.sleep(1)
+
+    async with running_event_loop.until_idle():
+        waiters = [asyncio.create_task(waiter(i)) for i in range(4)]
+    metrics_capture.assert_metric_expected(
+        "datalineup.resources.waiters",
+        [metrics_capture.create_number_data_point(4, {"type": "R"})],
+    )
+
+    # A cancelled waiter loses its turn, the others get the resource in the
+    # order they asked for it.
+    waiters[1].cancel()
+    await resource.release()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    assert acquired == [0, 2, 3]
+
+    # New requests don't get ahead of queued waiters.
+    resource = await resources_manager.acquire("R", wait=False)
+    async with running_event_loop.until_idle():
+        waiters = [asyncio.create_task(waiter(i)) for i in range(2)]
+    with pytest.raises(ResourceUnavailable):
+        await resources_manager.acquire("R", wait=False)
+    await resource.release()
+    await asyncio.gather(*waiters)
+    assert acquired == [0, 2, 3, 0, 1]
+
+    metrics_capture.collect()
+    metrics_capture.assert_metric_expected(
+        "datalineup.resources.waiters",
+        [metrics_capture.create_number_data_point(0, {"type": "R"})],
+    )
+    metrics_capture.assert_metric_expected(
+        "datalineup.resources.wait",
+        [
+            metrics_capture.create_histogram_data_point(
+                count=6,
+                sum_data_point=4000,
+                max_data_point=2000,
+                min_data_point=0,
+                attributes={"type": "R"},
+            )
+        ],
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy", ["gcra", "token-bucket"])
+async def test_resources_manager_with_local_rate_limiter(
+    running_event_loop: TimeForwardLoop, strategy: str
+) -> None:
+    r1 = ResourceData(
+        name="r1",
+        type="R",
+        data={},
+        rate_limit=ResourceRateLimit(
+            rate_limits=["3 per hour", "2 per minute"], strategy=strategy
+        ),
+    )
+    resources_manager = ResourcesManager()
+    await resources_manager.add(r1)
+
+    # The minute limit allows a burst of two requests.
+    for _ in range(2):
+        async with await resources_manager.acquire("R", wait=False):
+            pass
+    with pytest.raises(ResourceUnavailable):
+        await resources_manager.acquire("R", wait=False)
+
+    # The resource comes back once the next request is allowed.
+    await asyncio.sleep(31)
+    async with await resources_manager.acquire("R", wait=False):
+        pass
+
+    # The hour limit is then exhausted, a request is allowed every 20 minutes.
+    time_start = time.time()
+    async with await resources_manager.acquire("R", wait=True):
+        pass
+    assert round(time.time() - time_start) == 1169
+    with pytest.raises(ResourceUnavailable):
+        await resources_manager.acquire("R", wait=False)
+    await asyncio.sleep(1201)
+    await resources_manager.acquire("R", wait=False)
+
+
+@pytest.mark.asyncio
+async def test_resources_manager_delayed_releases(
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+) -> None:
+    resources_manager = ResourcesManager()
+    for i in range(100):
+        await resources_manager.add(
+            ResourceData(name=f"r{i}", type="R", data={}, default_delay=1 + i % 2)
+        )
+    await resources_manager.add(ResourceData(name="s1", type="S", data={}))
+
+    for _ in range(100):
+        async with await resources_manager.acquire("R", wait=False):
+            pass
+    resource = await resources_manager.acquire("S", wait=False)
+    resource.release_later(time.time() + 3)
+    await resource.release()
+
+    # Releases are scheduled without a task per resource.
+    assert len(asyncio.all_tasks()) == 1
+    assert resources_manager.cooling_down() == 101
+    assert resources_manager.cooling_down("R") == 100
+    metrics_capture.assert_metric_expected(
+        "datalineup.resources.cooling_down",
+        [
+            metrics_capture.create_number_data_point(100, {"type": "R"}),
+            metrics_capture.create_number_data_point(1, {"type": "S"}),
+        ],
+    )
+
+    await asyncio.sleep(1.5)
+    assert resources_manager.cooling_down("R") == 50
+    assert len(resources_manager.resources["R"].availables) == 50
+
+    await asyncio.sleep(1)
+    assert resources_manager.cooling_down() == 1
+    with pytest.raises(ResourceUnavailable):
+        await resources_manager.acquire("S", wait=False)
+
+    await asyncio.sleep(1)
+    assert resources_manager.cooling_down() == 0
+    await resources_manager.acquire("S", wait=False)
+
+
+@pytest.mark.asyncio
+async def test_resources_manager_keyed_pools(
+    running_event_loop: TimeForwardLoop,
+    metrics_capture: MetricsCapture,
+) -> None:
+    resources_manager = ResourcesManager()
+    resources_manager.add_keyed_pool(
+        "Host",
+        KeyedPoolOptions(concurrency=2, rate_limits=["1 per second"], max_keys=2),
+    )
+
+    # Each key gets its own pool of `concurrency` resources. The rate limits
+    # are shared by the resources of a key, which are all unavailable until
+    # the limit allows another acquisition.
+    first = await resources_manager.acquire("Host/a", wait=False)
+    assert first.resource and first.resource.data == {"key": "a"}
+    with pytest.raises(ResourceUnavailable):
+        await resources_manager.acquire("Host/a", wait=False)
+    assert not resources_manager.available(["Host/a"])
+    await asyncio.sleep(1)
+    second = await resources_manager.acquire("Host/a", wait=False)
+    await asyncio.sleep(1)
+    with pytest.raises(ResourceUnavailable):
+        await resources_manager.acquire("Host/a", wait=False)
+    await first.release()
+    await second.release()
+
+    # Uses are spaced by the limit whatever the concurrency.
+    async def use() -> float:
+        async with await resources_manager.acquire("Host/a", wait=True):
+            return time.time()
+
+    time_start = time.time()
+    started_at = await asyncio.gather(*(use() for _ in range(4)))
+    assert [round(t - time_start, 1) for t in started_at] == [0, 1, 2, 3]
+
+    # Least recently used idle keys are evicted, keys in use are kept.
+    await asyncio.sleep(2)
+    async with await resources_manager.acquire("Host/a", wait=False):
+        async with await resources_manager.acquire("Host/b", wait=False):
+            pass
+        await asyncio.sleep(2)
+        async with await resources_manager.acquire("Host/c", wait=False):
+            pass
+        assert set(resources_manager.resources) == {"Host/a", "Host/c"}
+
+    # Both resources of the last used key cool down from its rate limit.
+    metrics_capture.assert_metric_expected(
+        "datalineup.resources.cooling_down",
+        [metrics_capture.create_number_data_point(2, {"type": "Host"})],
+    )
+
+
+@pytest.mark.asyncio
+async def test_resources_manager_keyed_pools_keep_acquired_key(
+    running_event_loop: TimeForwardLoop,
+) -> None:
+    resources_manager = ResourcesManager()
+    resources_manager.add_keyed_pool("Host", KeyedPoolOptions(max_keys=1))
+
+    # The key being acquired is kept past the limit, with its concurrency.
+    async with await resources_manager.acquire("Host/a", wait=False):
+        async with await resources_manager.acquire("Host/c.com", wait=False):
+            with pytest.raises(ResourceUnavailable):
+                await resources_manager.acquire("Host/c.com", wait=False)
+        assert set(resources_manager.resources) == {"Host/a", "Host/c.com"}
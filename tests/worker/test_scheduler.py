@@ -1,6 +1,7 @@
 import typing as t
 
 import asyncio
+import itertools
 from collections import Counter
 from collections.abc import AsyncGenerator
 from collections.abc import AsyncIterator
@@ -13,6 +14,9 @@ import pytest
 from datalineup_engine.utils.asyncutils import aiter2agen
 from datalineup_engine.worker.executors.scheduler import Schedulable
 from datalineup_engine.worker.executors.scheduler import Scheduler
+from datalineup_engine.worker.resources.manager import ResourceData
+from datalineup_engine.worker.resources.manager import ResourcesManager
+from tests.utils import TimeForwardLoop
 
 
 @pytest.fixture
@@ -140,3 +144,61 @@ async def test_scheduler_close_error(scheduler: Scheduler) -> None:
             raise AssertionError()
 
     close_mock.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_idle_schedulables(scheduler: Scheduler) -> None:
+    never = asyncio.Event()
+
+    async def idle() -> AsyncGenerator:
+        while True:
+            await never.wait()
+            yield sentinel.idle
+
+    for _ in range(100):
+        scheduler.add(make_schedulable(iterable=idle()))
+    scheduler.add(
+        make_schedulable(iterable=aiter2agen(alib.cycle([sentinel.schedulable1])))
+    )
+    scheduler.add(
+        make_schedulable(iterable=aiter2agen(alib.cycle([sentinel.schedulable2])))
+    )
+
+    messages: Counter[object] = Counter()
+    async with alib.scoped_iter(scheduler.run()) as generator:
+        async for item in alib.islice(generator, 10):
+            messages[item] += 1
+    assert messages == {sentinel.schedulable1: 5, sentinel.schedulable2: 5}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_resources(running_event_loop: TimeForwardLoop) -> None:
+    resources_manager = ResourcesManager()
+    scheduler: Scheduler[object] = Scheduler(resources_manager=resources_manager)
+    polled: list[int] = []
+
+    async def counter() -> AsyncGenerator:
+        for i in itertools.count():
+            polled.append(i)
+            yield i
+
+    scheduler.add(make_schedulable(iterable=counter()), resources=["R"])
+    async with alib.scoped_iter(scheduler.run()) as generator:
+        # Without the resource, the schedulable isn't polled at all.
+        async with running_event_loop.until_idle():
+            pass
+        assert polled == []
+
+        await resources_manager.add(ResourceData(name="r1", type="R", data={}))
+        assert await alib.anext(generator) == 0
+
+        # The resource is in use, the schedulable waits before polling again.
+        resource = await resources_manager.acquire("R", wait=False)
+        async with running_event_loop.until_idle():
+            pass
+        assert polled == [0]
+
+        await resource.release()
+        assert await alib.anext(generator) == 1
+        assert polled == [0, 1]
+    await scheduler.close()
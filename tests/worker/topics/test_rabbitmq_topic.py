@@ -1,6 +1,7 @@
 import typing as t
 
 import asyncio
+import logging
 from collections.abc import Awaitable
 from datetime import datetime
 from datetime import timedelta
@@ -8,6 +9,7 @@ from datetime import timedelta
 import asyncstdlib as alib
 import pytest
 from aiormq.exceptions import AMQPConnectionError
+from pytest_mock import MockerFixture
 
 from datalineup_engine.config import Config
 from datalineup_engine.core import MessageId
@@ -115,6 +117,65 @@ async def test_bounded_rabbitmq_topic_max_length(
     await topic.close()
 
 
+@pytest.mark.asyncio
+async def test_rabbitmq_topic_publish_many(
+    rabbitmq_topic_maker: t.Callable[..., Awaitable[RabbitMQTopic]]
+) -> None:
+    topic = await rabbitmq_topic_maker(RabbitMQTopic, max_length=2, prefetch_count=2)
+    topic.RETRY_PUBLISH_DELAY = timedelta(seconds=0.1)
+    messages = [TopicMessage(id=MessageId(str(n)), args={"n": n}) for n in range(3)]
+
+    # The message over the queue max length is nacked.
+    assert await topic.publish_many(messages, wait=False) == [True, True, False]
+
+    # While a blocking publish waits for the queue, batches aren't published.
+    publish_task = asyncio.create_task(topic.publish(messages[2], wait=True))
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(asyncio.shield(publish_task), 0.5)
+    assert await topic.publish_many(messages, wait=False) == [False] * 3
+
+    async with alib.scoped_iter(topic.run()) as topic_iter:
+        assert await unwrap(await alib.anext(topic_iter)) == messages[0]
+        assert await publish_task
+        assert await unwrap(await alib.anext(topic_iter)) == messages[1]
+        assert await unwrap(await alib.anext(topic_iter)) == messages[2]
+
+    await topic.close()
+
+
+@pytest.mark.asyncio
+async def test_rabbitmq_topic_publish_many_error(
+    rabbitmq_topic_maker: t.Callable[..., Awaitable[RabbitMQTopic]],
+    mocker: MockerFixture,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    topic = await rabbitmq_topic_maker(RabbitMQTopic)
+    messages = [TopicMessage(id=MessageId(str(n)), args={"n": n}) for n in range(2)]
+    publish_body = topic._publish_body
+
+    async def failing_publish_body(
+        exchange: t.Any, body: bytes, message: TopicMessage
+    ) -> None:
+        if message.args["n"] == 1:
+            raise RuntimeError("publish failed")
+        await publish_body(exchange, body, message)
+
+    mocker.patch.object(topic, "_publish_body", side_effect=failing_publish_body)
+
+    # Failed messages are reported as unpublished and logged.
+    with caplog.at_level(logging.ERROR):
+        assert await topic.publish_many(messages, wait=False) == [True, False]
+    assert "Failed to publish" in caplog.text
+
+    # Serialization errors are raised.
+    with pytest.raises(TypeError):
+        await topic.publish_many(
+            [TopicMessage(id=MessageId("2"), args={"n": datetime.now()})], wait=False
+        )
+
+    await topic.close()
+
+
 @pytest.mark.asyncio
 async def test_rabbitmq_topic_channel_closed(
     services_manager_maker: t.Callable[[Config], t.Awaitable[ServicesManager]],
@@ -221,6 +221,42 @@ def test_api_lock_with_resources(
     assert resp.json["resources"][0]["name"] == "test"
 
 
+def test_api_lock_with_keyed_resources(
+    client: FlaskClient,
+    session: Session,
+    frozen_time: FreezeTime,
+    queue_item_maker: Callable[..., api.QueueItem],
+    static_definitions: StaticDefinitions,
+    fake_job_definition: api.JobDefinition,
+) -> None:
+    queue_item = queue_item_maker()
+    queue_item.pipeline.info.resources["host"] = "TestHost[url:host]"
+    queues_store.create_queue(session=session, name="test")
+    jobs_store.create_job(
+        session=session,
+        name="test",
+        queue_name="test",
+        job_definition_name=fake_job_definition.name,
+    )
+    session.commit()
+
+    # Keyed resources are provided by the provider of their type.
+    provider = api.ResourcesProviderItem(
+        name="test-provider",
+        type="KeyedResourcesProvider",
+        resource_type="TestHost",
+        options={"concurrency": 2},
+    )
+    static_definitions.resources_providers["test-provider"] = provider
+    static_definitions.resources_by_type["TestHost"] = [provider]
+
+    resp = client.post("/api/lock", json={"worker_id": "worker-1"})
+    assert resp.status_code == 200
+    assert resp.json
+    assert resp.json["items"][0]["name"] == "test"
+    assert resp.json["resources_providers"][0]["name"] == "test-provider"
+
+
 def test_ignore_bad_jobs(
     client: FlaskClient,
     session: Session,